@@ -43,6 +43,7 @@ import time
 
 import insanity.dbustools as dbustools
 from insanity.testrun import TestRun
+from insanity.scheduler import SlotScheduler
 from insanity.scenario import Scenario
 from insanity.log import warning, debug, info, exception, initLogging
 
@@ -72,8 +73,23 @@ class TesterClient(dbus.service.Object):
     Subclasses of TesterClient need to put the name of their software in __software_name__
     """
 
-    def __init__(self, singlerun=False, storage=None,
+    def __init__(self, singlerun=False, storage=None, maxruns=1,
+                 maxslots=None, maxload=None, minmemory=None, isolation=None,
                  *args, **kwargs):
+        """
+        singlerun : if True, the client quits once all testruns are done
+        storage : the DataStorage to use (default : SQLiteStorage)
+        maxruns : maximum number of TestRuns running at the same time
+        maxslots : maximum total cost of the tests running at the same
+        time over all the TestRuns, shared fairly between them (default :
+        no limit besides the maxnbtests of each TestRun)
+        maxload : fraction (from 0.0 to 1.0) of the CPU time the tests may
+        use before no new test is started (default : no limit)
+        minmemory : available memory (in kB) needed to start a test of
+        cost 1 (default : no limit)
+        isolation : the IsolationProfile shared by all the TestRuns
+        (default : none)
+        """
         dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
         info("starting")
         self._ml = gobject.MainLoop()
@@ -86,8 +102,12 @@ class TesterClient(dbus.service.Object):
         self._clientid = None
         if storage:
             self.setStorage(storage)
-        # _current is the current TestRun being executed
-        self._current = None
+        # _currents are the TestRuns being executed
+        self._currents = []
+        self._maxruns = maxruns
+        # shares the test slots between the running TestRuns
+        self._scheduler = SlotScheduler(maxslots, maxload, minmemory)
+        self._isolation = isolation
         # _running is True if the mainloop is running
         self._running = False
         # If _singlerun == True, the client will quit after
@@ -114,14 +134,23 @@ class TesterClient(dbus.service.Object):
             return
         self._running = False
         try:
-            if self._current:
-                self._current.abort()
+            self._abortCurrents()
         finally:
             try:
                 self._storage.close(self._exit)
             except:
                 self._exit()
 
+    def _abortCurrents(self):
+        for current in self._currents[:]:
+            current.abort()
+
+    def getCurrentTestRuns(self):
+        """
+        Returns the list of TestRuns being executed
+        """
+        return self._currents[:]
+
     def _exit(self):
         debug("Really quitting")
         try:
@@ -172,31 +201,37 @@ class TesterClient(dbus.service.Object):
 
     def _runNext(self):
         """
-        Run next testrun if available
+        Run next testruns if available
         """
         if not self._running:
             warning("Not running")
             return False
-        if self._current:
-            warning("Already running a TestRun [%s]" % self._current)
+        if len(self._currents) >= self._maxruns:
+            debug("Already running %d TestRun(s)", len(self._currents))
             return False
         if self._testruns == []:
             debug("No more TestRun(s) available")
-            if self._singlerun:
+            if self._singlerun and self._currents == []:
                 debug("Single-Run mode, now exiting")
                 self.quit()
             return False
-        self._current = self._testruns.pop(0)
-        debug("Current testrun is now %s" % self._current)
-        # connect signals
-        self._current.connect("start", self._currentStartCb)
-        self._current.connect("done", self._currentDoneCb)
-        self._current.connect("aborted", self._currentAbortedCb)
-        # give access to the data storage object
-        self._current.setStorage(self._storage)
-        self._current._clientid = self._clientid
-        # and run it!
-        self._current.run()
+        while self._testruns and len(self._currents) < self._maxruns:
+            current = self._testruns.pop(0)
+            self._currents.append(current)
+            debug("Starting testrun %s" % current)
+            # connect signals
+            current.connect("start", self._currentStartCb)
+            current.connect("done", self._currentDoneCb)
+            current.connect("aborted", self._currentAbortedCb)
+            # give access to the data storage object, each testrun gets
+            # its own id in it
+            current.setStorage(self._storage)
+            current.setScheduler(self._scheduler)
+            if self._isolation:
+                current.setIsolationProfile(self._isolation)
+            current._clientid = self._clientid
+            # and run it!
+            current.run()
         return False
 
     ## TestRun callbacks
@@ -206,14 +241,14 @@ class TesterClient(dbus.service.Object):
 
     def _currentDoneCb(self, current):
         self.test_run_done(current)
-        if current == self._current:
-            self._current = None
+        if current in self._currents:
+            self._currents.remove(current)
             self._runNext()
 
     def _currentAbortedCb(self, current):
         self.test_run_aborted(current)
-        if current == self._current:
-            self._current = None
+        if current in self._currents:
+            self._currents.remove(current)
             self._runNext()
 
     ## methods for giving test instructions
@@ -338,12 +373,14 @@ class CommandLineTesterClient(TesterClient):
                 print stub, "  %s : %s\t\t%s" % (arg, fa[arg], ta[arg])
             # print results from test
             print stub, "Results"
-            tc = test.getIterationCheckList(1) # TODO! iterations
+            # the latest iteration is kept until the next one starts
+            iteration = test.getIteration()
+            tc = test.getIterationCheckList(iteration)
             fc = test.getFullCheckList()
             for step,val in tc:
                 print stub, "  %30s:%10s\t\t%s" % (step, val, fc[step])
 
-            infos = test.getIterationExtraInfo(1) # TODO! iterations
+            infos = test.getIterationExtraInfo(iteration)
             if infos:
                 print stub, "Extra information:"
             for extra in infos:
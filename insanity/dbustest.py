@@ -32,6 +32,7 @@ from insanity.threads import RedirectTerminalOuputThread
 from insanity.test import Test
 from insanity.dbustools import unwrap
 from insanity.log import error, warning, debug, info, exception
+from insanity.isolation import format_cpu_list
 import insanity.utils as utils
 import gobject
 
@@ -66,6 +67,9 @@ class DBusTest(Test, dbus.service.Object):
     __test_extra_infos__ = {
     "subprocess-return-code":"The exit value returned by the subprocess",
     "subprocess-spawn-time":"How long it took to spawn the subprocess (in milliseconds)",
+    "subprocess-cpu-time":"CPU time used by the subprocess (in milliseconds)",
+    "subprocess-max-rss":"Maximum resident memory of the subprocess (in kB)",
+    "subprocess-cpu-set":"List of the CPUs the subprocess was pinned to (ex: 0-1,4)",
     "cpu-load": "CPU load in percent (can exceed 100% on multi core systems)" # TODO: move to C
     }
 
@@ -83,31 +87,8 @@ class DBusTest(Test, dbus.service.Object):
     ## Needed for dbus
     __metaclass__ = dbus.gobject_service.ExportedGObjectType
 
-    def _parse_test_arguments(self, test_arguments):
-        parsed_arguments = {}
-        metadata_arguments = self.getFullArgumentList()
-
-        for (k, v) in test_arguments.items():
-            if not k in metadata_arguments:
-                continue
-            t = metadata_arguments[k]["type"]
-
-            if t == "i":
-                parsed_arguments[k] = dbus.Int32(int(v))
-            elif t == "I":
-                parsed_arguments[k] = dbus.Int64(int(v))
-            elif t == "u":
-                parsed_arguments[k] = dbus.UInt32(int(v))
-            elif t == "U":
-                parsed_arguments[k] = dbus.UInt64(int(v))
-            elif t == "s":
-                parsed_arguments[k] = v
-            elif t == "d":
-                parsed_arguments[k] = float(v)
-            elif t == "b":
-                parsed_arguments[k] = (v == "True" or v == "true" or v == "TRUE" or v == "1")
-
-        return parsed_arguments
+    def _parse_test_arguments(self, test_arguments, onlyglobal=False):
+        return self.getSchema().convertArguments(test_arguments, onlyglobal)
 
     def __init__(self, bus=None, bus_address="", metadata = None,
                  test_arguments = None, env=None, *args, **kwargs):
@@ -153,6 +134,9 @@ class DBusTest(Test, dbus.service.Object):
         self._environ.update(os.environ.copy())
         self._subprocessspawntime = 0
         self._subprocessconnecttime = 0
+        self._subprocessstoptime = 0
+        self._subprocessrusage = None
+        self._isolation = None
         self._pid = 0
 
     # Test class overrides
@@ -172,6 +156,7 @@ class DBusTest(Test, dbus.service.Object):
 
         cwd = self._testrun.getWorkingDirectory()
 
+        self._environ.update(self._testrun.getTestEnvironmentVariables())
         self._environ["PRIVATE_DBUS_ADDRESS"] = self._bus_address
         info("Setting PRIVATE_DBUS_ADDRESS : %r" % self._bus_address)
         info("bus:%r" % self._bus)
@@ -182,6 +167,15 @@ class DBusTest(Test, dbus.service.Object):
             print("Setting PRIVATE_DBUS_ADDRESS : %r" % self._bus_address)
             time.sleep(5)
 
+        # pin the other process to its cpus
+        preexec = None
+        self._isolation = self._testrun.getIsolationProfile()
+        if self._isolation:
+            cpus = self._isolation.acquireCPUs(self)
+            if cpus:
+                self.extraInfo("subprocess-cpu-set", format_cpu_list(cpus))
+            preexec = self._isolation.getPreExecFunction(cpus)
+
         # spawn the other process
         info("opening %r" % pargs)
         info("cwd %s" % cwd)
@@ -193,12 +187,16 @@ class DBusTest(Test, dbus.service.Object):
                                              stderr = subprocess.PIPE,
                                              env=self._environ,
                                              shell = shell,
-                                             cwd=cwd)
+                                             cwd=cwd,
+                                             preexec_fn=preexec)
 
             self._ensureOutRedirection()
             self._pid = self._process.pid
         except:
             exception("Error starting the subprocess command ! %r", pargs)
+            if self._isolation:
+                self._isolation.releaseCPUs(self)
+                self._isolation = None
             self.validateChecklistItem("dbus-process-spawned", False)
             return False
         debug("Subprocess created successfully [pid:%d]", self._pid)
@@ -233,6 +231,9 @@ class DBusTest(Test, dbus.service.Object):
             if self._processpollid:
                 gobject.source_remove(self._processpollid)
                 self._processpollid = 0
+            if self._isolation:
+                self._isolation.releaseCPUs(self)
+                self._isolation = None
             if self._process:
                 # double check it hasn't actually exited
                 # give the test up to one second to exit
@@ -245,6 +246,11 @@ class DBusTest(Test, dbus.service.Object):
             if not self._returncode is None:
                 info("Process returned %d", self._returncode)
                 self.extraInfo("subprocess-return-code", self._returncode)
+            if self._subprocessrusage is not None:
+                rusage = self._subprocessrusage
+                self.extraInfo("subprocess-cpu-time",
+                               int((rusage.ru_utime + rusage.ru_stime) * 1000))
+                self.extraInfo("subprocess-max-rss", rusage.ru_maxrss)
 
             self.validateChecklistItem("subprocess-exited-normally", self._returncode == 0)
 
@@ -268,6 +274,21 @@ class DBusTest(Test, dbus.service.Object):
     def ping(self):
         Test.ping(self)
 
+    def getSubprocessUsage(self):
+        """
+        Returns the resources used by the subprocess as a tuple of:
+        * the time it ran (in seconds)
+        * the CPU time it used (in seconds)
+        * its maximum resident memory (in kB)
+
+        Returns None if the subprocess didn't exit by itself.
+        """
+        if self._subprocessrusage is None:
+            return None
+        rusage = self._subprocessrusage
+        return (self._subprocessstoptime - self._subprocessspawntime,
+                rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss)
+
     def get_remote_launcher_args(self):
         """
         Subclasses should return the name and arguments of the remote
@@ -282,7 +303,7 @@ class DBusTest(Test, dbus.service.Object):
         if not self._process:
             info("process left, stopping looping")
             return False
-        res = self._process.poll()
+        res = self._waitSubProcess()
         # None means the process hasn't terminated yet
         if res == None:
             info("process hasn't stopped yet")
@@ -300,6 +321,24 @@ class DBusTest(Test, dbus.service.Object):
         self.stop()
         return False
 
+    def _waitSubProcess(self):
+        # like Popen.poll(), but also collects the resources used
+        try:
+            pid, status, rusage = os.wait4(self._process.pid, os.WNOHANG)
+        except OSError:
+            return self._process.poll()
+        if pid == 0:
+            return None
+        if os.WIFSIGNALED(status):
+            res = -os.WTERMSIG(status)
+        else:
+            res = os.WEXITSTATUS(status)
+        # the process is reaped, Popen can't wait for it anymore
+        self._process.returncode = res
+        self._subprocessstoptime = time.time()
+        self._subprocessrusage = rusage
+        return res
+
 
     ## void handlers for remote DBUS calls
     def _voidRemoteCallBackHandler(self):
@@ -381,8 +420,7 @@ class DBusTest(Test, dbus.service.Object):
         if not self._remoteinstance:
             return
 
-        args = dict((k, v) for k, v in self.args.items() if (k in self.getFullArgumentList() and self.getFullArgumentList()[k]["global"] == True))
-        args = self._parse_test_arguments(args)
+        args = self._parse_test_arguments(self.args, onlyglobal=True)
 
         debug("Setting up remote with argunents %s outputfiles %s", args, self.getOutputFiles())
         self._remoteinstance.remoteSetUp(args, self.getOutputFiles(),
@@ -494,6 +532,9 @@ class DBusTest(Test, dbus.service.Object):
         if not self._stopping:
             self.stop()
 
+    def getSchema(self):
+        return self._metadata.getSchema()
+
     def getFullCheckList(self):
         return self._metadata.getFullCheckList()
 
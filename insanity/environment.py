@@ -31,9 +31,20 @@ import os
 import tempfile
 import sys
 import imp
+import time
+import stat
 import gobject
 gobject.threads_init()
-from insanity.log import debug, exception
+from insanity.log import debug, info, warning, exception
+
+GST_REGISTRIES = [
+    ("1.0", "GST_REGISTRY_1_0", ["gst-inspect-1.0"]),
+    ("0.10", "GST_REGISTRY", ["gst-inspect-0.10", "gst-inspect"])
+    ]
+"""
+For each GStreamer version, the environment variable giving the path of
+its registry, and the commands tried in turn to build it
+"""
 
 def _tupletostr(atup):
     return ".".join([str(x) for x in atup])
@@ -93,6 +104,76 @@ def collectEnvironment(environ, callback):
     else:
         gobject.timeout_add(500, _pollSubProcess, proc, respath, callback)
 
+def _pollRegistryProcesses(processes, devnull, starttime, callback):
+    for variable, path, process in processes:
+        if process.poll() == None:
+            return True
+    devnull.close()
+    duration = int((time.time() - starttime) * 1000)
+    registries = {}
+    for variable, path, process in processes:
+        if process.returncode != 0 or not os.path.exists(path):
+            warning("Building the GStreamer registry %s failed (%r)",
+                    path, process.returncode)
+            # the versions without a registry would use the one of
+            # another version, better not share any
+            callback({}, duration)
+            return False
+        # the tests must only read it
+        os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        registries[variable] = path
+    info("GStreamer registries %r built in %dms", registries.values(), duration)
+    callback(registries, duration)
+    return False
+
+def buildRegistry(environ, directory, callback):
+    """
+    Using the given environment variables, spawn new processes to build
+    in the given directory one GStreamer registry for each GStreamer
+    version installed (see GST_REGISTRIES).
+
+    When the registries are built, the given callback will be called with
+    a dictionnary of the registry environment variable to the path of
+    each registry (empty if they couldn't be built) and the time it took
+    (in milliseconds) as arguments.
+    """
+    devnull = open(os.devnull, "w")
+    starttime = time.time()
+    processes = []
+    for version, variable, commands in GST_REGISTRIES:
+        path = os.path.join(directory, "registry-%s.bin" % version)
+        env = environ.copy()
+        env[variable] = path
+        for name in ("GST_REGISTRY_UPDATE", "GST_REGISTRY_FORK"):
+            env.pop(name, None)
+        for command in commands:
+            try:
+                debug("spawning %s", command)
+                proc = subprocess.Popen([command], env=env,
+                                        stdout=devnull, stderr=devnull)
+            except OSError:
+                continue
+            processes.append((variable, path, proc))
+            break
+    if not processes:
+        devnull.close()
+        warning("No gst-inspect found, can't build the GStreamer registry")
+        callback({}, 0)
+        return
+    gobject.timeout_add(100, _pollRegistryProcesses, processes, devnull,
+                        starttime, callback)
+
+def getRegistryVariables(registries):
+    """
+    Returns the environment variables making the GStreamer processes only
+    use the given registries (dictionnary of registry environment variable
+    to path, as given by buildRegistry), without updating them.
+    """
+    d = dict(registries)
+    d["GST_REGISTRY_UPDATE"] = "no"
+    d["GST_REGISTRY_FORK"] = "no"
+    return d
+
 def _getGObjectEnvironment():
     d = {}
     d["pygobject-path"] = gobject.__path__[0]
@@ -0,0 +1,284 @@
+# GStreamer QA system
+#
+#       isolation.py
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+"""
+Isolation of the test processes from each other (CPU pinning, nice and
+I/O priority levels)
+"""
+
+import os
+import platform
+import ctypes
+import ctypes.util
+from insanity.log import debug, warning
+
+IOPRIO_CLASSES = {
+    "realtime": 1,
+    "best-effort": 2,
+    "idle": 3
+    }
+"""
+I/O scheduling classes, as used by ionice
+"""
+
+# ioprio_set() has no wrapper in the C library
+_IOPRIO_SET_SYSCALLS = {
+    "x86_64": 251,
+    "i386": 289,
+    "i486": 289,
+    "i586": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "armv7l": 314,
+    "ppc": 273,
+    "ppc64": 273,
+    "ppc64le": 273
+    }
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+
+_libc = None
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                            use_errno=True)
+    return _libc
+
+def _raise_errno():
+    err = ctypes.get_errno()
+    raise OSError(err, os.strerror(err))
+
+def get_cpu_affinity(pid=0):
+    """
+    Returns the sorted list of CPUs the given process (default : the
+    current one) may run on.
+    """
+    nbits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    mask = (ctypes.c_ulong * (1024 / nbits))()
+    if _get_libc().sched_getaffinity(pid, ctypes.sizeof(mask), mask) < 0:
+        _raise_errno()
+    return [cpu for cpu in range(len(mask) * nbits)
+            if mask[cpu / nbits] & (1 << (cpu % nbits))]
+
+def set_cpu_affinity(cpus, pid=0):
+    """
+    Restricts the given process (default : the current one) to the given
+    list of CPUs.
+    """
+    nbits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    mask = (ctypes.c_ulong * (max(cpus) / nbits + 1))()
+    for cpu in cpus:
+        mask[cpu / nbits] |= 1 << (cpu % nbits)
+    if _get_libc().sched_setaffinity(pid, ctypes.sizeof(mask), mask) < 0:
+        _raise_errno()
+
+def set_io_priority(ioclass, level=0, pid=0):
+    """
+    Sets the I/O scheduling class (one of IOPRIO_CLASSES) and level (from
+    0 to 7, 0 being the highest priority) of the given process (default :
+    the current one).
+    """
+    syscall = _IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if syscall is None:
+        raise OSError("ioprio_set isn't known on %s" % platform.machine())
+    ioprio = (IOPRIO_CLASSES[ioclass] << _IOPRIO_CLASS_SHIFT) | level
+    if _get_libc().syscall(syscall, _IOPRIO_WHO_PROCESS, pid, ioprio) < 0:
+        _raise_errno()
+
+def _check_in_child(func, *args):
+    """
+    Calls the given function with the given arguments in a throwaway child
+    process, so that it doesn't change the current one.
+
+    Returns None if it succeeded, else the error message.
+    """
+    # loading the C library in the child could deadlock
+    _get_libc()
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(rfd)
+            try:
+                func(*args)
+            except Exception, e:
+                os.write(wfd, str(e) or e.__class__.__name__)
+        finally:
+            os._exit(0)
+    os.close(wfd)
+    message = ""
+    try:
+        while True:
+            data = os.read(rfd, 4096)
+            if not data:
+                break
+            message += data
+    finally:
+        os.close(rfd)
+        os.waitpid(pid, 0)
+    return message or None
+
+def format_cpu_list(cpus):
+    """
+    Returns the given list of CPUs in the kernel's list format (ex: "0-3,6")
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join([first == last and "%d" % first or "%d-%d" % (first, last)
+                     for first, last in ranges])
+
+def parse_cpu_list(value):
+    """
+    Returns the sorted list of CPUs of the given string in the kernel's
+    list format (ex: "0-3,6").
+
+    Raises ValueError if it isn't one.
+    """
+    cpus = set()
+    for item in value.split(","):
+        first, sep, last = item.strip().partition("-")
+        first = int(first)
+        last = sep and int(last) or first
+        if first < 0 or last < first:
+            raise ValueError("Invalid CPU range %r" % item)
+        cpus.update(range(first, last + 1))
+    return sorted(cpus)
+
+class IsolationProfile(object):
+    """
+    Describes how the test processes should be isolated from each other.
+
+    Each test process can be pinned to its own set of CPUs, taken from
+    the CPUs the least used by the other running test processes, and run
+    with a given nice level and I/O priority.
+
+    The same IsolationProfile can be shared by several TestRuns.
+
+    The settings are checked once, when it is created, rather than failing
+    the spawning of every test process.
+    """
+
+    def __init__(self, cpuspertest=None, cpus=None, nice=None,
+                 ioclass=None, iolevel=0):
+        """
+        cpuspertest : number of CPUs each test process is pinned to, or
+        None to not pin the test processes.
+        cpus : list of the CPUs the test processes can be pinned to
+        (default : all the CPUs the client may run on).
+        nice : niceness increment of the test processes, or None.
+        ioclass : I/O scheduling class of the test processes (one of
+        IOPRIO_CLASSES), or None to keep the default one.
+        iolevel : I/O priority level within that class (from 0 to 7).
+
+        Raises ValueError if some of the given CPUs aren't allowed. If the
+        nice level or the I/O priority can't be set here, a warning is
+        logged and the test processes keep the default ones.
+        """
+        if ioclass is not None and not ioclass in IOPRIO_CLASSES:
+            raise ValueError("Unknown I/O scheduling class %r" % ioclass)
+        self._cpuspertest = cpuspertest
+        self._nice = nice
+        self._ioclass = ioclass
+        self._iolevel = iolevel
+        if cpuspertest:
+            try:
+                allowed = get_cpu_affinity()
+            except OSError:
+                allowed = None
+            if cpus is None:
+                if allowed is None:
+                    warning("Couldn't get the CPU affinity, not pinning tests")
+                    self._cpuspertest = None
+                cpus = allowed
+            elif allowed is not None:
+                outside = set(cpus).difference(allowed)
+                if outside:
+                    raise ValueError("CPUs %s are not allowed (allowed: %s)" %
+                                     (format_cpu_list(outside),
+                                      format_cpu_list(allowed)))
+        if nice:
+            err = _check_in_child(os.nice, nice)
+            if err:
+                warning("Can't set the nice level of the test processes "
+                        "(%s), keeping the default one", err)
+                self._nice = None
+        if ioclass is not None:
+            err = _check_in_child(set_io_priority, ioclass, iolevel)
+            if err:
+                warning("Can't set the I/O priority of the test processes "
+                        "(%s), keeping the default one", err)
+                self._ioclass = None
+        # key : cpu, value : number of test processes pinned to it
+        self._cpuusers = dict([(cpu, 0) for cpu in cpus or []])
+        # key : test, value : list of cpus assigned to it
+        self._assigned = {}
+
+    def acquireCPUs(self, test):
+        """
+        Returns the sorted list of CPUs assigned to the given test, or
+        None if the test processes aren't pinned.
+        """
+        if not self._cpuspertest:
+            return None
+        if test in self._assigned:
+            return self._assigned[test]
+        # the least used cpus, the lowest first to keep them contiguous
+        cpus = sorted(self._cpuusers,
+                      key=lambda cpu: (self._cpuusers[cpu], cpu))
+        cpus = sorted(cpus[:self._cpuspertest])
+        for cpu in cpus:
+            self._cpuusers[cpu] += 1
+        self._assigned[test] = cpus
+        debug("test %r gets cpus %s", test, format_cpu_list(cpus))
+        return cpus
+
+    def releaseCPUs(self, test):
+        """
+        Gives back the CPUs assigned to the given test.
+        """
+        for cpu in self._assigned.pop(test, []):
+            self._cpuusers[cpu] -= 1
+
+    def getPreExecFunction(self, cpus=None):
+        """
+        Returns the function to call in a test process before executing
+        it, pinning it to the given list of CPUs if any, or None if there
+        is nothing to do.
+        """
+        if not cpus and self._nice is None and self._ioclass is None:
+            return None
+        nice = self._nice
+        ioclass = self._ioclass
+        iolevel = self._iolevel
+        def preexec():
+            # runs in the child process, errors make the spawning fail
+            # (the settings were checked when creating the profile)
+            if cpus:
+                set_cpu_affinity(cpus)
+            if nice:
+                os.nice(nice)
+            if ioclass is not None:
+                set_io_priority(ioclass, iolevel)
+        return preexec
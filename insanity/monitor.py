@@ -44,7 +44,10 @@ information, run extra analysis, etc...
 # * can modify timeout (i.e. with valgrind)
 
 import os
+import re
 import subprocess
+import hashlib
+import weakref
 from insanity.test import Test, DBusTest
 from insanity.log import warning, debug, info, exception
 from insanity.utils import compress_file
@@ -98,6 +101,12 @@ class Monitor(object):
     Class of Test this monitor can be applied on.
     """
 
+    __monitor_cost__ = 1.0
+    """
+    Factor by which the monitor multiplies the cost (CPU and memory
+    usage) of the test it applies on, used to schedule tests.
+    """
+
     def __init__(self, testrun, instance, **kwargs):
         self.testrun = testrun
         self.test = instance
@@ -268,6 +277,14 @@ class Monitor(object):
 
     ## Class methods
 
+    @classmethod
+    def getCost(cls):
+        """
+        Returns the factor by which the monitor multiplies the cost of
+        the tests.
+        """
+        return cls.__monitor_cost__
+
     @classmethod
     def getFullCheckList(cls):
         """
@@ -337,9 +354,12 @@ class ValgrindMemCheckMonitor(Monitor):
 
     __applies_on__ = DBusTest
 
+    __monitor_cost__ = 10.0
+
     def setUp(self):
         Monitor.setUp(self)
-        self._logfile, self._logfilepath = self.testrun.get_temp_file(nameid="valgrind-memcheck")
+        self._logfile, self._logfilepath = self.testrun.get_temp_file(nameid="valgrind-memcheck",
+                                                                      test=self.test)
         # prepend valgrind options
         ourargs = ["valgrind", "--tool=memcheck",
                    "--leak-check=full", "--trace-children=yes",
@@ -403,15 +423,26 @@ class GDBMonitor(Monitor):
     """
     __monitor_arguments__ = {
         "save-core-dumps":"Save core dump files (default: False)",
+        "core-dumps-budget":"Maximum size in MB of the compressed core dumps saved by a testrun (default: 1024)",
         "generate-back-traces":"Generate back traces from core dumps (default True)",
         "gdb-script":"Script to use to generate gdb backtraces (default : gdb.instructions"
         }
     __monitor_output_files__ = {
-        "core-dump":"The core dump file",
+        "core-dump":"The gzip-compressed core dump file",
         "backtrace-file":"The backtrace file"
         }
+    __monitor_extra_infos__ = {
+        "crash-signature":"Identifier of the crash, computed from the top of its backtrace"
+        }
     __applies_on__ = DBusTest
 
+    # number of backtrace frames identifying a crash
+    SIGNATURE_FRAMES = 5
+
+    # key : testrun, value : dictionnary of the crash signatures of the
+    # core dumps saved for that testrun and of their total size
+    _savedcores = weakref.WeakKeyDictionary()
+
     # doesn't need to do any redirections
     # setup 'ulimit -c unlimited'
     # when the test is done, check whether it crashed, if so:
@@ -421,6 +452,7 @@ class GDBMonitor(Monitor):
     def setUp(self):
         Monitor.setUp(self)
         self._saveCoreDumps = self.arguments.get("save-core-dumps", False)
+        self._coreDumpsBudget = int(self.arguments.get("core-dumps-budget", 1024)) * 1024 * 1024
         self._generateBackTraces = self.arguments.get("generate-back-traces", True)
         self._GDBScript = self.arguments.get("gdb-script", "gdb.instructions")
         # add some env variables
@@ -445,9 +477,11 @@ class GDBMonitor(Monitor):
             core = self._findCoreFile()
             if core:
                 debug("Got core file %s", core)
+                backtracepath = None
                 if self._generateBackTraces:
                     # output file for backtrace
-                    backtracefd, backtracepath = self.testrun.get_temp_file(nameid="gdb-back-trace")
+                    backtracefd, backtracepath = self.testrun.get_temp_file(nameid="gdb-back-trace",
+                                                                            test=self.test)
                     backtracefile = open(backtracepath, "a+")
 
                     # run the backtrace script
@@ -464,32 +498,85 @@ class GDBMonitor(Monitor):
 
                     # notify of backtrace file
                     self.setOutputFile("backtrace-file", backtracepath)
-                if self._saveCoreDumps:
-                    # copy over the core dump
-                    corefd, corepath = self.testrun.get_temp_file(nameid="core-dump")
-                    # copy core dump to that file
-                    # FIXME : THIS MIGHT NOT WORK ON WINDOWS (see os.rename docs)
-                    try:
-                        os.rename(core, corepath)
-                        self.setOutputFile("core-dump", corepath)
-                    except:
-                        exception("Couldn't rename core dump file !!!")
-                        os.remove(core)
-                    finally:
-                        os.close(corefd)
-                else:
+                signature = self._getCrashSignature(backtracepath)
+                self.extraInfo("crash-signature", signature)
+                try:
+                    if self._saveCoreDumps:
+                        self._saveCoreFile(core, signature)
+                finally:
                     os.remove(core)
 
     def _findCoreFile(self):
+        # core_uses_pid gives core.<pid>, else it can only be ours if it
+        # is the only test running
         cwd = self.testrun.getWorkingDirectory()
-        files = os.listdir(cwd)
-        debug("files : %r", files)
-        for fname in files:
-            if fname == "core":
-                return os.path.join(cwd, fname)
-            if fname == "core.%d" % self.test._pid:
-                return os.path.join(cwd, fname)
-        return None
+        path = os.path.join(cwd, "core.%d" % self.test._pid)
+        if os.path.isfile(path):
+            return path
+        path = os.path.join(cwd, "core")
+        if not os.path.isfile(path):
+            return None
+        if self.testrun.getNbRunningTests() > 1:
+            info("Not using %s, it could come from another running test "
+                 "(enable kernel.core_uses_pid to get core.<pid> files)",
+                 path)
+            return None
+        return path
+
+    def _getCrashSignature(self, backtracepath):
+        """
+        Returns an identifier of the crash, computed from the test, the
+        signal that killed it and the functions at the top of the
+        backtrace if any.
+        """
+        frames = []
+        if backtracepath:
+            framere = re.compile(r"^#\d+\s+(?:0x[0-9a-fA-F]+ in )?(\S+)")
+            f = open(backtracepath)
+            try:
+                for line in f:
+                    match = framere.match(line)
+                    if match:
+                        frames.append(match.group(1))
+                        if len(frames) == self.SIGNATURE_FRAMES:
+                            break
+            finally:
+                f.close()
+        key = "\n".join([self.test._metadata.__test_name__,
+                          str(self.test._returncode)] + frames)
+        return hashlib.sha1(key).hexdigest()
+
+    def _saveCoreFile(self, core, signature):
+        """
+        Compresses the given core dump into the output files, unless a
+        core dump of the same crash was already saved in the testrun or
+        its budget for core dumps is exhausted.
+        """
+        saved = self._savedcores.setdefault(self.testrun,
+                                            {"signatures": set(), "size": 0})
+        if signature in saved["signatures"]:
+            debug("core dump of crash %s already saved", signature)
+            return
+        remaining = self._coreDumpsBudget - saved["size"]
+        if remaining <= 0:
+            warning("core dumps budget exhausted, not saving %s", core)
+            return
+        corefd, corepath = self.testrun.get_temp_file(nameid="core-dump",
+                                                      suffix=".gz",
+                                                      test=self.test)
+        os.close(corefd)
+        try:
+            if not compress_file(core, corepath, remaining, 1024 * 1024):
+                warning("core dump %s doesn't fit in the core dumps budget", core)
+                return
+        except:
+            exception("Couldn't compress core dump file !!!")
+            if os.path.exists(corepath):
+                os.remove(corepath)
+            return
+        saved["signatures"].add(signature)
+        saved["size"] += os.path.getsize(corepath)
+        self.setOutputFile("core-dump", corepath)
 
 class TerminalRedirectionMonitor(Monitor):
     """
@@ -543,9 +630,10 @@ class TerminalRedirectionMonitor(Monitor):
             nameid = "global-" + nameid
 
         if category:
-            return self.testrun.get_temp_file(nameid=nameid, category=category)
+            return self.testrun.get_temp_file(nameid=nameid, category=category,
+                                              test=self.test)
         else:
-            return self.testrun.get_temp_file(nameid=nameid)
+            return self.testrun.get_temp_file(nameid=nameid, test=self.test)
 
     def _start(self, glob):
         desc = self.arguments.get("desc")
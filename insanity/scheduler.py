@@ -0,0 +1,330 @@
+# GStreamer QA system
+#
+#       scheduler.py
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+"""
+Sharing of the test slots between concurrent TestRuns
+"""
+
+import os
+import time
+import gobject
+from insanity.log import debug, info
+
+LOAD_POLL_INTERVAL = 1000
+"""
+Interval (in milliseconds) between two load measures while tests are
+waiting for the machine to be less loaded.
+"""
+
+COST_HISTORY_WEIGHT = 0.5
+"""
+Weight of the previously learned cost of a test when averaging it with
+the cost measured on its latest run.
+"""
+
+MIN_TEST_COST = 0.1
+"""
+Lowest cost a test can be given, so that idle tests still count.
+"""
+
+class SystemLoad(object):
+    """
+    Live CPU and memory usage of the machine, read from /proc
+
+    All values are None when they can't be read.
+    """
+
+    def __init__(self, procdir="/proc"):
+        self._procdir = procdir
+        self._nbcpus = self._readCPUCount()
+        self._lastcputimes = self._readCPUTimes()
+
+    def _readProcFile(self, name):
+        try:
+            f = open(os.path.join(self._procdir, name))
+        except IOError:
+            return []
+        try:
+            return f.readlines()
+        finally:
+            f.close()
+
+    def _readCPUCount(self):
+        nbcpus = len([line for line in self._readProcFile("stat")
+                      if line.startswith("cpu") and line[3].isdigit()])
+        return nbcpus or 1
+
+    def _readCPUTimes(self):
+        for line in self._readProcFile("stat"):
+            if line.startswith("cpu "):
+                values = [int(x) for x in line.split()[1:]]
+                # idle and iowait
+                return sum(values), sum(values[3:5])
+        return None
+
+    def getCPUCount(self):
+        """
+        Returns the number of CPUs of the machine
+        """
+        return self._nbcpus
+
+    def getCPUUsage(self):
+        """
+        Returns the fraction (from 0.0 to 1.0) of the total CPU time that
+        was used since the previous call.
+        """
+        previous = self._lastcputimes
+        current = self._lastcputimes = self._readCPUTimes()
+        if previous is None or current is None:
+            return None
+        total = current[0] - previous[0]
+        if total <= 0:
+            return None
+        return 1.0 - float(current[1] - previous[1]) / total
+
+    def getAvailableMemory(self):
+        """
+        Returns the memory (in kB) available for new processes.
+        """
+        meminfo = {}
+        for line in self._readProcFile("meminfo"):
+            fields = line.split()
+            if len(fields) >= 2:
+                meminfo[fields[0].rstrip(":")] = int(fields[1])
+        if "MemAvailable" in meminfo:
+            return meminfo["MemAvailable"]
+        # kernels older than 3.14
+        if "MemFree" in meminfo:
+            return (meminfo["MemFree"] + meminfo.get("Buffers", 0) +
+                    meminfo.get("Cached", 0))
+        return None
+
+class SlotScheduler(object):
+    """
+    Hands out test slots to the TestRuns of a TesterClient.
+
+    A TestRun needs slots for each test it runs (on top of its own
+    maxnbtests limit): as many as the cost of the test, a test of cost 1
+    being a test using one CPU. When there aren't enough free slots, the
+    TestRun waits and gets the next freed slots if it is the waiting
+    TestRun running the fewest tests, so that all TestRuns progress at
+    the same pace.
+
+    If maxload or minmemory are given, tests are also only started while
+    the machine has enough CPU time and memory left for them, as read
+    from /proc. Since a test takes some time to load the machine, the
+    load is measured again after each test started before starting the
+    next one. A test is always started if no other test is running.
+
+    The scheduler also learns the cost of each kind of test from the
+    resources its previous runs used (see learnCost).
+
+    All methods must be called from the main loop.
+    """
+
+    def __init__(self, maxslots=None, maxload=None, minmemory=None,
+                 systemload=None):
+        """
+        maxslots : total cost of the tests running at the same time, or
+        None for no limit.
+        maxload : fraction (from 0.0 to 1.0) of the CPU time the running
+        tests may use, or None for no limit.
+        minmemory : available memory (in kB) needed to start a test of
+        cost 1, or None for no limit. A test of cost N needs N times that.
+        systemload : the SystemLoad to read the load from (default : a
+        SystemLoad on /proc).
+        """
+        self._maxslots = maxslots
+        self._maxload = maxload
+        self._minmemory = minmemory
+        self._systemload = None
+        if maxload is not None or minmemory is not None:
+            self._systemload = systemload or SystemLoad()
+        # key : testrun, value : total cost of its running tests
+        self._used = {}
+        # key : testrun, value : number of running tests
+        self._nbtests = {}
+        # testruns waiting for slots, in arrival order
+        self._waiting = []
+        # key : testrun, value : cost of the test it waits to start
+        self._pending = {}
+        # key : test kind (see learnCost), value : learned cost
+        self._costs = {}
+        self._pollid = 0
+        # time of the latest test start, and start time of the window
+        # of the latest CPU usage measure
+        self._admissiontime = 0
+        self._measuretime = 0
+        self._cpuusage = None
+        self._cpuusagetime = 0
+
+    def getMaxSlots(self):
+        return self._maxslots
+
+    def getMaxLoad(self):
+        return self._maxload
+
+    def getMinMemory(self):
+        return self._minmemory
+
+    def getUsedSlots(self, testrun=None):
+        """
+        Returns the number of slots used by the given testrun, or by all
+        testruns.
+        """
+        if testrun is not None:
+            return self._used.get(testrun, 0)
+        return sum(self._used.itervalues())
+
+    def getRunningTests(self, testrun=None):
+        """
+        Returns the number of tests run by the given testrun, or by all
+        testruns.
+        """
+        if testrun is not None:
+            return self._nbtests.get(testrun, 0)
+        return sum(self._nbtests.itervalues())
+
+    def getCost(self, key, default=1.0):
+        """
+        Returns the cost learned for the given kind of test, or the given
+        default cost if none was learned yet.
+        """
+        return self._costs.get(key, default)
+
+    def learnCost(self, key, cost):
+        """
+        Records the cost measured on a run of the given kind of test.
+
+        key : any hashable identifying the kind of test, usually the test
+        name along with the names of its monitors.
+        cost : the number of CPUs the test used while it was running.
+        """
+        cost = max(cost, MIN_TEST_COST)
+        if key in self._costs:
+            cost = (COST_HISTORY_WEIGHT * self._costs[key] +
+                    (1.0 - COST_HISTORY_WEIGHT) * cost)
+        debug("cost of %r : %f", key, cost)
+        self._costs[key] = cost
+
+    def acquire(self, testrun, cost=1.0):
+        """
+        Returns True if the given testrun can start a new test of the
+        given cost right away.
+
+        Else the testrun is queued, and its _slotGranted() method will be
+        called with the cost once enough slots are available for it.
+        """
+        if self._canStart(cost) and not [x for x in self._waiting
+                                         if x is not testrun and
+                                         self.getRunningTests(x) < self.getRunningTests(testrun)]:
+            self._take(testrun, cost)
+            return True
+        if not testrun in self._waiting:
+            debug("%r waiting for %f slots", testrun, cost)
+            self._waiting.append(testrun)
+        self._pending[testrun] = cost
+        if self._systemload and not self._pollid:
+            self._pollid = gobject.timeout_add(LOAD_POLL_INTERVAL, self._pollCb)
+        return False
+
+    def release(self, testrun, cost=1.0):
+        """
+        Gives back the slots acquired by the given testrun for a test of
+        the given cost.
+        """
+        nbtests = self.getRunningTests(testrun) - 1
+        if nbtests > 0:
+            self._nbtests[testrun] = nbtests
+            self._used[testrun] = self.getUsedSlots(testrun) - cost
+        else:
+            self._nbtests.pop(testrun, None)
+            self._used.pop(testrun, None)
+        self._grant()
+
+    def remove(self, testrun):
+        """
+        Forgets about the given testrun, releasing all its slots.
+        """
+        self._used.pop(testrun, None)
+        self._nbtests.pop(testrun, None)
+        self._pending.pop(testrun, None)
+        if testrun in self._waiting:
+            self._waiting.remove(testrun)
+        self._grant()
+
+    def _take(self, testrun, cost):
+        self._used[testrun] = self.getUsedSlots(testrun) + cost
+        self._nbtests[testrun] = self.getRunningTests(testrun) + 1
+        self._admissiontime = time.time()
+
+    def _canStart(self, cost):
+        if not self.getRunningTests():
+            return True
+        if self._maxslots is not None and \
+               self.getUsedSlots() + cost > self._maxslots:
+            return False
+        if self._systemload is None:
+            return True
+        self._measureLoad()
+        if self._cpuusagetime <= self._admissiontime:
+            # the latest started tests aren't accounted for yet
+            return False
+        if self._maxload is not None and self._cpuusage is not None:
+            if self._cpuusage + cost / self._systemload.getCPUCount() > self._maxload:
+                debug("CPU usage too high (%f)", self._cpuusage)
+                return False
+        if self._minmemory is not None:
+            available = self._systemload.getAvailableMemory()
+            if available is not None and available < self._minmemory * cost:
+                debug("not enough available memory (%dkB)", available)
+                return False
+        return True
+
+    def _measureLoad(self):
+        now = time.time()
+        if (now - self._measuretime) * 1000 < LOAD_POLL_INTERVAL:
+            return
+        self._cpuusage = self._systemload.getCPUUsage()
+        self._cpuusagetime = self._measuretime
+        self._measuretime = now
+
+    def _grant(self):
+        while self._waiting:
+            # the first of the testruns running the fewest tests
+            testrun = min(self._waiting, key=self.getRunningTests)
+            cost = self._pending[testrun]
+            if not self._canStart(cost):
+                break
+            self._waiting.remove(testrun)
+            del self._pending[testrun]
+            self._take(testrun, cost)
+            info("granting %f slots to %r", cost, testrun)
+            gobject.idle_add(self._grantCb, testrun, cost)
+
+    def _grantCb(self, testrun, cost):
+        testrun._slotGranted(cost)
+        return False
+
+    def _pollCb(self):
+        self._grant()
+        if self._waiting:
+            return True
+        self._pollid = 0
+        return False
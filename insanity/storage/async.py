@@ -55,10 +55,23 @@ class AsyncStorage:
     Interface for asynchronous storing Storage
     """
 
-    def __init__(self, async=True):
+    def __init__(self, async=True, maxqueue=1000, batchsize=50):
+        """
+        If async is True, write operations will be queued and processed
+        in a separate thread.
+
+        maxqueue : maximum number of pending write operations. Once reached,
+        callers will block until the queue has been drained. Set to 0 for
+        an unbounded queue.
+        batchsize : maximum number of pending write operations that will be
+        processed together (between _beginBatch() and _endBatch()).
+        """
         self._async = async
         if self._async:
-            self._actionthread = ActionQueueThread()
+            self._actionthread = ActionQueueThread(maxsize=maxqueue,
+                                                   batchsize=batchsize,
+                                                   batchstart=self._beginBatch,
+                                                   batchend=self._endBatch)
             self._actionthread.start()
 
     @property
@@ -74,3 +87,27 @@ class AsyncStorage:
         if self._async:
             self._actionthread.queueFinalAction(cb, *args, **kwargs)
 
+    def getQueueStatistics(self):
+        """
+        Returns a dictionnary of statistics about the pending write
+        operations, or None if the storage isn't asynchronous.
+
+        See ActionQueueThread.getStatistics() for the contents.
+        """
+        if self._async:
+            return self._actionthread.getStatistics()
+        return None
+
+    # methods to override in subclasses
+    def _beginBatch(self):
+        """
+        Called in the queue thread before processing a batch of actions.
+        """
+        pass
+
+    def _endBatch(self):
+        """
+        Called in the queue thread after processing a batch of actions.
+        """
+        pass
+
@@ -36,6 +36,12 @@ def _updateTables(storage, fromversion, toversion):
         __updateDatabaseFrom1To2(storage)
     if fromversion < 3:
         __updateDatabaseFrom2To3(storage)
+    if fromversion < 4:
+        __updateDatabaseFrom3To4(storage)
+    if fromversion < 5:
+        __updateDatabaseFrom4To5(storage)
+    if fromversion < 6:
+        __updateDatabaseFrom5To6(storage)
 
     # finally update the db version
     cmstr = "UPDATE version SET version=?,modificationtime=? WHERE version=?"
@@ -438,3 +444,100 @@ def __updateDatabaseFrom2To3(storage):
 
 
     print("done")
+
+def test_checklist_bitmap_3to4(storage, chunksize=10000):
+    # pack the existing test_checklist_list rows, a chunk of tests at a time
+    res = storage._FetchOne("""SELECT MAX(id) FROM test""")
+    if not res or res[0] == None:
+        return
+    maxid = res[0]
+    types = dict(storage._FetchAll("""SELECT id, type FROM testclassinfo"""))
+    columns = ["containerid", "word", "success", "failure", "skipped", "expectedfailure"]
+    for start in range(0, maxid + 1, chunksize):
+        tests = storage._FetchAll("""SELECT id, type FROM test WHERE id>=? AND id<?""",
+                                  (start, start + chunksize))
+        rows = storage._FetchAll("""SELECT test_checklist_list.containerid,
+        testclassinfo_checklist_dict.name, test_checklist_list.intvalue
+        FROM test_checklist_list, testclassinfo_checklist_dict
+        WHERE test_checklist_list.containerid>=? AND test_checklist_list.containerid<?
+        AND test_checklist_list.name=testclassinfo_checklist_dict.id""",
+                                 (start, start + chunksize))
+        checklists = {}
+        for containerid, name, value in rows:
+            checklists.setdefault(containerid, []).append((name, value))
+        bitmaps = []
+        for testid, ttype in tests:
+            if not testid in checklists or not ttype in types:
+                continue
+            bitmaps.extend([(testid, ) + x for x in
+                            storage._packCheckList(types[ttype], checklists[testid])])
+        storage._InsertMany("test_checklist_bitmap", columns, bitmaps, commit=False)
+        storage.con.commit()
+        print "Packed checklists of tests %d to %d" % (start, min(maxid, start + chunksize - 1))
+
+def __updateDatabaseFrom3To4(storage):
+    create3to4 = """
+    CREATE TABLE test_checklist_bitmap (
+       containerid INTEGER NOT NULL,
+       word INTEGER NOT NULL,
+       success BIGINT NOT NULL DEFAULT 0,
+       failure BIGINT NOT NULL DEFAULT 0,
+       skipped BIGINT NOT NULL DEFAULT 0,
+       expectedfailure BIGINT NOT NULL DEFAULT 0,
+       PRIMARY KEY (containerid, word)
+    );
+    """
+    print("Creating test_checklist_bitmap table")
+    storage._ExecuteScript(create3to4)
+    storage.con.commit()
+
+    print("Packing test_checklist_list into test_checklist_bitmap")
+    test_checklist_bitmap_3to4(storage)
+    print("done")
+
+def __updateDatabaseFrom4To5(storage):
+    create4to5 = """
+    CREATE TABLE testrun_summary (
+       testrunid INTEGER NOT NULL PRIMARY KEY,
+       nbtests INTEGER NOT NULL DEFAULT 0,
+       nbfailed INTEGER NOT NULL DEFAULT 0,
+       nbtimedout INTEGER NOT NULL DEFAULT 0,
+       nbcrashed INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE TABLE testrun_summary_failures (
+       testrunid INTEGER NOT NULL,
+       name VARCHAR(255) NOT NULL,
+       nbfailed INTEGER NOT NULL DEFAULT 0,
+       PRIMARY KEY (testrunid, name)
+    );
+    """
+    print("Creating testrun_summary tables")
+    storage._ExecuteScript(create4to5)
+    storage.con.commit()
+    # summaries of existing testruns are computed on demand, use
+    # insanity-rebuild-summary to store them
+
+def __updateDatabaseFrom5To6(storage):
+    create5to6 = """
+    CREATE TABLE failure_signature (
+       id %s,
+       signature CHAR(40) NOT NULL UNIQUE,
+       testtype TEXT,
+       description TEXT
+    );
+
+    CREATE TABLE test_failure_signature (
+       testid INTEGER NOT NULL PRIMARY KEY,
+       testrunid INTEGER NOT NULL,
+       signatureid INTEGER NOT NULL
+    );
+
+    CREATE INDEX t_f_sig_signatureid_idx ON test_failure_signature (signatureid, testrunid);
+    CREATE INDEX t_f_sig_testrunid_idx ON test_failure_signature (testrunid);
+    """ % storage._getAutoIncrementKey()
+    print("Creating failure signature tables")
+    storage._ExecuteScript(create5to6)
+    storage.con.commit()
+    # use insanity-failures --rebuild to compute the signatures of the
+    # existing testruns
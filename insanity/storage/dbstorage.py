@@ -23,17 +23,81 @@
 Database DataStorage for python modules supporting the DB-API v2.0
 """
 
+import os
 import time
 import threading
+import re
+import hashlib
 from weakref import WeakKeyDictionary
-from insanity.log import error, warning, debug
+from insanity.log import error, warning, debug, exception
 from insanity.utils import map_dict, map_list, map_dict_full
 from insanity.storage.storage import DataStorage
 from insanity.storage.async import AsyncStorage, queuemethod
 
+# name of the attached database while merging (see DBStorage.merge())
+MERGE_SOURCE = "mergesource"
+# default number of tests copied at once when merging without attaching
+MERGE_BATCH_SIZE = 1000
+# (table, testclassinfo dict table of its items, value columns) of the
+# per-test tables copied when merging
+MERGE_TEST_TABLES = [
+    ("test_arguments_dict", "testclassinfo_arguments_dict",
+     ["intvalue", "txtvalue"]),
+    ("test_checklist_list", "testclassinfo_checklist_dict", ["intvalue"]),
+    ("test_extrainfo_dict", "testclassinfo_extrainfo_dict",
+     ["intvalue", "txtvalue"]),
+    ("test_error_explanation_dict", "testclassinfo_checklist_dict",
+     ["txtvalue"]),
+    ("test_outputfiles_dict", "testclassinfo_outputfiles_dict", ["txtvalue"]),
+    ]
+
 class BlobException(Exception):
     pass
 
+class TestRunData(object):
+    """
+    In-memory copy of the tests (and monitors) of a testrun, as returned
+    by DBStorage.loadTestRun().
+
+    Provides the same accessors as DBStorage for the loaded tests, without
+    doing any query.
+    """
+
+    def __init__(self, testrunid, tests, infos, monitors, explanations):
+        self.testrunid = testrunid
+        # the list of test ids, as returned by getTestsForTestRun()
+        self.tests = tests
+        # key : testid, value : getFullTestInfo() tuple
+        self._infos = infos
+        # key : testid, value : list of monitor ids
+        self._monitors = monitors
+        # key : testid, value : getTestErrorExplanations() dictionnary
+        self._explanations = explanations
+
+    def __contains__(self, testid):
+        return testid in self._infos
+
+    def getTestInfo(self, testid):
+        info = self.getFullTestInfo(testid)
+        return (info[0], info[1], info[4], info[7], info[8], info[9])
+
+    def getFullTestInfo(self, testid):
+        if not testid in self._infos:
+            return (None, None, None, None, None, None, None, None, None, None)
+        return self._infos[testid]
+
+    def getTestErrorExplanations(self, testid):
+        return self._explanations.get(testid, {})
+
+    def getMonitorsIDForTest(self, testid):
+        return self._monitors.get(testid, [])
+
+    def getFullMonitorInfo(self, monitorid):
+        info = self.getFullTestInfo(monitorid)
+        if info[0] == None:
+            return (None, None, None, None, None, None, None)
+        return (info[7], info[1], info[2], info[3], info[4], info[5], info[6])
+
 class DBStorage(DataStorage, AsyncStorage):
     """
     Stores data in a database
@@ -42,7 +106,9 @@ class DBStorage(DataStorage, AsyncStorage):
     Don't use this class directly, but one of its subclasses
     """
 
-    def __init__(self, async=True, *args, **kwargs):
+    def __init__(self, async=True, maxqueue=1000, batchsize=50,
+                 readers=0, compactchecklist=False, outputstore=None,
+                 *args, **kwargs):
 
         # public
         # db-api Connection
@@ -51,8 +117,27 @@ class DBStorage(DataStorage, AsyncStorage):
         # protected
         # threading lock
         self._lock = threading.Lock()
+        # thread currently processing a batch of actions, commits
+        # done from that thread are deferred until the end of the batch
+        self._batchthread = None
+        # maximum number of read connections (see _openReadConnection())
+        self._maxreaders = readers
+        # if True, checklists are only stored in test_checklist_bitmap,
+        # the web interface only reads test_checklist_list and refuses
+        # to show them
+        self._compactchecklist = compactchecklist
+        # if set, the output files are moved to that OutputStore once
+        # their test is finished, and only their digest is kept
+        self._outputstore = outputstore
 
         # private
+        # idle read connections
+        self.__readers = []
+        # number of read connections opened (idle, in use or being opened)
+        self.__nbreaders = 0
+        # signaled when a read connection is given back or couldn't be
+        # opened
+        self.__readerscond = threading.Condition(threading.Lock())
         # key: testrun, value: testrunid
         self.__testruns = WeakKeyDictionary()
         self.__tests = WeakKeyDictionary()
@@ -61,17 +146,47 @@ class DBStorage(DataStorage, AsyncStorage):
         # cache of mappings for testclassinfo
         # { 'testtype' : { 'dictname' : mapping } }
         self.__tcmapping = {}
+        # cache of checklist bitmap positions
+        # { 'testtype' : ( [checklist ids], { name : position }, [names] ) }
+        self.__cpositions = {}
+        # contribution of each stored test to its testrun_summary
+        # key : test id, value : (tests, failed, timedout, crashed, failures)
+        self.__summaries = {}
+        # testrun ids known to have a testrun_summary entry
+        self.__summaryruns = set()
+        # cache of failure_signature ids
+        # { signature : id }
+        self.__signatureids = {}
+        # stored tests with an entry in test_failure_signature
+        # key : test id, value : signature id
+        self.__signedtests = {}
+        # (test, iteration) stored in the current batch, released once
+        # the batch is committed
+        self.__storediterations = []
+        # output files to move to the OutputStore once their test is done
+        # key : test, value : list of (containerid, name id, path)
+        self.__outputfiles = WeakKeyDictionary()
 
         DataStorage.__init__(self, *args, **kwargs)
-        AsyncStorage.__init__(self, async)
+        AsyncStorage.__init__(self, async, maxqueue=maxqueue,
+                              batchsize=batchsize)
 
-    def merge(self, otherdb, testruns=None):
+    def merge(self, otherdb, testruns=None, progress=None,
+              batchsize=MERGE_BATCH_SIZE):
         """
         Merges the contents of 'otherdb' into ourselves.
 
         If no list of testrun id from otherdb are specified, then all testruns
         from otherdb are merged into ourselves.
 
+        Each testrun is copied in a single transaction. If both databases
+        can be attached to each other (see _attachDatabase()), the tests are
+        copied with set-based INSERT ... SELECT queries, else they are
+        streamed by batches of 'batchsize' tests.
+
+        progress : (optional) callable called with (testrunid, copied, total)
+        as the tests of each testrun of otherdb get copied.
+
         Currently only supports DBStorage as other database.
         """
         if not isinstance(otherdb, DBStorage):
@@ -82,7 +197,8 @@ class DBStorage(DataStorage, AsyncStorage):
                 raise TypeError("testruns needs to be a list of testrun id")
         if self.async:
             raise Exception("Can not merge into an Asynchronous DBStorage, use async=False")
-        self.__merge(otherdb, testruns=testruns)
+        self.__merge(otherdb, testruns=testruns, progress=progress,
+                     batchsize=batchsize)
 
     # DataStorage methods implementation
 
@@ -187,6 +303,11 @@ class DBStorage(DataStorage, AsyncStorage):
     def getNbTestsForTestrun(self, testrunid, withscenarios=True,
                              failedonly=False, withmonitors=False):
         debug("testrunid:%d", testrunid)
+        if withscenarios and not withmonitors:
+            res = self._FetchOne("""SELECT nbtests, nbfailed FROM testrun_summary
+            WHERE testrunid=?""", (testrunid, ))
+            if res != None:
+                return res[int(failedonly)]
         liststr = "SELECT COUNT(*) FROM test WHERE testrunid=?"
         if failedonly:
             liststr += " AND resultpercentage <> 100.0"
@@ -199,6 +320,237 @@ class DBStorage(DataStorage, AsyncStorage):
             return 0
         return res[0]
 
+    def getTestRunSummary(self, testrunid):
+        """
+        Returns a tuple with the following info about the given testrun:
+        * the number of tests (excluding monitors)
+        * the number of failed tests
+        * the number of timed out tests
+        * the number of crashed tests
+        * a dictionnary of check item name to number of tests where it
+        failed
+
+        The values come from the testrun_summary table if available, else
+        they are computed (see rebuildTestRunSummary()).
+        """
+        res = self._FetchOne("""SELECT nbtests, nbfailed, nbtimedout, nbcrashed
+        FROM testrun_summary WHERE testrunid=?""", (testrunid, ))
+        if res == None:
+            return self._computeTestRunSummary(testrunid)
+        failures = dict(self._FetchAll("""SELECT name, nbfailed
+        FROM testrun_summary_failures WHERE testrunid=? AND nbfailed>0""",
+                                       (testrunid, )))
+        return tuple(res) + (failures, )
+
+    def rebuildTestRunSummary(self, testrunid):
+        """
+        Recomputes the testrun_summary of the given testrun from the
+        stored tests.
+        """
+        nbtests, nbfailed, nbtimedout, nbcrashed, failures = self._computeTestRunSummary(testrunid)
+        self._ExecuteCommit("DELETE FROM testrun_summary WHERE testrunid=?",
+                            (testrunid, ), commit=False)
+        self._ExecuteCommit("DELETE FROM testrun_summary_failures WHERE testrunid=?",
+                            (testrunid, ), commit=False)
+        self._InsertMany("testrun_summary_failures",
+                         ["testrunid", "name", "nbfailed"],
+                         [(testrunid, k, v) for k, v in failures.iteritems()],
+                         commit=False)
+        self._ExecuteCommit("""INSERT INTO testrun_summary
+        (testrunid, nbtests, nbfailed, nbtimedout, nbcrashed)
+        VALUES (?, ?, ?, ?, ?)""", (testrunid, nbtests, nbfailed,
+                                    nbtimedout, nbcrashed))
+        self.__summaryruns.add(testrunid)
+
+    def _computeTestRunSummary(self, testrunid):
+        """
+        Computes the contents of getTestRunSummary() from the stored tests.
+        """
+        res = self._FetchOne("""SELECT COUNT(*),
+        SUM(CASE WHEN resultpercentage<>100.0 THEN 1 ELSE 0 END)
+        FROM test WHERE testrunid=? AND ismonitor=0""", (testrunid, ))
+        nbtests = res[0] or 0
+        nbfailed = res[1] or 0
+        nbtimedout = 0
+        nbcrashed = 0
+        failures = {}
+        rows = self._FetchAll("""SELECT test.id, testclassinfo.type,
+        test_checklist_bitmap.word, test_checklist_bitmap.failure
+        FROM test, testclassinfo, test_checklist_bitmap
+        WHERE test.testrunid=? AND test.ismonitor=0
+        AND test.type=testclassinfo.id
+        AND test_checklist_bitmap.containerid=test.id
+        AND test_checklist_bitmap.failure<>0""", (testrunid, ))
+        for testid, testtype, word, bits in rows:
+            names = self.__getCheckListPositions(testtype)[2]
+            for bit in range(CHECKLIST_BITMAP_BITS):
+                pos = word * CHECKLIST_BITMAP_BITS + bit
+                if not bits & (1 << bit) or pos >= len(names):
+                    continue
+                name = names[pos]
+                failures[name] = failures.get(name, 0) + 1
+                if name == CHECKLIST_TIMEOUT_ITEM:
+                    nbtimedout += 1
+                elif name == CHECKLIST_CRASH_ITEM:
+                    nbcrashed += 1
+        return (nbtests, nbfailed, nbtimedout, nbcrashed, failures)
+
+    def getFailureSignature(self, testid):
+        """
+        Returns the (signature id, description) of the failure of the given
+        test, or (None, None) if it didn't fail.
+        """
+        res = self._FetchOne("""SELECT failure_signature.id, failure_signature.description
+        FROM test_failure_signature, failure_signature
+        WHERE test_failure_signature.testid=?
+        AND failure_signature.id=test_failure_signature.signatureid""", (testid, ))
+        if not res:
+            return (None, None)
+        return tuple(res)
+
+    def getFailureSignaturesForTestRun(self, testrunid):
+        """
+        Returns the failures of the given testrun grouped by signature, as a
+        list of tuples, most frequent first:
+        * the signature id
+        * the description of the signature
+        * the number of tests of the testrun having that signature
+        * the number of testruns having that signature
+        """
+        res = self._FetchAll("""SELECT failure_signature.id, failure_signature.description,
+        COUNT(*)
+        FROM test_failure_signature, failure_signature
+        WHERE test_failure_signature.testrunid=?
+        AND failure_signature.id=test_failure_signature.signatureid
+        GROUP BY failure_signature.id, failure_signature.description
+        ORDER BY COUNT(*) DESC, failure_signature.id""", (testrunid, ))
+        if not res:
+            return []
+        nbruns = dict(self._FetchAll("""SELECT signatureid, COUNT(DISTINCT testrunid)
+        FROM test_failure_signature WHERE signatureid IN
+        (SELECT signatureid FROM test_failure_signature WHERE testrunid=?)
+        GROUP BY signatureid""", (testrunid, )))
+        return [(sid, desc, nb, nbruns.get(sid, 1)) for sid, desc, nb in res]
+
+    def getTestRunsForFailureSignature(self, signatureid):
+        """
+        Returns the list of (testrun id, number of tests) of the testruns
+        having failures with the given signature id.
+        """
+        return [tuple(x) for x in self._FetchAll("""SELECT testrunid, COUNT(*)
+        FROM test_failure_signature WHERE signatureid=?
+        GROUP BY testrunid ORDER BY testrunid""", (signatureid, ))]
+
+    def findTestsByFailureSignature(self, signatureid, testrunid=None):
+        """
+        Returns the list of test ids whose failure has the given signature
+        id.
+
+        If specified, only tests belonging to the given testrunid will be
+        returned.
+        """
+        searchstr = "SELECT testid FROM test_failure_signature WHERE signatureid=?"
+        args = [signatureid]
+        if not testrunid == None:
+            searchstr += " AND testrunid=?"
+            args.append(testrunid)
+        searchstr += " ORDER BY testid"
+        return [x[0] for x in self._FetchAll(searchstr, args)]
+
+    def rebuildFailureSignatures(self, testrunid):
+        """
+        Recomputes the failure signatures of the tests of the given testrun
+        from the stored tests.
+        """
+        rows = []
+        for batch in self.iterTestRun(testrunid, failedonly=True):
+            for testid in batch.tests:
+                trid, ttype, args, checks, resperc, extras = batch.getFullTestInfo(testid)[:6]
+                if resperc == None:
+                    continue
+                crashsignature = None
+                for monitorid in batch.getMonitorsIDForTest(testid):
+                    mextras = batch.getFullMonitorInfo(monitorid)[5] or {}
+                    crashsignature = crashsignature or \
+                                     mextras.get("crash-signature")
+                signature, desc = self._computeFailureSignature(ttype, checks, extras,
+                                                                crashsignature)
+                rows.append((testid, testrunid,
+                             self.__getFailureSignatureID(signature, ttype, desc)))
+        self._ExecuteCommit("DELETE FROM test_failure_signature WHERE testrunid=?",
+                            (testrunid, ), commit=not rows)
+        if rows:
+            self._InsertMany("test_failure_signature",
+                             ["testid", "testrunid", "signatureid"], rows)
+
+    def _computeFailureSignature(self, testtype, checklist, extras,
+                                 crashsignature=None):
+        """
+        Returns the (signature, description) of the failure of a test of
+        type 'testtype' with the given checklist (list of (check item name,
+        value)) and extra information (dictionnary).
+
+        The signature is made of the test type, the failed check items,
+        the way the subprocess exited, the first error reported by the
+        test, the python exception raised and the crash signature of its
+        backtrace (see GDBMonitor), if any. Addresses and numbers are
+        stripped from the error and exception so that the same error on
+        different media gets the same signature.
+        """
+        parts = [testtype]
+        failed = [k for k, v in checklist if v == 0]
+        failed.sort()
+        parts.append(", ".join(failed))
+        returncode = extras.get("subprocess-return-code")
+        if returncode and returncode < 0:
+            parts.append("signal %d" % -returncode)
+        elif returncode:
+            parts.append("exit %d" % returncode)
+        error = self.__getFirstTestError(extras)
+        if error:
+            parts.append(re.sub(r"0x[0-9a-fA-F]+|\d+", "#", error))
+        exception = extras.get("python-exception")
+        if exception:
+            lines = [l.strip() for l in exception.splitlines() if l.strip()]
+            if lines:
+                parts.append(re.sub(r"0x[0-9a-fA-F]+|\d+", "#", lines[-1]))
+        if crashsignature:
+            parts.append("crash %s" % crashsignature)
+        desc = "; ".join([p for p in parts if p])
+        if isinstance(desc, unicode):
+            signature = hashlib.sha1(desc.encode("utf-8")).hexdigest()
+        else:
+            signature = hashlib.sha1(desc).hexdigest()
+        return (signature, desc)
+
+    def __getFirstTestError(self, extras):
+        """
+        Returns the message of the first error of the "errors" extra
+        information, stored either as a list of (code, domain, message,
+        debug) or as errors.<n>.domain/message entries.
+        """
+        errors = extras.get("errors")
+        if isinstance(errors, (list, tuple)):
+            if not errors:
+                return None
+            error = errors[0]
+            if isinstance(error, (list, tuple)) and len(error) >= 3:
+                return "%s: %s" % (error[1], error[2])
+            return "%s" % (error, )
+        if errors:
+            return "%s" % (errors, )
+        indexes = [int(k.split(".")[1]) for k in extras
+                   if k.startswith("errors.") and k.endswith(".message")
+                   and k.split(".")[1].isdigit()]
+        if not indexes:
+            return None
+        first = min(indexes)
+        message = extras["errors.%d.message" % first]
+        domain = extras.get("errors.%d.domain" % first)
+        if domain:
+            return "%s: %s" % (domain, message)
+        return message
+
     def getTestsForTestRun(self, testrunid, withscenarios=True,
                            failedonly=False, withmonitors=False):
         debug("testrunid:%d", testrunid)
@@ -324,6 +676,115 @@ class DBStorage(DataStorage, AsyncStorage):
         return (testrunid, ttype, args, results, resperc,
                 extras, ofs, parentid, ismonitor, isscenario)
 
+    def loadTestRun(self, testrunid, withscenarios=True, failedonly=False,
+                    rawinfo=False, onlyargs=False):
+        """
+        Returns a TestRunData with the full information of all the tests
+        and monitors of the given testrun.
+
+        Every table is only queried once for the whole testrun, which is
+        much faster than calling getFullTestInfo() and
+        getFullMonitorInfo() for each test.
+
+        withscenarios, failedonly : see getTestsForTestRun()
+        rawinfo, onlyargs : see getFullTestInfo()
+        """
+        tests = self.getTestsForTestRun(testrunid, withscenarios, failedonly)
+        return self.__loadTestRun(testrunid, tests, "test.testrunid=?",
+                                  (testrunid, ), rawinfo, onlyargs)
+
+    def iterTestRun(self, testrunid, withscenarios=True, failedonly=False,
+                    rawinfo=False, onlyargs=False, batchsize=1000):
+        """
+        Same as loadTestRun(), but yields a TestRunData for each batch of
+        at most 'batchsize' tests, in test id order, so that the memory
+        used doesn't depend on the size of the testrun.
+
+        The monitors of the tests of a batch are in the same TestRunData.
+        """
+        liststr = """SELECT test.id FROM test
+        WHERE test.testrunid=? AND test.id>? AND test.ismonitor<>1"""
+        if failedonly:
+            liststr += " AND test.resultpercentage <> 100.0"
+        if withscenarios == False:
+            liststr += " AND test.isscenario=0"
+        liststr += " ORDER BY test.id LIMIT ?"
+        lastid = -1
+        while True:
+            res = self._FetchAll(liststr, (testrunid, lastid, batchsize))
+            if not res:
+                return
+            tests = [x[0] for x in res]
+            firstid, lastid = tests[0], tests[-1]
+            yield self.__loadTestRun(testrunid, tests,
+                                     """test.testrunid=? AND
+                                     (test.id BETWEEN ? AND ? OR
+                                     (test.ismonitor=1 AND test.parentid BETWEEN ? AND ?))""",
+                                     (testrunid, firstid, lastid, firstid, lastid),
+                                     rawinfo, onlyargs)
+            if len(tests) < batchsize:
+                return
+
+    def __loadTestRun(self, testrunid, tests, testfilter, filterargs,
+                      rawinfo=False, onlyargs=False):
+        """
+        Returns a TestRunData with the given list of tests and all the
+        information of the tests matching the 'testfilter' condition.
+        """
+        res = self._FetchAll("""SELECT test.id, test.type, testclassinfo.type,
+        test.resultpercentage, test.parentid, test.ismonitor, test.isscenario
+        FROM test, testclassinfo
+        WHERE %s AND test.type=testclassinfo.id
+        ORDER BY test.id""" % testfilter, filterargs)
+        args = self.__loadTestRunValues(testfilter, filterargs,
+                                        "test_arguments_dict",
+                                        "testclassinfo_arguments_dict",
+                                        ["intvalue", "txtvalue"], rawinfo)
+        if onlyargs:
+            checks, extras, ofs, expls = {}, {}, {}, {}
+        else:
+            checks = self.__loadTestRunValues(testfilter, filterargs,
+                                              "test_checklist_list",
+                                              "testclassinfo_checklist_dict",
+                                              ["intvalue"], rawinfo)
+            extras = self.__loadTestRunValues(testfilter, filterargs,
+                                              "test_extrainfo_dict",
+                                              "testclassinfo_extrainfo_dict",
+                                              ["intvalue", "txtvalue"], rawinfo)
+            ofs = self.__loadTestRunValues(testfilter, filterargs,
+                                           "test_outputfiles_dict",
+                                           "testclassinfo_outputfiles_dict",
+                                           ["txtvalue"], rawinfo)
+            # explanations are keyed by checklist item id, as in
+            # getTestErrorExplanations()
+            expls = self.__loadTestRunValues(testfilter, filterargs,
+                                             "test_error_explanation_dict",
+                                             None, ["txtvalue"], True)
+
+            types = dict([(row[0], row[2]) for row in res])
+            if [tid for tid in types if not tid in checks]:
+                # some checklists are only stored as bitmaps
+                checks.update(self.__loadTestRunCheckListBitmaps(testfilter,
+                                                                 filterargs,
+                                                                 types, checks,
+                                                                 rawinfo))
+
+        infos = {}
+        monitors = {}
+        for tid, typeid, ttype, resperc, parentid, ismonitor, isscenario in res:
+            if rawinfo:
+                ttype = typeid
+            infos[tid] = (testrunid, ttype, dict(args.get(tid, [])),
+                          checks.get(tid, []), resperc,
+                          dict(extras.get(tid, [])), dict(ofs.get(tid, [])),
+                          parentid, ismonitor, isscenario)
+            if ismonitor:
+                monitors.setdefault(parentid, []).append(tid)
+        explanations = {}
+        for tid, expl in expls.iteritems():
+            explanations[tid] = dict(expl)
+        return TestRunData(testrunid, tests, infos, monitors, explanations)
+
     def getTestErrorExplanations(self, testid):
         """
         Returns a dict with explanations of failed test check
@@ -552,6 +1013,29 @@ class DBStorage(DataStorage, AsyncStorage):
         """
         raise NotImplementedError
 
+    def _getAutoIncrementKey(self):
+        """
+        Returns the column definition of an auto-incremented integer
+        primary key, used when creating tables while updating the database
+        """
+        return "INTEGER PRIMARY KEY"
+
+    def _attachDatabase(self, otherdb, name):
+        """
+        Makes the tables of 'otherdb' available to our queries as
+        '<name>.<table>'.
+
+        Returns True if the database could be attached, in which case
+        _detachDatabase() will be called once it isn't needed anymore.
+        """
+        return False
+
+    def _detachDatabase(self, name):
+        """
+        Detaches a database attached with _attachDatabase().
+        """
+        pass
+
     def _openDatabase(self):
         """
         Open the database
@@ -581,17 +1065,78 @@ class DBStorage(DataStorage, AsyncStorage):
         self._ExecuteCommit(cmstr, (DB_SCHEME_VERSION, int(time.time())))
         debug("Tables properly created")
 
+    def _touchDatabase(self):
+        """
+        Updates the modification time of the database.
+
+        Users caching data from the database (like the web interface) use
+        it to know when their cache is outdated. It is always increased,
+        even if called several times in the same second.
+        """
+        now = int(time.time())
+        self._ExecuteCommit("""UPDATE version SET modificationtime=CASE
+        WHEN modificationtime>=? THEN modificationtime+1 ELSE ? END""",
+                            (now, now))
+
     def _shutDown(self):
         """
         Subclasses should implement this method for specific closing/cleanup.
         """
+        self.__readerscond.acquire()
+        try:
+            readers, self.__readers = self.__readers, []
+        finally:
+            self.__readerscond.release()
+        for con in readers:
+            con.close()
         if self.con:
             debug("Closing database Connection")
             self.con.close()
 
+    # AsyncStorage methods implementation
+
+    def _beginBatch(self):
+        self._batchthread = threading.currentThread()
+
+    def _endBatch(self):
+        self._lock.acquire()
+        try:
+            self._batchthread = None
+            if self.con:
+                self.con.commit()
+        finally:
+            self._lock.release()
+        stored, self.__storediterations = self.__storediterations, []
+        for test, iteration in stored:
+            test.releaseIteration(iteration)
+
+    def _cancelBatch(self):
+        """
+        Ends the batch being processed, discarding its changes.
+        """
+        self._lock.acquire()
+        try:
+            self._batchthread = None
+            if self.con:
+                self.con.rollback()
+        finally:
+            self._lock.release()
+        # cached ids might refer to discarded rows
+        self.__cpositions = {}
+        self.__signatureids = {}
+        # the iterations weren't stored after all
+        self.__storediterations = []
+
     # PROTECTED METHODS
     # Usable by subclasses
 
+    def _isCommitDeferred(self):
+        """
+        Returns True if commits from the current thread are deferred until
+        the end of the batch being processed.
+        """
+        return self._batchthread is threading.currentThread()
+
     def _ExecuteScript(self, instructions, *args, **kwargs):
         """
         Executes the given script.
@@ -602,6 +1147,8 @@ class DBStorage(DataStorage, AsyncStorage):
         """
         Calls .execute(instruction, *args, **kwargs) and .commit()
 
+        The commit is deferred if a batch of actions is being processed.
+
         Returns the last row id
 
         Threadsafe
@@ -614,7 +1161,7 @@ class DBStorage(DataStorage, AsyncStorage):
         try:
             cur = self.con.cursor()
             cur.execute(instruction, *args, **kwargs)
-            if commit:
+            if commit and not self._isCommitDeferred():
                 self.con.commit()
         finally:
             if not threadsafe:
@@ -630,12 +1177,27 @@ class DBStorage(DataStorage, AsyncStorage):
         try:
             cur = self.con.cursor()
             cur.executemany(instruction, *args, **kwargs)
-            if commit:
+            if commit and not self._isCommitDeferred():
                 self.con.commit()
         finally:
             if not threadsafe:
                 self._lock.release()
 
+    def _InsertMany(self, table, columns, rows, **kwargs):
+        """
+        Inserts all the given rows (list of tuples of values for the given
+        columns) in the given table.
+
+        Accepts the same keyword arguments as _ExecuteMany().
+        Subclasses can override this to use a more efficient method.
+        """
+        if not rows:
+            return
+        instruction = "INSERT INTO %s (%s) VALUES (%s)" % (table,
+                                                           ", ".join(columns),
+                                                           ", ".join(["?"] * len(columns)))
+        self._ExecuteMany(instruction, rows, **kwargs)
+
     def _FetchAll(self, instruction, *args, **kwargs):
         """
         Executes the given SQL query and returns a list
@@ -646,13 +1208,7 @@ class DBStorage(DataStorage, AsyncStorage):
         debug("instruction %s", instruction)
         debug("args: %r", args)
         debug("kwargs: %r", kwargs)
-        self._lock.acquire()
-        try:
-            cur = self.con.cursor()
-            cur.execute(instruction, *args, **kwargs)
-            res = cur.fetchall()
-        finally:
-            self._lock.release()
+        res = self.__fetch(instruction, args, kwargs)
         debug("returning %r", res)
         return list(res)
 
@@ -666,15 +1222,104 @@ class DBStorage(DataStorage, AsyncStorage):
         debug("instruction %s", instruction)
         debug("args: %r", args)
         debug("kwargs: %r", kwargs)
-        self._lock.acquire()
+        res = self.__fetch(instruction, args, kwargs, one=True)
+        debug("returning %r", res)
+        return res
+
+    def _openReadConnection(self):
+        """
+        Subclasses can implement this method to return a new DB-API
+        Connection only used for reading, or None if not supported.
+        """
+        return None
+
+    def _useReadConnection(self):
+        """
+        Returns True if reads from the current thread should go through
+        the read connections.
+        """
+        if not self._maxreaders:
+            return False
+        # synchronous users read back what they write from the same thread
+        if not getattr(self, "_async", False):
+            return False
+        return threading.currentThread() is not self._actionthread
+
+    def __getReadConnection(self):
+        """
+        Returns an idle read connection, opening a new one if there are
+        less than _maxreaders, else waiting for one to be given back.
+
+        Returns None if the read connections can't be used, the main
+        connection should be used instead.
+        """
+        self.__readerscond.acquire()
         try:
-            cur = self.con.cursor()
+            while True:
+                if self.__readers:
+                    return self.__readers.pop()
+                if self.__nbreaders < self._maxreaders:
+                    self.__nbreaders += 1
+                    break
+                if not self._maxreaders:
+                    # the pool can't grow, don't wait for a connection
+                    return None
+                # all the read connections are in use, they will be given
+                # back
+                self.__readerscond.wait()
+        finally:
+            self.__readerscond.release()
+        debug("opening read connection #%d", self.__nbreaders)
+        supported = True
+        try:
+            con = self._openReadConnection()
+            supported = con != None
+        except:
+            exception("Couldn't open a read connection")
+            con = None
+        if con == None:
+            self.__readerscond.acquire()
+            try:
+                self.__nbreaders -= 1
+                if not supported:
+                    # don't try again
+                    self._maxreaders = 0
+                # the waiters can't rely on that connection anymore
+                self.__readerscond.notifyAll()
+            finally:
+                self.__readerscond.release()
+        return con
+
+    def __putReadConnection(self, con):
+        self.__readerscond.acquire()
+        try:
+            self.__readers.append(con)
+            self.__readerscond.notify()
+        finally:
+            self.__readerscond.release()
+
+    def __fetch(self, instruction, args, kwargs, one=False):
+        con = None
+        if self._useReadConnection():
+            con = self.__getReadConnection()
+        if con == None:
+            self._lock.acquire()
+            try:
+                cur = self.con.cursor()
+                cur.execute(instruction, *args, **kwargs)
+                if one:
+                    return cur.fetchone()
+                return cur.fetchall()
+            finally:
+                self._lock.release()
+        try:
+            cur = con.cursor()
             cur.execute(instruction, *args, **kwargs)
-            res = cur.fetchone()
+            if one:
+                return cur.fetchone()
+            return cur.fetchall()
         finally:
-            self._lock.release()
-        debug("returning %r", res)
-        return res
+            self.__putReadConnection(con)
 
     def _getTestTypeID(self, testtype):
         """
@@ -735,19 +1380,33 @@ class DBStorage(DataStorage, AsyncStorage):
         callback(*args, **kwargs)
 
 
-    def __merge(self, otherdb, testruns=None):
-        # FIXME : This is a straight-forward method that could be optimized
-        # We just :
-        # * Get some data from otherdb
-        # * Save it into self (modifying key id on the fly)
+    def __merge(self, otherdb, testruns=None, progress=None,
+                batchsize=MERGE_BATCH_SIZE):
         debug("otherdb : %r", otherdb)
         debug("testruns : %r", testruns)
         if testruns == None:
             testruns = otherdb.listTestRuns()
-        for trid in testruns:
-            self.__mergeTestRun(otherdb, trid)
+        attached = self._attachDatabase(otherdb, MERGE_SOURCE)
+        debug("attached : %r", attached)
+        try:
+            for trid in testruns:
+                # everything from a testrun is copied in one transaction
+                self._beginBatch()
+                try:
+                    self.__mergeTestRun(otherdb, trid, attached, progress,
+                                        batchsize)
+                except:
+                    self._cancelBatch()
+                    raise
+                self._endBatch()
+        finally:
+            if attached:
+                self._detachDatabase(MERGE_SOURCE)
+        # let readers know the contents changed
+        self._touchDatabase()
 
-    def __mergeTestRun(self, otherdb, othertrid):
+    def __mergeTestRun(self, otherdb, othertrid, attached=False,
+                       progress=None, batchsize=MERGE_BATCH_SIZE):
         debug("othertrid:%d", othertrid)
         # FIXME : Try to figure out (by some way) if we're not merging an
         # existing testrun (same client, dates, etc...)
@@ -777,55 +1436,213 @@ class DBStorage(DataStorage, AsyncStorage):
         for tclass in testclasses:
             if not self.__hasTestClassInfo(tclass):
                 self.__mergeTestClassInfo(tclass, otherdb)
+        # classes present in both databases might not have the same items
+        namemaps = {}
+        for tablename, classtable, columns in MERGE_TEST_TABLES:
+            if not classtable in namemaps:
+                namemaps[classtable] = self.__mergeTestClassDict(classtable,
+                                                                 otherdb)
+        # new checklist items change the bitmap positions
+        self.__cpositions = {}
+
+        # 4. Tests, monitors and scenarios
+        # Tests are copied with the same ids shifted by 'offset', which
+        # keeps them (and their parentid) unique and in the same order.
+        total, firstid = otherdb._FetchOne("""SELECT COUNT(*), MIN(id)
+        FROM test WHERE testrunid=?""", (othertrid, ))
+        if total:
+            lastid = self._FetchOne("SELECT MAX(id) FROM test")[0] or 0
+            offset = lastid + 1 - firstid
+            if progress:
+                progress(othertrid, 0, total)
+            if attached:
+                self.__mergeTestsAttached(otherdb, othertrid, trid, offset,
+                                          batchsize)
+                if progress:
+                    progress(othertrid, total, total)
+            else:
+                self.__mergeTestsStreamed(otherdb, othertrid, trid, offset,
+                                          namemaps, progress, total,
+                                          batchsize)
 
-        debug("Getting Class mappings")
-        testclassmap = self.__getTestClassRemoteMapping(otherdb)
-        testmapping = {}
-
-        debug("Inserting tests")
-        for othertestid in otherdb.getTestsForTestRun(othertrid):
-            # this includes tests, monitors and scenarios
-            # to properly re-map parentid we need to have the mapping of
-            # oldtestid => newtestid, parentid
-            newtestid, parentid = self.__mergeTest(otherdb, othertestid, trid,
-                                                   testclassmap)
-            testmapping[othertestid] = (newtestid, parentid)
-
-        debug("Updating test.parentid with new values")
-        self._ExecuteMany("""UPDATE test SET parentid=? WHERE id=?""",
-                          [(pid, newid) for newid, pid in testmapping.itervalues() if pid])
+        self.rebuildTestRunSummary(trid)
+        self.rebuildFailureSignatures(trid)
 
         debug("done merging testrun")
 
-    def __mergeTest(self, otherdb, otid, testrunid, testclassmap):
+    def __mergeTestsAttached(self, otherdb, othertrid, testrunid, offset,
+                             batchsize=MERGE_BATCH_SIZE):
         """
-        Copy all information about test 'otid' from otherdb into self,
-        including monitor.
-
-        Returns the id of the new test entry
+        Copies all the tests of 'othertrid' from the attached otherdb with
+        INSERT ... SELECT queries, mapping the class and item ids by name.
         """
-        debug("otid:%d, testrunid:%d", otid, testrunid)
-        insertstr = """
-        INSERT INTO test (testrunid, type, resultpercentage, parentid, ismonitor, isscenario)
-        VALUES (?, ?, ?, ?, ?, ?)
+        debug("othertrid:%d, testrunid:%d, offset:%d", othertrid,
+              testrunid, offset)
+        self._ExecuteCommit("""INSERT INTO main.test
+        (id, testrunid, type, resultpercentage, parentid, ismonitor, isscenario)
+        SELECT t.id + ?, ?, c.id, t.resultpercentage, t.parentid + ?,
+        t.ismonitor, t.isscenario
+        FROM %(src)s.test t, %(src)s.testclassinfo o, main.testclassinfo c
+        WHERE t.testrunid=? AND t.type=o.id AND c.type=o.type""" % {"src" : MERGE_SOURCE},
+                            (offset, testrunid, offset, othertrid),
+                            commit=False)
+        for tablename, classtable, columns in MERGE_TEST_TABLES:
+            if tablename == "test_checklist_list" and self._compactchecklist:
+                continue
+            # items are mapped on (containerid, name), the same way
+            # __mergeTestClassDict() does
+            self._ExecuteCommit("""INSERT INTO main.%(table)s
+            (containerid, name, %(columns)s)
+            SELECT d.containerid + ?, m.id, %(dcolumns)s
+            FROM %(src)s.%(table)s d, %(src)s.test t, %(src)s.%(classtable)s o,
+            (SELECT containerid, name, MIN(id) AS id FROM main.%(classtable)s
+            GROUP BY containerid, name) m
+            WHERE t.testrunid=? AND d.containerid=t.id AND d.name=o.id
+            AND m.containerid=o.containerid AND m.name=o.name
+            ORDER BY d.id""" % {"src" : MERGE_SOURCE,
+                                "table" : tablename,
+                                "classtable" : classtable,
+                                "columns" : ", ".join(columns),
+                                "dcolumns" : ", ".join(["d." + c for c in columns])},
+                                (offset, othertrid), commit=False)
+        self.__mergeCheckListBitmapsAttached(otherdb, othertrid, offset,
+                                             batchsize)
+
+    def __mergeTestsStreamed(self, otherdb, othertrid, testrunid, offset,
+                             namemaps, progress=None, total=None,
+                             batchsize=MERGE_BATCH_SIZE):
         """
+        Copies all the tests of 'othertrid' from otherdb by batches of
+        'batchsize' tests.
 
-        oldtr, testname, args, checks, resperc, extras, outputfiles, parentid, ismonitor, isscenario = otherdb.getFullTestInfo(otid)
-        # convert testname (str) to testtype (int)
-        debug("testname %s", testname)
-        tmp = testclassmap[testname]
-        ttype = tmp[0]
+        namemaps : dictionnary of testclassinfo_*_dict table to
+        __mergeTestClassDict() mapping
+        """
+        debug("othertrid:%d, testrunid:%d, offset:%d", othertrid,
+              testrunid, offset)
+        classmap = dict([(otherid, selfid) for selfid, otherid
+                         in self.__getTestClassRemoteMapping(otherdb).itervalues()])
+        liststr = """SELECT id, type, resultpercentage, parentid, ismonitor,
+        isscenario FROM test WHERE testrunid=? AND id>? ORDER BY id LIMIT ?"""
+        copied = 0
+        lastid = -1
+        while True:
+            res = otherdb._FetchAll(liststr, (othertrid, lastid, batchsize))
+            if not res:
+                break
+            firstid, lastid = res[0][0], res[-1][0]
+            rows = []
+            for tid, ttype, resperc, parentid, ismonitor, isscenario in res:
+                if parentid != None:
+                    parentid += offset
+                rows.append((tid + offset, testrunid, classmap[ttype],
+                             resperc, parentid, ismonitor, isscenario))
+            self._InsertMany("test", ["id", "testrunid", "type",
+                                      "resultpercentage", "parentid",
+                                      "ismonitor", "isscenario"],
+                             rows, commit=False)
+
+            testfilter = "test.testrunid=? AND test.id BETWEEN ? AND ?"
+            filterargs = (othertrid, firstid, lastid)
+            for tablename, classtable, columns in MERGE_TEST_TABLES:
+                if tablename == "test_checklist_list" and self._compactchecklist:
+                    continue
+                names = namemaps[classtable]
+                rows = []
+                for row in otherdb._FetchAll("""SELECT d.containerid, d.name, %s
+                FROM %s d, test WHERE %s AND d.containerid=test.id
+                ORDER BY d.id""" % (", ".join(["d." + c for c in columns]),
+                                    tablename, testfilter), filterargs):
+                    if not row[1] in names:
+                        debug("Unknown %s item %r", classtable, row[1])
+                        continue
+                    rows.append((row[0] + offset, names[row[1]]) + tuple(row[2:]))
+                self._InsertMany(tablename, ["containerid", "name"] + columns,
+                                 rows, commit=False)
+            self.__mergeCheckListBitmaps(otherdb, testfilter, filterargs,
+                                         offset)
+
+            copied += len(res)
+            if progress:
+                progress(othertrid, copied, total)
+            if len(res) < batchsize:
+                break
 
-        newtid = self._ExecuteCommit(insertstr,
-                                     (testrunid, ttype, resperc, parentid, ismonitor, isscenario))
+    def __mergeCheckListBitmapsAttached(self, otherdb, othertrid, offset,
+                                        batchsize=MERGE_BATCH_SIZE):
+        """
+        Copies the checklist bitmaps of the tests of 'othertrid' from the
+        attached otherdb.
 
-        # store the dictionnaries
-        self.__storeTestArgumentsDict(newtid, args, testname)
-        self.__storeTestCheckListList(newtid, checks, testname)
-        self.__storeTestExtraInfoDict(newtid, extras, testname)
-        self.__storeTestOutputFileDict(newtid, outputfiles, testname)
+        The bitmaps of the test types whose items have the same positions
+        in both databases are copied as is with an INSERT ... SELECT query,
+        the other ones are re-packed by batches of 'batchsize' tests.
+        """
+        same = []
+        different = []
+        for ttype, typeid in otherdb._FetchAll("""SELECT DISTINCT
+        testclassinfo.type, testclassinfo.id FROM test, testclassinfo
+        WHERE test.type=testclassinfo.id AND test.testrunid=?""", (othertrid, )):
+            othernames = otherdb.__getCheckListPositions(ttype)[2]
+            names = self.__getCheckListPositions(ttype)[2]
+            # items only added to self get higher positions
+            if names[:len(othernames)] == othernames:
+                same.append(typeid)
+            else:
+                different.append(typeid)
+        debug("copying bitmaps of types %r, re-packing types %r", same, different)
+        if same:
+            self._ExecuteCommit("""INSERT INTO main.test_checklist_bitmap
+            (containerid, word, %(columns)s)
+            SELECT b.containerid + ?, b.word, %(bcolumns)s
+            FROM %(src)s.test_checklist_bitmap b, %(src)s.test t
+            WHERE t.testrunid=? AND b.containerid=t.id
+            AND t.type IN (%(types)s)""" % {"src" : MERGE_SOURCE,
+                                           "columns" : ", ".join(CHECKLIST_BITMAP_COLUMNS),
+                                           "bcolumns" : ", ".join(["b." + c for c in CHECKLIST_BITMAP_COLUMNS]),
+                                           "types" : ", ".join(["?"] * len(same))},
+                                (offset, othertrid) + tuple(same), commit=False)
+        if not different:
+            return
+        typefilter = "test.type IN (%s)" % ", ".join(["?"] * len(different))
+        liststr = """SELECT id FROM test WHERE testrunid=? AND %s AND id>?
+        ORDER BY id LIMIT ?""" % typefilter.replace("test.", "")
+        lastid = -1
+        while True:
+            res = otherdb._FetchAll(liststr, (othertrid, ) + tuple(different)
+                                    + (lastid, batchsize))
+            if not res:
+                break
+            firstid, lastid = res[0][0], res[-1][0]
+            self.__mergeCheckListBitmaps(otherdb,
+                                         "test.testrunid=? AND %s AND test.id BETWEEN ? AND ?" % typefilter,
+                                         (othertrid, ) + tuple(different) + (firstid, lastid),
+                                         offset)
+            if len(res) < batchsize:
+                break
 
-        return newtid, parentid
+    def __mergeCheckListBitmaps(self, otherdb, testfilter, filterargs, offset):
+        """
+        Stores the checklist bitmaps of the tests of otherdb matching the
+        'testfilter' condition, copied with the given id offset.
+        """
+        types = dict(otherdb._FetchAll("""SELECT test.id, testclassinfo.type
+        FROM test, testclassinfo
+        WHERE %s AND test.type=testclassinfo.id""" % testfilter, filterargs))
+        checks = otherdb.__loadTestRunValues(testfilter, filterargs,
+                                             "test_checklist_list",
+                                             "testclassinfo_checklist_dict",
+                                             ["intvalue"])
+        checks.update(otherdb.__loadTestRunCheckListBitmaps(testfilter,
+                                                            filterargs,
+                                                            types, checks))
+        rows = []
+        for tid, checklist in checks.iteritems():
+            rows.extend([(tid + offset, ) + x
+                         for x in self._packCheckList(types[tid], checklist)])
+        self._InsertMany("test_checklist_bitmap",
+                         ["containerid", "word"] + CHECKLIST_BITMAP_COLUMNS,
+                         rows, commit=False)
 
     def __mergeTestClassInfo(self, ttype, otherdb):
         """
@@ -870,6 +1687,32 @@ class DBStorage(DataStorage, AsyncStorage):
         """
         return self.__getRemoteMapping("testclassinfo", otherdb)
 
+    def __mergeTestClassDict(self, tablename, otherdb):
+        """
+        Copies the items of the given testclassinfo_*_dict table of otherdb
+        missing in self.
+
+        Returns the mapping of all the items of otherdb
+        Key : id in otherdb
+        Value : id in self
+        """
+        getstr = """SELECT containerid, name, id, txtvalue FROM %s
+        ORDER BY id""" % tablename
+        selfids = {}
+        for containerid, name, selfid, txtvalue in self._FetchAll(getstr):
+            selfids.setdefault((containerid, name), selfid)
+        res = {}
+        for containerid, name, otherid, txtvalue in otherdb._FetchAll(getstr):
+            key = (containerid, name)
+            if not key in selfids:
+                debug("Adding %r to %s", key, tablename)
+                selfids[key] = self._ExecuteCommit("""INSERT INTO %s
+                (containerid, name, txtvalue) VALUES (?, ?, ?)""" % tablename,
+                                                   (containerid, name, txtvalue),
+                                                   commit=False)
+            res[otherid] = selfids[key]
+        return res
+
 
     def __rawStartNewTestRun(self, clientid, starttime):
         insertstr = """
@@ -888,6 +1731,7 @@ class DBStorage(DataStorage, AsyncStorage):
         else:
             clientid = self.__clients.get(testrun, 0)
         testrunid = self.__rawStartNewTestRun(clientid, testrun._starttime)
+        self.__ensureTestRunSummary(testrunid)
         envdict = testrun.getEnvironment()
         if envdict:
             self._storeEnvironmentDict(testrunid, envdict)
@@ -906,6 +1750,8 @@ class DBStorage(DataStorage, AsyncStorage):
             self.__startNewTestRun(testrun, None)
         self.__rawEndTestRun(self.__testruns[testrun],
                              testrun._stoptime)
+        # fix up anything the incremental updates might have missed
+        self.rebuildTestRunSummary(self.__testruns[testrun])
         debug("updated")
 
     def __rawNewTestStarted(self, testrunid, testtype, commit=True):
@@ -928,7 +1774,12 @@ class DBStorage(DataStorage, AsyncStorage):
         testid = self.__rawNewTestStarted(self.__testruns[testrun],
                                           testtid, commit)
         debug("got testid %d", testid)
+        if test in self.__tests:
+            # the previous iteration won't be updated anymore
+            self.__forgetTestRow(self.__tests[test])
         self.__tests[test] = testid
+        # counted from now on, like the summaries computed from the rows
+        self.__updateTestRunSummary(self.__testruns[testrun], testid, None)
 
     def __newTestStopped(self, testrun, test, iteration, parentid=None):
         if not testrun in self.__testruns.keys():
@@ -952,14 +1803,15 @@ class DBStorage(DataStorage, AsyncStorage):
             self._ExecuteCommit("""UPDATE test SET isscenario=1 WHERE id=?""", (tid, ))
 
         # store the dictionnaries
+        checklist = test.getIterationCheckList(iteration)
         self.__storeTestArgumentsDict(tid, test.getIterationArguments(iteration),
                                      test.getTestName())
-        self.__storeTestCheckListList(tid, test.getIterationCheckList(iteration),
+        self.__storeTestCheckListList(tid, checklist,
                                      test.getTestName())
         self.__storeTestExtraInfoDict(tid, test.getIterationExtraInfo(iteration),
                                      test.getTestName())
         self.__storeTestOutputFileDict(tid, test.getIterationOutputFiles(iteration),
-                                      test.getTestName())
+                                      test.getTestName(), test)
         self.__storeTestErrorExplanationDict(tid, test.getErrorExplanations(),
                                              test.getTestName())
         # store monitor results
@@ -970,13 +1822,30 @@ class DBStorage(DataStorage, AsyncStorage):
         updatestr = "UPDATE test SET resultpercentage=?, parentid=? WHERE id=?"
         resultpercentage = test.getIterationSuccessPercentage(iteration)
         self._ExecuteCommit(updatestr, (resultpercentage, parentid, tid))
+        self.__updateTestRunSummary(self.__testruns[testrun], tid,
+                                    resultpercentage, checklist)
+        crashsignature = None
+        for monitor in test._monitorinstances:
+            crashsignature = crashsignature or \
+                             monitor.getExtraInfo().get("crash-signature")
+        self.__storeFailureSignature(self.__testruns[testrun], test, tid,
+                                     resultpercentage, checklist,
+                                     test.getIterationExtraInfo(iteration),
+                                     crashsignature)
+
+        # the test doesn't need to keep that iteration in memory once it
+        # is committed
+        if self._isCommitDeferred():
+            self.__storediterations.append((test, iteration))
+        else:
+            test.releaseIteration(iteration)
 
         debug("done adding information for test %d", tid)
 
 
     def __rawStoreMonitor(self, testid, monitortype, monitorname,
                           resperc, args, checks, extras, outputfiles,
-                          testrunid):
+                          testrunid, test=None):
         insertstr = """
         INSERT INTO test (parentid, type, resultpercentage, ismonitor, testrunid)
         VALUES (?, ?, ?, 1, ?)
@@ -993,7 +1862,7 @@ class DBStorage(DataStorage, AsyncStorage):
         self.__storeTestArgumentsDict(mid, args, monitorname)
         self.__storeTestCheckListList(mid, checks, monitorname)
         self.__storeTestExtraInfoDict(mid, extras, monitorname)
-        self.__storeTestOutputFileDict(mid, outputfiles, monitorname)
+        self.__storeTestOutputFileDict(mid, outputfiles, monitorname, test)
 
     def __storeMonitor(self, monitor, testid, testrunid, iteration=-1):
         debug("monitor:%r:%d", monitor, testid)
@@ -1015,18 +1884,133 @@ class DBStorage(DataStorage, AsyncStorage):
                                monitor.getCheckList(),
                                monitor.getExtraInfo(),
                                outputfiles,
-                               testrunid)
+                               testrunid, monitor.test)
 
     def __newTestFinished(self, testrun, test, parentid=None):
         debug("testrun:%r, test:%r", testrun, test)
 
         tid = self.__tests[test]
 
+        # the output files are complete now
+        self.__moveOutputFilesToStore(test)
+
         # finally update the test
         updatestr = "UPDATE test SET resultpercentage=?, parentid=? WHERE id=?"
         resultpercentage = test.getSuccessPercentage()
         self._ExecuteCommit(updatestr, (resultpercentage, parentid, tid))
+        if testrun in self.__testruns:
+            self.__updateTestRunSummary(self.__testruns[testrun], tid,
+                                        resultpercentage)
+            if resultpercentage == 100.0 and tid in self.__signedtests:
+                self.__deleteFailureSignature(tid)
+        # that test is done, its row won't be updated anymore
+        self.__forgetTestRow(tid)
+
+    def __ensureTestRunSummary(self, testrunid):
+        if testrunid in self.__summaryruns:
+            return
+        res = self._FetchOne("SELECT testrunid FROM testrun_summary WHERE testrunid=?",
+                             (testrunid, ))
+        if res == None:
+            self._ExecuteCommit("INSERT INTO testrun_summary (testrunid) VALUES (?)",
+                                (testrunid, ))
+        self.__summaryruns.add(testrunid)
+
+    def __forgetTestRow(self, testid):
+        self.__summaries.pop(testid, None)
+        self.__signedtests.pop(testid, None)
+
+    def __updateTestRunSummary(self, testrunid, testid, resultpercentage,
+                               checklist=None):
+        """
+        Updates the testrun_summary of the given testrun with the latest
+        results of the given test id.
+
+        As in _computeTestRunSummary(), every test is counted, but only
+        those with a resultpercentage other than 100.0 are failed (not
+        those without result yet).
+
+        checklist : the list of (check item name, value) of the test, if
+        None the previous one will be used.
+        """
+        old = self.__summaries.get(testid, (0, 0, 0, 0, frozenset()))
+        if checklist == None:
+            failures = old[4]
+        else:
+            failures = frozenset([k for k, v in checklist if v == 0])
+        new = (1, int(resultpercentage != None and resultpercentage != 100.0),
+               int(CHECKLIST_TIMEOUT_ITEM in failures),
+               int(CHECKLIST_CRASH_ITEM in failures),
+               failures)
+        self.__summaries[testid] = new
+        deltas = [a - b for a, b in zip(new[:4], old[:4])]
+        self.__ensureTestRunSummary(testrunid)
+        if [x for x in deltas if x]:
+            self._ExecuteCommit("""UPDATE testrun_summary
+            SET nbtests=nbtests+?, nbfailed=nbfailed+?, nbtimedout=nbtimedout+?,
+            nbcrashed=nbcrashed+? WHERE testrunid=?""",
+                                tuple(deltas) + (testrunid, ), commit=False)
+        for name in new[4] - old[4]:
+            res = self._FetchOne("""SELECT nbfailed FROM testrun_summary_failures
+            WHERE testrunid=? AND name=?""", (testrunid, name))
+            if res == None:
+                self._ExecuteCommit("""INSERT INTO testrun_summary_failures
+                (testrunid, name, nbfailed) VALUES (?, ?, 1)""",
+                                    (testrunid, name), commit=False)
+            else:
+                self._ExecuteCommit("""UPDATE testrun_summary_failures
+                SET nbfailed=nbfailed+1 WHERE testrunid=? AND name=?""",
+                                    (testrunid, name), commit=False)
+        for name in old[4] - new[4]:
+            self._ExecuteCommit("""UPDATE testrun_summary_failures
+            SET nbfailed=nbfailed-1 WHERE testrunid=? AND name=?""",
+                                (testrunid, name), commit=False)
+
+
+    def __getFailureSignatureID(self, signature, testtype, description):
+        if signature in self.__signatureids:
+            return self.__signatureids[signature]
+        res = self._FetchOne("SELECT id FROM failure_signature WHERE signature=?",
+                             (signature, ))
+        if res:
+            sid = res[0]
+        else:
+            sid = self._ExecuteCommit("""INSERT INTO failure_signature
+            (signature, testtype, description) VALUES (?, ?, ?)""",
+                                      (signature, testtype, description),
+                                      commit=False)
+        self.__signatureids[signature] = sid
+        return sid
+
+    def __storeFailureSignature(self, testrunid, test, testid,
+                                resultpercentage, checklist, extras,
+                                crashsignature=None):
+        """
+        Updates the test_failure_signature entry of the given test id
+        """
+        if resultpercentage == None or resultpercentage == 100.0:
+            if testid in self.__signedtests:
+                self.__deleteFailureSignature(testid)
+            return
+        signature, desc = self._computeFailureSignature(test.getTestName(),
+                                                        checklist, extras,
+                                                        crashsignature)
+        sid = self.__getFailureSignatureID(signature, test.getTestName(), desc)
+        if self.__signedtests.get(testid) == sid:
+            return
+        if testid in self.__signedtests:
+            self._ExecuteCommit("""UPDATE test_failure_signature SET signatureid=?
+            WHERE testid=?""", (sid, testid), commit=False)
+        else:
+            self._ExecuteCommit("""INSERT INTO test_failure_signature
+            (testid, testrunid, signatureid) VALUES (?, ?, ?)""",
+                                (testid, testrunid, sid), commit=False)
+        self.__signedtests[testid] = sid
 
+    def __deleteFailureSignature(self, testid):
+        self._ExecuteCommit("DELETE FROM test_failure_signature WHERE testid=?",
+                            (testid, ), commit=False)
+        del self.__signedtests[testid]
 
     def __getTestClassMapping(self, testtype, dictname):
         debug("testtype:%r, dictname:%r", testtype, dictname)
@@ -1064,7 +2048,7 @@ class DBStorage(DataStorage, AsyncStorage):
         return self.__getTestClassMapping(testtype,
                                           "testclassinfo_outputfiles_dict")
 
-    def __storeDict(self, dicttable, containerid, pdict):
+    def __storeDict(self, dicttable, containerid, pdict, rowids=True):
         if not pdict:
             # empty dictionnary
             debug("Empty dictionnary, returning")
@@ -1073,9 +2057,17 @@ class DBStorage(DataStorage, AsyncStorage):
         keys = pdict.keys()
         keys.sort()
         return self.__storeList(dicttable, containerid,
-                                [(k,pdict[k]) for k in keys])
+                                [(k,pdict[k]) for k in keys],
+                                rowids=rowids)
+
+    def __storeList(self, dicttable, containerid, pdict, rowids=True):
+        """
+        Stores the (key, value) list in the given table.
 
-    def __storeList(self, dicttable, containerid, pdict):
+        If rowids is True, returns a dictionnary of the row ids of the
+        stored keys. If False, nothing is returned and the rows are stored
+        using _InsertMany().
+        """
         if not pdict:
             # empty dictionnary
             debug("Empty list, returning")
@@ -1098,17 +2090,21 @@ class DBStorage(DataStorage, AsyncStorage):
 
         pdict = flatten_tuple(pdict)
         dres = {}
+        # key : value column name, value : list of rows
+        groups = {}
 
         self._lock.acquire()
         try:
-            cur = self.con.cursor()
             insertstr = """INSERT INTO %s (containerid, name, %s)
             VALUES (?, ?, ?)"""
             for key, value in pdict:
                 debug("Adding key:%s , value:%r", key, value)
                 if value == None:
-                    self._ExecuteCommit("""INSERT INTO %s (containerid, name) VALUES (?, ?)""" % dicttable,
-                                        (containerid, key), commit=False, threadsafe=True)
+                    if rowids:
+                        self._ExecuteCommit("""INSERT INTO %s (containerid, name) VALUES (?, ?)""" % dicttable,
+                                            (containerid, key), commit=False, threadsafe=True)
+                    else:
+                        groups.setdefault(None, []).append((containerid, key))
                     continue
                 val = value
                 if isinstance(value, int):
@@ -1118,14 +2114,24 @@ class DBStorage(DataStorage, AsyncStorage):
                 else:
                     valstr = "txtvalue"
                     val = repr(value)
+                if not rowids:
+                    groups.setdefault(valstr, []).append((containerid, key, val))
+                    continue
                 comstr = insertstr % (dicttable, valstr)
                 #debug("instruction:%s", comstr)
                 #debug("%s, %s, %s", containerid, key, val)
                 dres[key] = self._ExecuteCommit(comstr, (containerid, key, val),
                                                 commit=False, threadsafe=True)
+            for valstr, rows in groups.iteritems():
+                columns = ["containerid", "name"]
+                if valstr:
+                    columns.append(valstr)
+                self._InsertMany(dicttable, columns, rows,
+                                 commit=False, threadsafe=True)
         finally:
             self._lock.release()
-            return dres
+            if rowids:
+                return dres
 
     def __getArguments(self, containerid, rawinfo=False):
         fullsearch = """SELECT testclassinfo_arguments_dict.name,
@@ -1191,8 +2197,226 @@ class DBStorage(DataStorage, AsyncStorage):
             res = self._FetchAll(fullsearch, (containerid, ))
         else:
             res = self._FetchAll(normalsearch, (containerid, ))
+        if not res:
+            # compact storage
+            res = self.__getCheckListBitmap(containerid, rawinfo)
         return list(res)
 
+    def __getCheckListBitmap(self, containerid, rawinfo=False):
+        res = self._FetchOne("""SELECT testclassinfo.type
+        FROM test, testclassinfo
+        WHERE test.id=? AND test.type=testclassinfo.id""", (containerid, ))
+        if not res:
+            return []
+        words = self._FetchAll("""SELECT word, success, failure, skipped, expectedfailure
+        FROM test_checklist_bitmap WHERE containerid=? ORDER BY word""",
+                               (containerid, ))
+        if not words:
+            return []
+        found = self.__decodeCheckListBitmap(res[0], words)
+        if rawinfo:
+            return found
+        names = dict(self._FetchAll("""SELECT id, name FROM testclassinfo_checklist_dict"""))
+        return [(names[cid], value) for cid, value in found]
+
+    def __decodeCheckListBitmap(self, testtype, words):
+        """
+        Returns the list of (checklist item id, value) stored in the given
+        (word, success, failure, skipped, expectedfailure) bitmaps of a
+        test of type 'testtype', in checklist order.
+        """
+        ids = self.__getCheckListPositions(testtype)[0]
+        found = []
+        for row in words:
+            word = row[0]
+            for value, bits in zip(CHECKLIST_BITMAP_VALUES, row[1:]):
+                if not bits:
+                    continue
+                for bit in range(CHECKLIST_BITMAP_BITS):
+                    pos = word * CHECKLIST_BITMAP_BITS + bit
+                    if bits & (1 << bit) and pos < len(ids):
+                        found.append((pos, ids[pos], value))
+        found.sort()
+        return [(cid, value) for pos, cid, value in found]
+
+    def __loadTestRunValues(self, testfilter, filterargs, tablename,
+                            classtable, columns, rawinfo=False):
+        """
+        Returns the (name, value) rows of the given test dict/list table
+        for all the tests matching the 'testfilter' condition, as a
+        dictionnary of test id to list of rows.
+
+        The value of a row is the first non-NULL column of 'columns'. If
+        rawinfo is True, or no classtable is given, names are the item ids.
+        """
+        if rawinfo or classtable == None:
+            searchstr = """SELECT d.containerid, d.name, %s
+            FROM %s d, test
+            WHERE %s AND d.containerid=test.id
+            ORDER BY d.id""" % (", ".join(["d." + c for c in columns]),
+                                tablename, testfilter)
+        else:
+            searchstr = """SELECT d.containerid, c.name, %s
+            FROM %s d, %s c, test
+            WHERE %s AND d.containerid=test.id AND d.name=c.id
+            ORDER BY d.id""" % (", ".join(["d." + c for c in columns]),
+                                tablename, classtable, testfilter)
+        res = {}
+        for row in self._FetchAll(searchstr, filterargs):
+            value = None
+            for v in row[2:]:
+                if v != None:
+                    value = v
+                    break
+            res.setdefault(row[0], []).append((row[1], value))
+        return res
+
+    def __loadTestRunCheckListBitmaps(self, testfilter, filterargs, types,
+                                      skip, rawinfo=False):
+        """
+        Returns the checklists stored as bitmaps of the tests matching the
+        'testfilter' condition, as a dictionnary of test id to list of
+        (name, value).
+
+        types : dictionnary of test id to test type
+        skip : test ids to ignore
+        """
+        words = {}
+        for row in self._FetchAll("""SELECT b.containerid, b.word, b.success,
+        b.failure, b.skipped, b.expectedfailure
+        FROM test_checklist_bitmap b, test
+        WHERE %s AND b.containerid=test.id
+        ORDER BY b.containerid, b.word""" % testfilter, filterargs):
+            if not row[0] in skip:
+                words.setdefault(row[0], []).append(row[1:])
+        if not words:
+            return {}
+        names = None
+        if not rawinfo:
+            names = dict(self._FetchAll("""SELECT id, name FROM testclassinfo_checklist_dict"""))
+        res = {}
+        for tid, twords in words.iteritems():
+            found = self.__decodeCheckListBitmap(types[tid], twords)
+            if names != None:
+                found = [(names[cid], value) for cid, value in found]
+            res[tid] = found
+        return res
+
+    def __getCheckListPositions(self, testtype):
+        """
+        Returns a tuple of:
+        * the list of checklist item ids of the given test type (including
+        those from its parents). The index of an item in that list is its
+        position in the checklist bitmaps.
+        * a dictionnary of checklist item name to position
+        * the list of checklist item names, by position
+        """
+        if testtype in self.__cpositions:
+            return self.__cpositions[testtype]
+        items = []
+        rp = testtype
+        while rp:
+            items.extend(self._FetchAll("""SELECT id, name
+            FROM testclassinfo_checklist_dict WHERE containerid=?""", (rp, )))
+            res = self._FetchOne("SELECT parent FROM testclassinfo WHERE type=?",
+                                 (rp, ))
+            rp = res and res[0]
+        # items are never removed, new ones always get higher ids, so
+        # sorting by id keeps the positions of existing items stable
+        items.sort()
+        ids = [cid for cid, name in items]
+        positions = {}
+        for pos, (cid, name) in enumerate(items):
+            # an item also defined by a parent or subclass keeps the
+            # position of the oldest (lowest id) of them, so that it never
+            # changes
+            positions.setdefault(name, pos)
+        res = (ids, positions, [name for cid, name in items])
+        if ids:
+            self.__cpositions[testtype] = res
+        return res
+
+    def _packCheckList(self, testtype, checklist):
+        """
+        Packs the given checklist (list of (check item name, value)) of a
+        test of type 'testtype' into bitmaps.
+
+        Returns a list of (word, success, failure, skipped, expectedfailure)
+        bitmaps. Items unknown to the test type are ignored.
+        """
+        positions = self.__getCheckListPositions(testtype)[1]
+        words = {}
+        for name, value in checklist:
+            if not name in positions or not value in CHECKLIST_BITMAP_VALUES:
+                debug("Can't store item %r:%r in bitmap", name, value)
+                continue
+            word, bit = divmod(positions[name], CHECKLIST_BITMAP_BITS)
+            bits = words.setdefault(word, [0, 0, 0, 0])
+            bits[CHECKLIST_BITMAP_VALUES.index(value)] |= 1 << bit
+        return [tuple([word] + bits) for word, bits in sorted(words.items())]
+
+    def _getCheckItemFilter(self, testtype, checkitems):
+        """
+        Returns a tuple of (tables, conditions, arguments) to add to a
+        query on the test table in order to only match tests of type
+        'testtype' whose checklist contains the given items.
+
+        checkitems : dictionnary of check item name to expected value
+        (one of Test.SUCCESS, Test.FAILURE, Test.SKIPPED,
+        Test.EXPECTED_FAILURE).
+
+        Returns None if the test type doesn't have some of the given items.
+        """
+        positions = self.__getCheckListPositions(testtype)[1]
+        # { word : { column : mask } }
+        masks = {}
+        for name, value in checkitems.iteritems():
+            if not name in positions or not value in CHECKLIST_BITMAP_VALUES:
+                return None
+            word, bit = divmod(positions[name], CHECKLIST_BITMAP_BITS)
+            column = CHECKLIST_BITMAP_COLUMNS[CHECKLIST_BITMAP_VALUES.index(value)]
+            wmasks = masks.setdefault(word, {})
+            wmasks[column] = wmasks.get(column, 0) | (1 << bit)
+        tables = []
+        conditions = []
+        args = []
+        for i, (word, wmasks) in enumerate(sorted(masks.items())):
+            table = "cb%d" % i
+            tables.append("test_checklist_bitmap %s" % table)
+            conditions.append("%s.containerid=test.id AND %s.word=?" % (table, table))
+            args.append(word)
+            for column, mask in sorted(wmasks.items()):
+                conditions.append("(%s.%s & ?)=?" % (table, column))
+                args.extend([mask, mask])
+        return (tables, conditions, args)
+
+    def findTestsByCheckItem(self, testtype, checkitems, testrunid=None):
+        """
+        Returns the list of test ids of type <testtype> (the name of the
+        test class) for which all the check items of the <checkitems>
+        dictionnary have the given values (one of Test.SUCCESS,
+        Test.FAILURE, Test.SKIPPED, Test.EXPECTED_FAILURE).
+
+        If specified, only tests belonging to the given testrunid will be
+        returned.
+        """
+        typeid = self._getTestTypeID(testtype)
+        if typeid == None:
+            return []
+        filt = self._getCheckItemFilter(testtype, checkitems)
+        if filt == None:
+            return []
+        tables, conditions, args = filt
+        searchstr = "SELECT test.id FROM %s WHERE test.type=? " % ", ".join(["test"] + tables)
+        args = [typeid] + args
+        if conditions:
+            searchstr += "AND " + " AND ".join(conditions) + " "
+        if not testrunid == None:
+            searchstr += "AND test.testrunid=? "
+            args.append(testrunid)
+        searchstr += "ORDER BY test.id"
+        return [x[0] for x in self._FetchAll(searchstr, args)]
+
     def __getOutputFiles(self, containerid, rawinfo=False):
         fullsearch = """SELECT testclassinfo_outputfiles_dict.name,
         test_outputfiles_dict.txtvalue
@@ -1246,12 +2470,20 @@ class DBStorage(DataStorage, AsyncStorage):
         # transform the dictionnary from names to ids
         maps = self.__getTestClassArgumentMapping(testtype)
         return self.__storeDict("test_arguments_dict",
-                               testid, map_dict(dic, maps))
+                               testid, map_dict(dic, maps), rowids=False)
 
     def __storeTestCheckListList(self, testid, dic, testtype):
+        if not dic:
+            return
+        self._InsertMany("test_checklist_bitmap",
+                         ["containerid", "word"] + CHECKLIST_BITMAP_COLUMNS,
+                         [(testid, ) + x for x in self._packCheckList(testtype, dic)],
+                         commit=False)
+        if self._compactchecklist:
+            return
         maps = self.__getTestClassCheckListMapping(testtype)
         return self.__storeList("test_checklist_list",
-                               testid, map_list(dic, maps))
+                               testid, map_list(dic, maps), rowids=False)
 
     def __storeTestExtraInfoDict(self, testid, dic, testtype):
         maps = self.__getTestClassExtraInfoMapping(testtype)
@@ -1260,17 +2492,67 @@ class DBStorage(DataStorage, AsyncStorage):
             nd = self.__storeTestClassExtraInfoDict("", dict((x,"") for x in unk))
             res.update(dict((nd[a],b) for a,b in dic.iteritems() if a in nd))
         return self.__storeDict("test_extrainfo_dict",
-                               testid, res)
+                               testid, res, rowids=False)
 
-    def __storeTestOutputFileDict(self, testid, dic, testtype):
+    def __storeTestOutputFileDict(self, testid, dic, testtype, test=None):
         maps = self.__getTestClassOutputFileMapping(testtype)
+        dic = map_dict(dic, maps)
+        if self._outputstore and test is not None and dic:
+            self.__outputfiles.setdefault(test, []).extend(
+                [(testid, name, path) for name, path in dic.iteritems()])
+        if test is not None:
+            dic = self.__getRelativeOutputFiles(test, dic)
         return self.__storeDict("test_outputfiles_dict",
-                               testid, map_dict(dic, maps))
+                               testid, dic, rowids=False)
+
+    def __getRelativeOutputFiles(self, test, dic):
+        """
+        Returns the given output files with their paths relative to the
+        output root of the testrun of the given test, if it has one.
+        """
+        testrun = test._testrun
+        root = testrun and testrun.getOutputRoot()
+        if not root:
+            return dic
+        prefix = root + os.sep
+        res = {}
+        for name, path in dic.iteritems():
+            if isinstance(path, basestring) and path.startswith(prefix):
+                path = path[len(prefix):]
+            res[name] = path
+        return res
+
+    def __moveOutputFilesToStore(self, test):
+        """
+        Moves the output files stored for the given test to the
+        OutputStore, replacing their paths by their digests.
+        """
+        pending = self.__outputfiles.pop(test, None)
+        if not pending:
+            return
+        rows = []
+        # key : path, value : digest, for the files of several iterations
+        # or monitors of the test which are the same (and already removed)
+        digests = {}
+        for containerid, name, path in pending:
+            digest = digests.get(path)
+            if digest is None:
+                try:
+                    digest = self._outputstore.store(path)
+                except (IOError, OSError):
+                    exception("Couldn't move %s to the output store", path)
+                    continue
+                digests[path] = digest
+            if digest:
+                rows.append((digest, containerid, name))
+        if rows:
+            self._ExecuteMany("""UPDATE test_outputfiles_dict SET txtvalue=?
+            WHERE containerid=? AND name=?""", rows)
 
     def __storeTestErrorExplanationDict(self, testid, dic, testtype):
         maps = self.__getTestClassCheckListMapping(testtype)
         return self.__storeDict("test_error_explanation_dict",
-                                testid, map_dict(dic, maps))
+                                testid, map_dict(dic, maps), rowids=False)
 
     def __storeTestClassArgumentsDict(self, testclass, dic):
         return self.__storeDict("testclassinfo_arguments_dict",
@@ -1290,7 +2572,7 @@ class DBStorage(DataStorage, AsyncStorage):
 
     def _storeEnvironmentDict(self, testrunid, dic):
         return self.__storeDict("testrun_environment_dict",
-                               testrunid, dic)
+                               testrunid, dic, rowids=False)
 
     def __rawInsertTestClassInfo(self, ctype, description,
                                  args, checklist,
@@ -1326,16 +2608,11 @@ class DBStorage(DataStorage, AsyncStorage):
         fdesc = testinstance.getTestFullDescription()
         if fdesc:
             fdesc.strip()
-        args = testinstance.getFullArgumentList()
-        if args:
-            args = dict([(key, val["description"]) for key,val in args.iteritems()])
-        checklist = testinstance.getFullCheckList()
-        if checklist:
-            checklist = dict([(key, val["description"]) for key,val in checklist.iteritems()])
-        extrainfo = testinstance.getFullExtraInfoList()
-        outputfiles = testinstance.getFullOutputFilesList()
-        if outputfiles:
-            outputfiles = dict([(key, val["description"]) for key,val in outputfiles.iteritems()])
+        schema = testinstance.getSchema()
+        args = schema.argumentdescriptions
+        checklist = schema.checklistdescriptions
+        extrainfo = schema.extrainfos
+        outputfiles = schema.outputfilesdescriptions
         parent = None
 
         self.__rawInsertTestClassInfo(ctype=ctype, description=desc,
@@ -1401,4 +2678,16 @@ class DBStorage(DataStorage, AsyncStorage):
 
 
 
-DB_SCHEME_VERSION = 3
+# check items used to count timed out and crashed tests in testrun_summary
+CHECKLIST_TIMEOUT_ITEM = "no-timeout"
+CHECKLIST_CRASH_ITEM = "subprocess-exited-normally"
+
+# Number of checklist items stored in each test_checklist_bitmap row.
+# Kept below 64 so that bitmaps fit in signed 64bit integers.
+CHECKLIST_BITMAP_BITS = 63
+# checklist values (Test.SUCCESS, Test.FAILURE, Test.SKIPPED,
+# Test.EXPECTED_FAILURE) and the test_checklist_bitmap column storing them
+CHECKLIST_BITMAP_VALUES = [1, 0, None, 2]
+CHECKLIST_BITMAP_COLUMNS = ["success", "failure", "skipped", "expectedfailure"]
+
+DB_SCHEME_VERSION = 6
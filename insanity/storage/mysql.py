@@ -35,6 +35,12 @@ try:
     class MySQLStorage(DBStorage):
         """
         MySQL based DBStorage
+
+        Reads done from other threads than the writing one (when used
+        asynchronously) go through a pool of up to 'readers' connections.
+
+        Rows of the dictionnary/list tables are inserted with multi-row
+        INSERT statements of up to 'insertrows' rows each.
         """
 
         _default_host = "localhost"
@@ -88,7 +94,7 @@ try:
 
         def __init__(self, host=_default_host, username=_default_user,
                      passwd=_default_pass, port=_default_port,
-                     dbname=_default_db,
+                     dbname=_default_db, readers=4, insertrows=500,
                      *args, **kwargs):
 
             self.__host = host
@@ -96,7 +102,8 @@ try:
             self.__username = username
             self.__passwd = passwd
             self.__dbname = dbname
-            DBStorage.__init__(self, *args, **kwargs)
+            self.__insertrows = max(1, insertrows)
+            DBStorage.__init__(self, readers=readers, *args, **kwargs)
 
         def __repr__(self):
             return "<%s %s@%s:%d>" % (type(self),
@@ -112,6 +119,12 @@ try:
                                   db=self.__dbname)
             return con
 
+        def _openReadConnection(self):
+            con = self._openDatabase()
+            # so that each query sees the latest committed data
+            con.autocommit(True)
+            return con
+
         def _getDatabaseSchemeVersion(self):
             """
             Returns the scheme version of the currently loaded databse
@@ -159,6 +172,22 @@ try:
             instruction = instruction.replace('?', '%s')
             return DBStorage._ExecuteMany(self, instruction, *args, **kwargs)
 
+        def _InsertMany(self, table, columns, rows, **kwargs):
+            """
+            Inserts the rows using multi-row INSERT statements.
+            """
+            if not rows:
+                return
+            rowstr = "(%s)" % ", ".join(["%s"] * len(columns))
+            prefix = "INSERT INTO %s (%s) VALUES " % (table, ", ".join(columns))
+            for i in range(0, len(rows), self.__insertrows):
+                chunk = rows[i:i + self.__insertrows]
+                values = []
+                for row in chunk:
+                    values.extend(row)
+                instruction = prefix + ", ".join([rowstr] * len(chunk))
+                DBStorage._ExecuteCommit(self, instruction, values, **kwargs)
+
         def _FetchAll(self, instruction, *args, **kwargs):
             """
             Executes the given SQL query and returns a list
@@ -182,6 +211,9 @@ try:
         def _getDBScheme(self):
             return DB_SCHEME
 
+        def _getAutoIncrementKey(self):
+            return "INTEGER NOT NULL AUTO_INCREMENT PRIMARY KEY"
+
 
     DB_SCHEME = """
     CREATE TABLE version (
@@ -196,6 +228,34 @@ try:
        stoptime INTEGER
     );
 
+    CREATE TABLE testrun_summary (
+       testrunid INTEGER NOT NULL PRIMARY KEY,
+       nbtests INTEGER NOT NULL DEFAULT 0,
+       nbfailed INTEGER NOT NULL DEFAULT 0,
+       nbtimedout INTEGER NOT NULL DEFAULT 0,
+       nbcrashed INTEGER NOT NULL DEFAULT 0
+    );
+    
+    CREATE TABLE testrun_summary_failures (
+       testrunid INTEGER NOT NULL,
+       name VARCHAR(255) NOT NULL,
+       nbfailed INTEGER NOT NULL DEFAULT 0,
+       PRIMARY KEY (testrunid, name)
+    );
+    
+    CREATE TABLE failure_signature (
+       id integer NOT NULL AUTO_INCREMENT PRIMARY KEY,
+       signature CHAR(40) NOT NULL UNIQUE,
+       testtype TEXT,
+       description TEXT
+    );
+    
+    CREATE TABLE test_failure_signature (
+       testid INTEGER NOT NULL PRIMARY KEY,
+       testrunid INTEGER NOT NULL,
+       signatureid INTEGER NOT NULL
+    );
+    
     CREATE TABLE client (
        id integer NOT NULL AUTO_INCREMENT PRIMARY KEY,
        software TEXT,
@@ -244,6 +304,16 @@ try:
        intvalue INTEGER
     );
 
+    CREATE TABLE test_checklist_bitmap (
+       containerid INTEGER NOT NULL,
+       word INTEGER NOT NULL,
+       success BIGINT NOT NULL DEFAULT 0,
+       failure BIGINT NOT NULL DEFAULT 0,
+       skipped BIGINT NOT NULL DEFAULT 0,
+       expectedfailure BIGINT NOT NULL DEFAULT 0,
+       PRIMARY KEY (containerid, word)
+    );
+
     CREATE TABLE test_extrainfo_dict (
        id integer NOT NULL AUTO_INCREMENT PRIMARY KEY,
        containerid INTEGER,
@@ -303,6 +373,8 @@ try:
     CREATE INDEX tc_of_dict_c_idx ON testclassinfo_outputfiles_dict (containerid);
 
     CREATE INDEX test_type_idx ON test (type);
+    CREATE INDEX t_f_sig_signatureid_idx ON test_failure_signature (signatureid, testrunid);
+    CREATE INDEX t_f_sig_testrunid_idx ON test_failure_signature (testrunid);
     """
 except ImportError:
     print "mysql-python (http://mysql-python.sourceforge.net/) is needed" \
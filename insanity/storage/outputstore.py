@@ -0,0 +1,175 @@
+# GStreamer QA system
+#
+#       storage/outputstore.py
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+"""
+Content-addressed store of the output files
+"""
+
+import os
+import re
+import gzip
+import shutil
+import hashlib
+import tempfile
+from insanity.log import debug, exception
+from insanity.utils import compress_file
+
+GZIP_MAGIC = "\x1f\x8b"
+
+_digestre = re.compile("^[0-9a-f]{40}$")
+
+def is_digest(value):
+    """
+    Returns True if the given output file value (as stored in a
+    DataStorage) is the digest of a file of an OutputStore, and False if
+    it is a plain path.
+    """
+    return isinstance(value, basestring) and _digestre.match(value) is not None
+
+def resolve_output_file(value, outputstore=None, outputroot=None):
+    """
+    Returns the path of an output file from its value as stored in a
+    DataStorage: its path in the given OutputStore if it was moved there,
+    else its path in the given outputroot (the "output-files-root"
+    environment information of its testrun) if it is relative to it,
+    else the value itself.
+    """
+    if outputstore is not None and is_digest(value):
+        path = outputstore.lookup(value)
+        if path is not None:
+            return path
+    if outputroot and isinstance(value, basestring) and \
+           not is_digest(value) and not os.path.isabs(value):
+        return os.path.join(outputroot, value)
+    return value
+
+class OutputStore(object):
+    """
+    Stores the output files by the SHA-1 digest of their contents, so that
+    identical files are only stored once.
+
+    The files are stored gzip-compressed (unless they already were) in a
+    directory tree sharded by the first characters of their digest:
+    <root>/3f/a2/3fa2...[.gz]
+
+    A DataStorage given an OutputStore only keeps the digests of the
+    output files. Use lookup() or open() to get them back.
+    """
+
+    def __init__(self, root, levels=2):
+        """
+        root : the directory of the store, created if needed.
+        levels : the number of levels of sub-directories.
+        """
+        self.root = os.path.abspath(root)
+        self._levels = levels
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+
+    def _getBlobDirectory(self, digest):
+        return os.path.join(self.root,
+                            *[digest[2 * i:2 * i + 2] for i in range(self._levels)])
+
+    def lookup(self, value):
+        """
+        Returns the path of the file stored for the given output file
+        value, or None if the store doesn't have it.
+
+        Values which aren't digests are paths of files stored before the
+        OutputStore was used, and are returned as is.
+        """
+        if not is_digest(value):
+            return value
+        directory = self._getBlobDirectory(value)
+        for name in (value + ".gz", value):
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def open(self, value):
+        """
+        Returns a file object reading the original contents of the file
+        stored for the given output file value, or None if the store
+        doesn't have it.
+        """
+        path = self.lookup(value)
+        if path is None or not os.path.exists(path):
+            return None
+        if is_digest(value) and path.endswith(".gz"):
+            return gzip.open(path, "rb")
+        return open(path, "rb")
+
+    def store(self, path, remove=True):
+        """
+        Adds the file at the given path to the store, and returns its
+        digest. If remove is True, the original file is then removed.
+
+        Returns None if there is no such file (like when it was already
+        stored and removed).
+        """
+        if not os.path.isfile(path):
+            return None
+        sha = hashlib.sha1()
+        f = open(path, "rb")
+        try:
+            buf = f.read(65536)
+            compressed = buf.startswith(GZIP_MAGIC)
+            while buf:
+                sha.update(buf)
+                buf = f.read(65536)
+        finally:
+            f.close()
+        digest = sha.hexdigest()
+        if self.lookup(digest) is None:
+            self._addBlob(path, digest, compressed)
+        else:
+            debug("%s already stored as %s", path, digest)
+        if remove:
+            os.remove(path)
+        return digest
+
+    def _addBlob(self, path, digest, compressed):
+        directory = self._getBlobDirectory(digest)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created meanwhile by another process
+                if not os.path.isdir(directory):
+                    raise
+        if compressed:
+            name = digest
+        else:
+            name = digest + ".gz"
+        # written aside and renamed so that a blob is always complete
+        fd, tmppath = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+        os.close(fd)
+        try:
+            if compressed:
+                shutil.copyfile(path, tmppath)
+            else:
+                compress_file(path, tmppath)
+            os.chmod(tmppath, 0644)
+            os.rename(tmppath, os.path.join(directory, name))
+        except:
+            exception("Couldn't store %s", path)
+            os.remove(tmppath)
+            raise
+        debug("stored %s as %s", path, digest)
@@ -38,15 +38,30 @@ class SQLiteStorage(DBStorage):
     Stores data in a sqlite db
 
     The 'async' setting will allow all writes to be serialized in a separate thread,
-    allowing the testing to carry on.
+    allowing the testing to carry on. Pending writes are committed in batches
+    of up to 'batchsize' actions, and writers will block if more than
+    'maxqueue' actions are pending.
 
     If you are only using the database for reading information, you should use
     async=False and only use the storage object from one thread.
+
+    The database is opened in WAL journal mode, so that other processes (the
+    web interface, insanity-dumpresults, ...) can read it while tests are
+    being written. When used asynchronously, reads done from other threads
+    than the writing one use a pool of up to 'readers' read-only connections
+    and never wait for pending writes.
+
+    'synchronous' and 'cachesize' are passed on as the corresponding sqlite
+    PRAGMAs (a negative cachesize is in KiB, a positive one in pages).
     """
 
-    def __init__(self, path, *args, **kwargs):
+    def __init__(self, path, journalmode="WAL", synchronous="NORMAL",
+                 cachesize=-8192, readers=4, *args, **kwargs):
         self.path = path
-        DBStorage.__init__(self, *args, **kwargs)
+        self.__journalmode = journalmode
+        self.__synchronous = synchronous
+        self.__cachesize = cachesize
+        DBStorage.__init__(self, readers=readers, *args, **kwargs)
 
     def __repr__(self):
         return "<%s %s>" % (type(self), self.path)
@@ -54,11 +69,45 @@ class SQLiteStorage(DBStorage):
     # DBStorage methods implementation
     def _openDatabase(self):
         debug("opening sqlite db for path '%s'", self.path)
+        con = self.__connect()
+        if self.__journalmode and self.path != ":memory:":
+            mode = con.execute("PRAGMA journal_mode=%s" % self.__journalmode).fetchone()
+            if mode and mode[0].lower() != self.__journalmode.lower():
+                warning("Could not switch sqlite db to %s journal mode (using %s)",
+                        self.__journalmode, mode[0])
+        if self.__synchronous:
+            con.execute("PRAGMA synchronous=%s" % self.__synchronous)
+        return con
+
+    def __connect(self):
         con = sqlite.connect(self.path, check_same_thread=False)
         # we do this so that we can store UTF8 strings in the database
         con.text_factory = str
+        if self.__cachesize:
+            con.execute("PRAGMA cache_size=%d" % self.__cachesize)
+        return con
+
+    def _openReadConnection(self):
+        con = self.__connect()
+        con.execute("PRAGMA query_only=ON")
         return con
 
+    def _useReadConnection(self):
+        if self.path == ":memory:":
+            return False
+        return DBStorage._useReadConnection(self)
+
+    def _attachDatabase(self, otherdb, name):
+        if not isinstance(otherdb, SQLiteStorage):
+            return False
+        if ":memory:" in (self.path, otherdb.path):
+            return False
+        self._ExecuteCommit("ATTACH DATABASE ? AS %s" % name, (otherdb.path, ))
+        return True
+
+    def _detachDatabase(self, name):
+        self._ExecuteCommit("DETACH DATABASE %s" % name)
+
     def _ExecuteScript(self, instructions, *args, **kwargs):
         """
         Executes the given script.
@@ -71,7 +120,7 @@ class SQLiteStorage(DBStorage):
         try:
             cur = self.con.cursor()
             cur.executescript(instructions, *args, **kwargs)
-            if commit:
+            if commit and not self._isCommitDeferred():
                 self.con.commit()
         finally:
             if not threadsafe:
@@ -124,6 +173,34 @@ CREATE TABLE testrun (
    stoptime INTEGER
 );
 
+CREATE TABLE testrun_summary (
+   testrunid INTEGER NOT NULL PRIMARY KEY,
+   nbtests INTEGER NOT NULL DEFAULT 0,
+   nbfailed INTEGER NOT NULL DEFAULT 0,
+   nbtimedout INTEGER NOT NULL DEFAULT 0,
+   nbcrashed INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE testrun_summary_failures (
+   testrunid INTEGER NOT NULL,
+   name VARCHAR(255) NOT NULL,
+   nbfailed INTEGER NOT NULL DEFAULT 0,
+   PRIMARY KEY (testrunid, name)
+);
+
+CREATE TABLE failure_signature (
+   id INTEGER PRIMARY KEY,
+   signature CHAR(40) NOT NULL UNIQUE,
+   testtype TEXT,
+   description TEXT
+);
+
+CREATE TABLE test_failure_signature (
+   testid INTEGER NOT NULL PRIMARY KEY,
+   testrunid INTEGER NOT NULL,
+   signatureid INTEGER NOT NULL
+);
+
 CREATE TABLE client (
    id INTEGER PRIMARY KEY,
    software TEXT,
@@ -172,6 +249,16 @@ CREATE TABLE test_checklist_list (
    intvalue INTEGER
 );
 
+CREATE TABLE test_checklist_bitmap (
+   containerid INTEGER NOT NULL,
+   word INTEGER NOT NULL,
+   success BIGINT NOT NULL DEFAULT 0,
+   failure BIGINT NOT NULL DEFAULT 0,
+   skipped BIGINT NOT NULL DEFAULT 0,
+   expectedfailure BIGINT NOT NULL DEFAULT 0,
+   PRIMARY KEY (containerid, word)
+);
+
 CREATE TABLE test_extrainfo_dict (
    id INTEGER PRIMARY KEY,
    containerid INTEGER,
@@ -238,4 +325,6 @@ CREATE INDEX tc_ei_dict_c_idx ON testclassinfo_extrainfo_dict (containerid, name
 CREATE INDEX tc_of_dict_c_idx ON testclassinfo_outputfiles_dict (containerid, name);
 
 CREATE INDEX test_type_idx ON test (type);
+CREATE INDEX t_f_sig_signatureid_idx ON test_failure_signature (signatureid, testrunid);
+CREATE INDEX t_f_sig_testrunid_idx ON test_failure_signature (testrunid);
 """
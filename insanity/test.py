@@ -25,6 +25,8 @@ Base Test Classes
 
 import os
 import time
+import threading
+from array import array
 
 from insanity.log import error, warning, debug, info, exception
 import insanity.utils as utils
@@ -41,6 +43,22 @@ import gobject
 #      |
 #      +--- PythonDBusTest
 
+class IterationResult(object):
+    """
+    What is kept of a stopped iteration of a Test, until it is released
+    (see Test.releaseIteration()).
+
+    checklist is an array of the values of the test's check items, in the
+    order of Test._checkitems, with SKIPPED stored as -1.
+    """
+    __slots__ = ("checklist", "extrainfo", "outputfiles", "successpercentage")
+
+    def __init__(self, checklist, extrainfo, outputfiles, successpercentage):
+        self.checklist = checklist
+        self.extrainfo = extrainfo
+        self.outputfiles = outputfiles
+        self.successpercentage = successpercentage
+
 class Test(gobject.GObject):
     """
     Runs a series of commands
@@ -213,10 +231,18 @@ class Test(gobject.GObject):
         self._running = False
         self.arguments = utils.unicode_dict(kwargs)
         self.iteration_arguments = {}
-        self.iteration_checklist = {}
-        self.iteration_extrainfo = {}
-        self.iteration_outputfiles = {}
-        self.iteration_success_percentage = {}
+        # IterationResult of each stopped iteration not released yet
+        self._iterations = {}
+        # iterations released by the storage (from its own thread), only
+        # dropped from the main thread in start() and stop()
+        self._releasedlock = threading.Lock()
+        self._releasediterations = set()
+        # running totals of the checklists of all stopped iterations,
+        # updated once per iteration in stop()
+        self._nbitems = 0
+        self._nbsucceeded = 0
+        self._nbexpectedfailures = 0
+        self._nbskipped = 0
         self._iteration = 0
         self._stopping = False
 
@@ -227,6 +253,10 @@ class Test(gobject.GObject):
         # populate checklist with all possible checkitems
         # initialize checklist to False
         self._populateChecklist()
+        # check item names, by position in IterationResult.checklist
+        self._checkitems = sorted(set(utils.intern_dict(self._possiblechecklist).keys()
+                                      + ["no-unexpected-failures"]))
+        self._checkpositions = dict((k, i) for i, k in enumerate(self._checkitems))
         self._extrainfo = {}
         self._testrun = testrun
 
@@ -272,7 +302,8 @@ class Test(gobject.GObject):
         for ofname in oflist.iterkeys():
             if global_files == oflist[ofname]["global"]:
                 if not ofname in self._outputfiles or not global_files:
-                    ofd, opath = self._testrun.get_temp_file(nameid=ofname)
+                    ofd, opath = self._testrun.get_temp_file(nameid=ofname,
+                                                             test=self)
                     debug("created temp file name '%s' for outputfile '%s' [%s]",
                           opath, ofname, self.uuid)
                     self._outputfiles[ofname] = opath
@@ -447,12 +478,43 @@ class Test(gobject.GObject):
             notimeout = True
         self.validateChecklistItem("no-timeout", notimeout)
         self._stopMonitors()
+
+        self._dropReleasedIterations()
+        # the results are recorded before emitting 'stop', so that the
+        # storage can get them from the signal handlers
+        checklist = self._evaluateCheckList(self._checklist, self._extrainfo)
+        self._addIterationTotals(checklist)
+        self._iterations[self._iteration] = IterationResult(checklist,
+                                                            self._extrainfo,
+                                                            self._outputfiles,
+                                                            self.getSuccessPercentage())
         self.emit("stop", self._iteration)
 
-        self.iteration_checklist[self._iteration] = self._checklist
-        self.iteration_extrainfo[self._iteration] = self._extrainfo
-        self.iteration_outputfiles[self._iteration] = self._outputfiles
-        self.iteration_success_percentage[self._iteration] = self.getSuccessPercentage()
+    def _addIterationTotals(self, checklist, sign=1):
+        self._nbitems += sign * len(self._possiblechecklist)
+        for val in checklist:
+            if val == -1:
+                self._nbskipped += sign
+                continue
+            if val >= self.SUCCESS:
+                self._nbsucceeded += sign
+            if val == self.EXPECTED_FAILURE:
+                self._nbexpectedfailures += sign
+
+    def _updateStoppedCheckList(self):
+        """
+        Re-evaluates the checklist of the latest stopped iteration, for
+        items validated after it stopped (like when tearing down).
+        """
+        result = self._iterations.get(self._iteration)
+        if result is None:
+            return
+        # the unexpected failures were already logged when it stopped
+        checklist = self._evaluateCheckList(self._checklist, result.extrainfo,
+                                            warn=False)
+        self._addIterationTotals(result.checklist, -1)
+        self._addIterationTotals(checklist)
+        result.checklist = checklist
 
     def _stopMonitors(self):
         for monitorinstance in self._monitorinstances:
@@ -460,11 +522,6 @@ class Test(gobject.GObject):
                 info("Could not stop monitor %s", monitorinstance)
                 continue
 
-            ofiles =  monitorinstance.getIterationOutputFiles(self._iteration)
-            if ofiles:
-                self.iteration_outputfiles.update(ofiles)
-
-
     def start(self):
         """
         Starts the test.
@@ -500,13 +557,15 @@ class Test(gobject.GObject):
         self.emit("start", self._iteration)
         self.validateChecklistItem("test-started")
         if self._iteration > 1:
-            iteraction_checklist = self.getIterationCheckList(self._iteration - 1, False)
+            iteraction_checklist = self.getIterationCheckList(self._iteration - 1)
             for item, value in self.getFullCheckList().iteritems():
                 if value.get("global", False):
                     for name, res in iteraction_checklist:
                         if item == name:
                             self.validateChecklistItem(name, res)
                             break
+        # the previous iteration isn't needed anymore
+        self._dropReleasedIterations()
 
         # start timeout for test !
         self._testtimeouttime = time.time() + self._timeout
@@ -558,6 +617,9 @@ class Test(gobject.GObject):
             if explanation is not None:
                 self._error_explanations[checkitem] = explanation
 
+        if self._stopping:
+            self._updateStoppedCheckList()
+
         self.emit("check", checkitem, validated)
 
     def isExpectedFailure(self, checkitem, extra_info):
@@ -601,6 +663,9 @@ class Test(gobject.GObject):
         Called by the test itself
         """
         info("uuid:%s, key:%s, value:%r", self.uuid, key, value)
+        if isinstance(key, str):
+            # the same keys are given for every iteration
+            key = intern(key)
         self._extrainfo[key] = value
         self.emit("extra-info", key, value)
 
@@ -666,14 +731,13 @@ class Test(gobject.GObject):
                 break
         return dc
 
-    def getIterationCheckList(self, iteration, warn=True):
+    def _evaluateCheckList(self, checklist, extrainfo, warn=True):
         """
-        Returns the instance checklist as a list of tuples of:
-        * checkitem name
-        * value indicating whether the success of that checklist item
-           That value can be one of: SKIPPED, SUCCESS, FAILURE, EXPECTED_FAILURE
+        Returns the IterationResult checklist array of the given list of
+        validated (checkitem, bool).
+
+        If warn is True, the unexpected failures are logged.
         """
-        allk = self.getFullCheckList().keys()
         unexpected_failures = []
 
         def to_enum(key, val):
@@ -685,12 +749,12 @@ class Test(gobject.GObject):
                 unexpected_failures.append(key)
                 return self.FAILURE
 
-        d = dict((k, to_enum(k, v)) for k, v in self.iteration_checklist[iteration])
+        d = dict((k, to_enum(k, v)) for k, v in checklist)
         d["no-unexpected-failures"] = 1
 
-        for k in allk:
+        for k in self._checkitems:
             if k not in d:
-                if self.isExpectedResult(k, self.SKIPPED, self.iteration_extrainfo[iteration]):
+                if self.isExpectedResult(k, self.SKIPPED, extrainfo):
                     d[k] = self.EXPECTED_FAILURE
                 else:
                     unexpected_failures.append(k)
@@ -702,52 +766,116 @@ class Test(gobject.GObject):
                         unexpected_failures)
             d["no-unexpected-failures"] = 0
 
-        return d.items()
+        res = array("b", [-1] * len(self._checkitems))
+        for k, v in d.iteritems():
+            if v != self.SKIPPED:
+                res[self._checkpositions[k]] = v
+        return res
+
+    def getIterationCheckList(self, iteration):
+        """
+        Returns the instance checklist as a list of tuples of:
+        * checkitem name
+        * value indicating whether the success of that checklist item
+           That value can be one of: SKIPPED, SUCCESS, FAILURE, EXPECTED_FAILURE
+
+        The checklist of an iteration is evaluated when it is stopped, which
+        is also when its unexpected failures get logged.
+
+        Returns an empty list if the iteration was released.
+        """
+        if not iteration in self._iterations:
+            return []
+        res = []
+        for k, v in zip(self._checkitems, self._iterations[iteration].checklist):
+            if v == -1:
+                v = self.SKIPPED
+            res.append((k, v))
+        return res
 
     def prepareIteration(self,args):
         # arguments are prepared before starting
-        self.iteration_arguments[self._iteration + 1] = args
+        self.iteration_arguments[self._iteration + 1] = utils.intern_dict(args)
+
+    def releaseIteration(self, iteration):
+        """
+        Marks the given stopped iteration as stored, so that what is kept
+        in memory about it can be dropped. Only the totals used by
+        getSuccessPercentage() and getCheckListTotals() remain.
+
+        Can be called from any thread, the iteration is dropped from the
+        main thread when the next one starts (once its global check items
+        were carried over) or stops. The latest stopped iteration is
+        always kept.
+        """
+        self._releasedlock.acquire()
+        try:
+            self._releasediterations.add(iteration)
+        finally:
+            self._releasedlock.release()
+
+    def _dropReleasedIterations(self):
+        """
+        Drops the released iterations older than the current one.
+        """
+        self._releasedlock.acquire()
+        try:
+            dropped = [iteration for iteration in self._releasediterations
+                       if iteration < self._iteration]
+            self._releasediterations.difference_update(dropped)
+        finally:
+            self._releasedlock.release()
+        for iteration in dropped:
+            self._iterations.pop(iteration, None)
+            self.iteration_arguments.pop(iteration, None)
+
+    def getIteration(self):
+        """
+        Returns the number of the current iteration, or of the latest
+        stopped one if the test isn't running.
+        """
+        return self._iteration
 
     def getIterationArguments(self,iteration):
         """
         Returns the list of arguments for the given test
         """
-        validkeys = self.getFullArgumentList()
-        # Hide expected-failures from the storage backend.
-        validkeys.pop("expected-failures", [])
-        res = {}
         if not iteration in self.iteration_arguments:
-            return res
-        args = self.iteration_arguments[iteration]
-        for key in args.iterkeys():
-            if key in validkeys:
-                res[key] = args[key]
-        return res
+            return {}
+        return self.getSchema().filterStoredArguments(self.iteration_arguments[iteration])
 
     def getIterationSuccessPercentage(self,iteration):
-        return self.iteration_success_percentage[iteration]
+        if not iteration in self._iterations:
+            return None
+        return self._iterations[iteration].successpercentage
 
     def getSuccessPercentage(self):
         """
         Returns the success rate of this instance as a float
         """
-        total_nbitems = 0
-        total_nbsucc = 0
-        for iteration in self.iteration_checklist:
-            ckl = self.getIterationCheckList(iteration)
-            nbitems = len(self._possiblechecklist)
-            nbsucc = len([item for item, val in ckl if val >= 1])
-            total_nbitems = total_nbitems + nbitems
-            total_nbsucc = total_nbsucc + nbsucc
-        if total_nbitems == 0:
+        if self._nbitems == 0:
             return 0.0
-        return (100.0 * total_nbsucc) / total_nbitems
+        return (100.0 * self._nbsucceeded) / self._nbitems
+
+    def getCheckListTotals(self):
+        """
+        Returns the totals of the checklists of all the stopped iterations
+        as a tuple of:
+        * the number of check items
+        * the number of succeeded items (including expected failures)
+        * the number of expected failures
+        * the number of skipped items
+        """
+        return (self._nbitems, self._nbsucceeded, self._nbexpectedfailures,
+                self._nbskipped)
 
     def getIterationExtraInfo(self,iteration):
         """
         Returns the extra-information dictionnary
         """
-        return self.iteration_extrainfo[iteration]
+        if not iteration in self._iterations:
+            return {}
+        return self._iterations[iteration].extrainfo
 
     def getOutputFiles(self):
         """
@@ -759,7 +887,9 @@ class Test(gobject.GObject):
         """
         Returns the output files generated by the test
         """
-        return self.iteration_outputfiles[iteration]
+        if not iteration in self._iterations:
+            return {}
+        return self._iterations[iteration].outputfiles
 
     def getErrorExplanations(self):
         """
@@ -847,6 +977,13 @@ class Test(gobject.GObject):
         """
         return self.getFullCheckList().get(checkitem, None).get("likely_error", None)
 
+    def getSchema(self):
+        """
+        Returns the TestSchema of the test's arguments, checklist, extra
+        information and output files.
+        """
+        raise NotImplementedError
+
     def getFullCheckList(self):
         raise NotImplementedError
 
@@ -29,6 +29,101 @@ import subprocess
 import signal
 import json
 from insanity.log import error, warning, debug, info, exception
+try:
+    import dbus
+except ImportError:
+    dbus = None
+
+def _to_boolean(value):
+    return (value == "True" or value == "true" or value == "TRUE" or value == "1")
+
+def _to_unchanged(value):
+    return value
+
+# argument type (as given in the test metadata) : converter of the
+# argument values passed to the test
+ARGUMENT_CONVERTERS = {
+    "s" : _to_unchanged,
+    "d" : float,
+    "b" : _to_boolean,
+    }
+if dbus:
+    ARGUMENT_CONVERTERS["i"] = lambda v: dbus.Int32(int(v))
+    ARGUMENT_CONVERTERS["I"] = lambda v: dbus.Int64(int(v))
+    ARGUMENT_CONVERTERS["u"] = lambda v: dbus.UInt32(int(v))
+    ARGUMENT_CONVERTERS["U"] = lambda v: dbus.UInt64(int(v))
+
+class TestSchema(object):
+    """
+    Read-only tables derived from the full argument, checklist, extra
+    info and output files lists of a test, computed once so that they
+    don't need to be rebuilt for every test instance or iteration.
+
+    The dictionnaries must not be modified.
+    """
+    __slots__ = ("arguments", "checklist", "extrainfos", "outputfiles",
+                 "converters", "globalarguments", "storedarguments",
+                 "checkitems", "extrainfonames", "argumentdescriptions",
+                 "checklistdescriptions", "outputfilesdescriptions")
+
+    def __init__(self, arguments, checklist, extrainfos, outputfiles):
+        def init(name, value):
+            object.__setattr__(self, name, value)
+
+        def descriptions(adict):
+            return dict([(key, val["description"]) for key, val in adict.iteritems()])
+
+        arguments = arguments or {}
+        checklist = checklist or {}
+        extrainfos = extrainfos or {}
+        outputfiles = outputfiles or {}
+        init("arguments", arguments)
+        init("checklist", checklist)
+        init("extrainfos", extrainfos)
+        init("outputfiles", outputfiles)
+        # argument name : converter, arguments of unknown types are ignored
+        init("converters", dict([(key, ARGUMENT_CONVERTERS[val["type"]])
+                                for key, val in arguments.iteritems()
+                                if val.get("type") in ARGUMENT_CONVERTERS]))
+        init("globalarguments", frozenset([key for key, val in arguments.iteritems()
+                                          if val.get("global") == True]))
+        # expected-failures is hidden from the storage backend
+        init("storedarguments", frozenset(arguments) - frozenset(["expected-failures"]))
+        init("checkitems", tuple(sorted(checklist)))
+        init("extrainfonames", tuple(sorted(extrainfos)))
+        init("argumentdescriptions", descriptions(arguments))
+        init("checklistdescriptions", descriptions(checklist))
+        init("outputfilesdescriptions", descriptions(outputfiles))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TestSchema is read-only")
+
+    def convertArguments(self, arguments, onlyglobal=False):
+        """
+        Returns the given arguments converted to their types, without the
+        ones unknown to the test.
+
+        If onlyglobal is True, only the global arguments are returned.
+        """
+        res = {}
+        converters = self.converters
+        globalarguments = self.globalarguments
+        for key, value in arguments.iteritems():
+            if not key in converters:
+                continue
+            if onlyglobal and not key in globalarguments:
+                continue
+            res[key] = converters[key](value)
+        return res
+
+    def filterStoredArguments(self, arguments):
+        """
+        Returns the given arguments without the ones which shouldn't be
+        stored.
+        """
+        storedarguments = self.storedarguments
+        return dict([(key, value) for key, value in arguments.iteritems()
+                     if key in storedarguments])
 
 class TestMetadata():
     """
@@ -109,6 +204,7 @@ class TestMetadata():
         self.__test_output_files__ = self.get_metadata (metadata, "__output_files__")
         self.__test_checklist__ = self.get_metadata (metadata, "__checklist__")
         self.__test_extra_infos__ = self.get_metadata (metadata, "__extra_infos__")
+        self.__test_cost__ = float(self.get_metadata (metadata, "__cost__") or 1.0)
         info('It is a valid test')
 
         mod = sys.modules["insanity.dbustest"]
@@ -116,13 +212,39 @@ class TestMetadata():
         # get class
         cls = mod.__dict__.get("DBusTest")
         self.__test_class__ = cls
+        self.__test_schema__ = TestSchema(self.__getFullList(cls.getClassFullArgumentList(),
+                                                             self.__test_arguments__),
+                                          self.__getFullList(cls.getClassFullCheckList(),
+                                                             self.__test_checklist__),
+                                          self.__getFullList(cls.getClassFullExtraInfoList(),
+                                                             self.__test_extra_infos__),
+                                          self.__getFullList(cls.getClassFullOutputFilesList(),
+                                                             self.__test_output_files__))
         return True
 
+    def __getFullList(self, classlist, testlist):
+        if testlist != None:
+            classlist.update(testlist)
+        return classlist
+
     def get_metadata(self, metadata, key):
         if not key in metadata:
             return None
         return metadata[key]
 
+    def getSchema(self):
+        """
+        Returns the TestSchema of the test.
+        """
+        return self.__test_schema__
+
+    def getCost(self):
+        """
+        Returns the cost of the test as declared in its metadata, that is
+        roughly the number of CPUs it uses (default : 1.0).
+        """
+        return self.__test_cost__
+
     def getFullCheckList(self):
         """
         Returns the full test checklist. This is used to know all the
@@ -135,10 +257,7 @@ class TestMetadata():
             description: short description
             likely_error: The likely error
         """
-        dc = self.__test_class__.getClassFullCheckList()
-        if self.__test_checklist__ != None:
-            dc.update(self.__test_checklist__)
-        return dc
+        return dict(self.__test_schema__.checklist)
 
     def getFullArgumentList(self):
         """
@@ -153,26 +272,17 @@ class TestMetadata():
             type: type string
             default_value: default value as string
         """
-        dc = self.__test_class__.getClassFullArgumentList()
-        if self.__test_arguments__ != None:
-            dc.update(self.__test_arguments__)
-        return dc
+        return dict(self.__test_schema__.arguments)
 
     def getFullExtraInfoList(self):
         """
         Returns the full list of extra info with descriptions.
         """
-        dc = self.__test_class__.getClassFullExtraInfoList()
-        if self.__test_extra_infos__ != None:
-            dc.update(self.__test_extra_infos__)
-        return dc
+        return dict(self.__test_schema__.extrainfos)
 
     def getFullOutputFilesList(self):
         """
         Returns the full list of output files with descriptions.
         """
-        dc = self.__test_class__.getClassFullOutputFilesList()
-        if self.__test_output_files__ != None:
-            dc.update(self.__test_output_files__)
-        return dc
+        return dict(self.__test_schema__.outputfiles)
 
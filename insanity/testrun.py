@@ -39,6 +39,7 @@ import gobject
 import time
 import dbus.gobject_service
 import tempfile
+import shutil
 import os
 from insanity.log import error, warning, debug, info
 from insanity.test import PythonDBusTest
@@ -112,12 +113,27 @@ class TestRun(gobject.GObject):
                                  (gobject.TYPE_STRING, ))
         }
 
-    def __init__(self, maxnbtests=1, workingdir=None, env=None, clientid=None):
+    def __init__(self, maxnbtests=1, workingdir=None, env=None, clientid=None,
+                 sharedregistry=True, outputlayout="flat"):
         """
         maxnbtests : Maximum number of tests to run simultaneously in each batch.
         workingdir : Working directory (default : getcwd() + /workingdir/)
         env : extra environment variables
+        sharedregistry : if True, a GStreamer registry per installed
+        GStreamer version is built in a directory of the working directory
+        private to this TestRun when it starts, and used read-only by all
+        its tests, instead of each test checking its own registry.
+        outputlayout : how the output files are laid out in the
+        outputfiles directory of the working directory, one of:
+        * "flat" : all the files in that directory
+        * "sharded" : the files of each test in their own directory,
+          <run directory>/<first 2 chars of the test uuid>/<test uuid>/,
+          the run directory being unique to this TestRun. The output
+          files are then stored relative to the run directory, whose
+          path is in the "output-files-root" environment information.
         """
+        if not outputlayout in ("flat", "sharded"):
+            raise ValueError("Unknown output layout %r" % outputlayout)
         gobject.GObject.__init__(self)
         # dbus
         self._bus = None
@@ -128,11 +144,20 @@ class TestRun(gobject.GObject):
 
         self._tests = [] # list of (test, arguments, monitors, kwargs)
         self._storage = None
+        self._scheduler = None
+        self._isolation = None
         self._currenttest = None
         self._currentmonitors = None
         self._currentkwargs = None
         self._currentarguments = None
+        # True if the current batch wasn't started yet
+        self._batchpending = False
+        # True while waiting for the scheduler to grant the slots of the
+        # current batch
+        self._waitingslots = False
         self._runninginstances = []
+        # key : running test, value : (cost, cost key) for the scheduler
+        self._testcosts = {}
         self._maxnbtests = maxnbtests
         self._starttime = None
         self._stoptime = None
@@ -144,6 +169,15 @@ class TestRun(gobject.GObject):
         self._env = os.environ.copy()
         if env:
             self._env.update(env)
+        # environment variables set for all the tests
+        self._testenv = {}
+        self._sharedregistry = sharedregistry
+        self._registrybuildtime = None
+        # directory of the shared registries, removed at the end of the run
+        self._registrydir = None
+        self._outputlayout = outputlayout
+        # directory of the output files of this run, in the sharded layout
+        self._rundir = None
         self._running = False
         self.setWorkingDirectory(workingdir or os.path.join(os.getcwd(), "workingdir"))
 
@@ -156,7 +190,10 @@ class TestRun(gobject.GObject):
         if self._running:
             error("TestRun is already running")
             return
-        self._collectEnvironment()
+        if self._sharedregistry:
+            self._buildRegistry()
+        else:
+            self._collectEnvironment()
 
     def abort(self):
         """
@@ -165,6 +202,10 @@ class TestRun(gobject.GObject):
         # TODO : fill
         for test in self._runninginstances:
             test.stop()
+        self._running = False
+        if self._scheduler:
+            self._scheduler.remove(self)
+        self._removeRegistry()
         self.emit("aborted")
 
     def setStorage(self, storage):
@@ -173,6 +214,27 @@ class TestRun(gobject.GObject):
         """
         self._storage = storage
 
+    def setScheduler(self, scheduler):
+        """
+        Use the given SlotScheduler to share the test slots with other
+        TestRuns. Each test also needs slots from it to be started, as
+        many as its cost (see getTestCost).
+        """
+        self._scheduler = scheduler
+
+    def setIsolationProfile(self, profile):
+        """
+        Use the given IsolationProfile to isolate the processes of the
+        tests from each other.
+        """
+        self._isolation = profile
+
+    def getIsolationProfile(self):
+        """
+        Returns the IsolationProfile of the tests, or None.
+        """
+        return self._isolation
+
     def addTest(self, test, arguments, monitors=None, kwargs={}):
         """
         Adds test with the given arguments (or generator) and monitors
@@ -201,6 +263,13 @@ class TestRun(gobject.GObject):
         """
         return self._environment
 
+    def getTestEnvironmentVariables(self):
+        """
+        Returns the dictionnary of environment variables to set for all
+        the tests of this testrun.
+        """
+        return self._testenv
+
     ## PRIVATE API
 
     def _setupPrivateBus(self):
@@ -225,6 +294,30 @@ class TestRun(gobject.GObject):
         elif oldowner == "":
             self.emit("new-remote-test", uuid)
 
+    def _buildRegistry(self):
+        """
+        Build the GStreamer registries shared by the tests
+        """
+        # private to this run, other runs can share the working directory
+        self._registrydir = tempfile.mkdtemp(prefix="gst-registry-",
+                                             dir=self._workingdir)
+        environment.buildRegistry(self._env, self._registrydir,
+                                  self._gotRegistry)
+
+    def _gotRegistry(self, registries, duration):
+        if registries:
+            variables = environment.getRegistryVariables(registries)
+            self._testenv.update(variables)
+            # so that they are collected with the environment
+            self._env.update(variables)
+            self._registrybuildtime = duration
+        self._collectEnvironment()
+
+    def _removeRegistry(self):
+        if self._registrydir:
+            shutil.rmtree(self._registrydir, True)
+            self._registrydir = None
+
     def _collectEnvironment(self):
         """
         Collect the environment settings, parameters, variables,...
@@ -233,7 +326,12 @@ class TestRun(gobject.GObject):
 
     def _gotEnvironment(self, resdict):
         info("Got environment %r", resdict)
+        if self._registrybuildtime is not None:
+            resdict["gst-registry-build-time"] = self._registrybuildtime
+        if self.getOutputRoot():
+            resdict["output-files-root"] = self.getOutputRoot()
         self._environment = resdict
+        self._running = True
         self.emit("start")
         self._starttime = int(time.time())
         self._storage.startNewTestRun(self, self._clientid)
@@ -256,17 +354,70 @@ class TestRun(gobject.GObject):
         # FIXME : Improvement : disconnect all signals from that test
         if test in self._runninginstances:
             self._runninginstances.remove(test)
+            if self._scheduler:
+                cost, key = self._testcosts.pop(test)
+                self._learnTestCost(test, key)
+                self._scheduler.release(self, cost)
         self._storage.newTestFinished(self, test)
         self._runNextBatch()
 
     def _singleTestCheck(self, test, check, validate):
         pass
 
-    def _runNext(self):
-        """ Run the next test+arg+monitor combination """
+    def getTestCost(self):
+        """
+        Returns the cost of the current test+monitor combination, which
+        is the cost learned by the scheduler from the previous runs of
+        that combination or else the cost declared by the test multiplied
+        by the cost of each monitor.
+        """
+        cost = self._currenttest.getCost()
+        for monitor in self._currentmonitors or []:
+            cost *= monitor[0].getCost()
+        if self._scheduler:
+            cost = self._scheduler.getCost(self._getCostKey(), cost)
+        return cost
+
+    def _getCostKey(self):
+        monitors = [monitor[0].__monitor_name__
+                    for monitor in self._currentmonitors or []]
+        return (self._currenttest.__test_name__, tuple(sorted(monitors)))
+
+    def _learnTestCost(self, test, key):
+        usage = test.getSubprocessUsage()
+        if usage is None:
+            return
+        walltime, cputime, maxrss = usage
+        if walltime <= 0:
+            return
+        # number of CPUs used, or fraction of the memory a cost of 1
+        # stands for, whichever is the highest
+        cost = cputime / walltime
+        minmemory = self._scheduler.getMinMemory()
+        if minmemory:
+            cost = max(cost, float(maxrss) / minmemory)
+        self._scheduler.learnCost(key, cost)
+
+    def _runNext(self, cost=None):
+        """
+        Run the next test+arg+monitor combination
+
+        cost : the cost of the slots already acquired from the scheduler,
+        if any
+        """
         if len(self._runninginstances) >= self._maxnbtests:
             warning("We were already running the max number of tests")
+            if cost is not None:
+                self._scheduler.release(self, cost)
             return False
+        if self._scheduler and cost is None:
+            cost = self.getTestCost()
+            if not self._scheduler.acquire(self, cost):
+                info("Waiting for free slots")
+                self._waitingslots = True
+                return False
+        self._waitingslots = False
+        self._batchpending = False
 
         # grab the next arguments
         testclass = self._currenttest
@@ -297,6 +448,10 @@ class TestRun(gobject.GObject):
         if allok:
             # add instance to running tests
             self._runninginstances.append(test)
+            if self._scheduler:
+                self._testcosts[test] = (cost, self._getCostKey())
+        elif self._scheduler:
+            self._scheduler.release(self, cost)
 
         warning("Just added a test %d/%d", len(self._runninginstances), self._maxnbtests)
         # if we can still create a new test, call ourself again
@@ -308,12 +463,33 @@ class TestRun(gobject.GObject):
 
     def _runNextBatch(self):
         """ Runs the next test batch """
+        if not self._running:
+            return False
+        if self._waitingslots:
+            # the current batch is started once the scheduler grants
+            # its slots
+            info("Still waiting for free slots")
+            return False
+        if len(self._runninginstances) >= self._maxnbtests:
+            # the next batch is started once a running test is done
+            return False
+        if self._batchpending:
+            # the current batch couldn't be started yet
+            self._runNext()
+            return False
         if len(self._tests) == 0:
+            if self._runninginstances:
+                info("No more tests batch to run, waiting for %d tests",
+                     len(self._runninginstances))
+                return False
             # if nothing left, stop
             info("No more tests batch to run, we're done")
+            if self._scheduler:
+                self._scheduler.remove(self)
             self._stoptime = int(time.time())
             self._storage.endTestRun(self)
             self._running = False
+            self._removeRegistry()
             self.emit("done")
             return False
 
@@ -324,6 +500,7 @@ class TestRun(gobject.GObject):
         self._currentmonitors = monitors
         self._currentarguments = args
         self._currentkwargs = kwargs
+        self._batchpending = True
 
         info("Current test : %r" % test)
         info("Current monitors : %r" % monitors)
@@ -333,6 +510,17 @@ class TestRun(gobject.GObject):
         self._runNext()
         return False
 
+    def _slotGranted(self, cost):
+        """
+        Called by the scheduler when the slots we were waiting for are
+        available.
+        """
+        self._waitingslots = False
+        if not self._running or not self._batchpending:
+            self._scheduler.release(self, cost)
+            return
+        self._runNext(cost)
+
     def getCurrentBatchPosition(self):
         """
         Returns the position (index) in the current batch.
@@ -349,6 +537,12 @@ class TestRun(gobject.GObject):
             return len(self._currentarguments)
         return 0
 
+    def getNbRunningTests(self):
+        """
+        Returns the number of tests currently running.
+        """
+        return len(self._runninginstances)
+
     def getWorkingDirectory(self):
         """
         Returns the currently configured working directory for this
@@ -375,13 +569,39 @@ class TestRun(gobject.GObject):
             os.makedirs(self._outputdir)
         return True
 
-    def get_temp_file(self, nameid='', suffix='', category="insanity-output"):
+    def getOutputRoot(self):
+        """
+        Returns the directory the output files should be stored relative
+        to, or None if they should be stored with their full path.
+        """
+        if self._outputlayout == "flat":
+            return None
+        return self._getOutputDirectory()
+
+    def _getOutputDirectory(self, test=None):
+        if self._outputlayout == "flat":
+            return self._outputdir
+        if self._rundir is None:
+            rundir = tempfile.mkdtemp(prefix=time.strftime("%Y%m%d-%H%M%S-"),
+                                      dir=self._outputdir)
+            self._rundir = os.path.abspath(rundir)
+        if test is None:
+            return self._rundir
+        directory = os.path.join(self._rundir, test.uuid[:2], test.uuid)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return directory
+
+    def get_temp_file(self, nameid='', suffix='', category="insanity-output",
+                      test=None):
         """
         Creates a new temporary file in a secure fashion, guaranteeing
         it will be unique and only accessible from this user.
 
         If specified, the nameid will be inserted in the unique name.
         If specified, the suffix will be used
+        If specified, the file will be in the output directory of the
+        given test (see the outputlayout argument of TestRun)
 
         The returned file will NEVER be removed or closed, the caller
         should take care of that.
@@ -392,7 +612,7 @@ class TestRun(gobject.GObject):
         prefix = "%s-%s" % (category, nameid)
         return tempfile.mkstemp(prefix=prefix,
                                 suffix=suffix,
-                                dir=self._outputdir)
+                                dir=self._getOutputDirectory(test))
 
 
 gobject.type_register(TestRun)
@@ -441,11 +661,13 @@ class XmlTestRun(TestRun):
     </insanity-tests>
     """
 
-    def __init__(self, xmlpath, workingdir, substitutes={}):
+    def __init__(self, xmlpath, workingdir, substitutes={}, outputlayout="flat",
+                 maxnbtests=1):
         """
         Creates a testrun base on the content of @xmlpath
         """
-        TestRun.__init__(self, maxnbtests=1, workingdir=workingdir)
+        TestRun.__init__(self, maxnbtests=maxnbtests, workingdir=workingdir,
+                         outputlayout=outputlayout)
         self.substitutes = substitutes
         self._root = parse(xmlpath)
         self._fillTestRunFromXml()
@@ -27,8 +27,10 @@ Convenience methods and classes for multi-threading
 
 import Queue
 import threading
+import time
 import gobject
 import traceback
+from collections import deque
 from insanity.log import error, warning, debug
 
 class Thread(threading.Thread, gobject.GObject):
@@ -91,77 +93,142 @@ class ActionQueueThread(threading.Thread):
 
     If you wish to abort the thread, just call abort() and
     the Thread will return as soon as possible.
+
+    Pending actions are executed in batches of up to 'batchsize'
+    actions. If provided, 'batchstart' and 'batchend' are called before
+    and after each batch (i.e. to wrap it in a single transaction).
+
+    If 'maxsize' is non-null, queueAction() will block while there are
+    'maxsize' or more pending actions, until the thread has caught up.
     """
 
-    def __init__(self):
+    def __init__(self, maxsize=0, batchsize=1, batchstart=None,
+                 batchend=None):
         threading.Thread.__init__(self)
-        self._lock = threading.Condition()
+        mutex = threading.Lock()
+        # signalled when actions are added or on exit/abort
+        self._lock = threading.Condition(mutex)
+        # signalled when the queue goes below the high-water mark
+        self._notfull = threading.Condition(mutex)
         # if set to True, the thread will exit even though
         # there are remaining actions
         self._abort = False
         # if set to True, the thread will exit when there's
         # no longer any actions in the queue.
         self._exit = False
-        # list of callables with arguments/kwargs
-        self._queue = []
+        # deque of (queuetime, callable, args, kwargs)
+        self._queue = deque()
+        # action to call once the queue has been drained
+        self._finalaction = None
+        self._maxsize = maxsize
+        self._batchsize = max(1, batchsize)
+        self._batchstart = batchstart
+        self._batchend = batchend
+
+        # statistics
+        self._nbqueued = 0
+        self._nbprocessed = 0
+        self._nbbatches = 0
+        self._nbblocked = 0
+        self._maxdepth = 0
+        self._totallatency = 0.0
+        self._maxlatency = 0.0
 
     def run(self):
-        # do something
         debug("Starting in process...")
         self._lock.acquire()
-        while True:
-            debug("queue:%d _exit:%r _abort:%r",
-                    len(self._queue), self._exit,
-                    self._abort)
-            if self._abort:
-                debug("aborting")
-                self._lock.release()
-                return
-
-            while len(self._queue) == 0:
+        try:
+            while True:
                 debug("queue:%d _exit:%r _abort:%r",
-                        len(self._queue), self._exit,
-                        self._abort)
-                if self._exit:
-                    self._lock.release()
-                    return
-                debug("waiting for cond")
-                self._lock.wait()
-                debug("cond was triggered")
+                      len(self._queue), self._exit, self._abort)
+                while not self._abort and len(self._queue) == 0:
+                    if self._exit:
+                        break
+                    debug("waiting for cond")
+                    self._lock.wait()
+                    debug("cond was triggered")
                 if self._abort:
-                    self._lock.release()
+                    debug("aborting")
                     return
-            method, args, kwargs = self._queue.pop(0)
+                if len(self._queue) == 0:
+                    # _exit was set and everything was processed
+                    break
+                batch = []
+                while self._queue and len(batch) < self._batchsize:
+                    batch.append(self._queue.popleft())
+                self._notfull.notifyAll()
+                self._lock.release()
+                try:
+                    self._processBatch(batch)
+                finally:
+                    self._lock.acquire()
+            final = self._finalaction
+            self._finalaction = None
+        finally:
             self._lock.release()
-            try:
-                debug("about to call %r", method)
-                method(*args, **kwargs)
-            except:
-                error("There was a problem calling %r", method)
-                error(traceback.format_exc())
-            finally:
-                debug("Finished calling %r, re-acquiring lock",
-                      method)
+        if final:
+            self._callAction(*final)
+
+    def _processBatch(self, batch):
+        debug("processing batch of %d actions", len(batch))
+        if self._batchstart:
+            self._callAction(self._batchstart, (), {})
+        latencies = []
+        try:
+            for queuetime, method, args, kwargs in batch:
+                latencies.append(time.time() - queuetime)
+                self._callAction(method, args, kwargs)
+        finally:
+            if self._batchend:
+                self._callAction(self._batchend, (), {})
             self._lock.acquire()
+            self._nbbatches += 1
+            self._nbprocessed += len(latencies)
+            self._totallatency += sum(latencies)
+            self._maxlatency = max([self._maxlatency] + latencies)
+            self._lock.release()
+
+    def _callAction(self, method, args, kwargs):
+        try:
+            debug("about to call %r", method)
+            method(*args, **kwargs)
+        except:
+            error("There was a problem calling %r", method)
+            error(traceback.format_exc())
+        finally:
+            debug("Finished calling %r", method)
 
     def abort(self):
         self._lock.acquire()
         self._abort = True
         self._lock.notify()
+        self._notfull.notifyAll()
         self._lock.release()
 
     def queueAction(self, method, *args, **kwargs):
         """
         Queue an action.
         Returns True if the action was queued, else False.
+
+        If the queue is above the high-water mark, this will block
+        until enough actions have been processed.
         """
         res = False
         debug("about to queue %r", method)
         self._lock.acquire()
         debug("Got lock to queue, _abort:%r, _exit:%r",
                 self._abort, self._exit)
+        if self._maxsize and len(self._queue) >= self._maxsize \
+               and not self._abort and not self._exit:
+            warning("action queue is full (%d), waiting", len(self._queue))
+            self._nbblocked += 1
+            while len(self._queue) >= self._maxsize \
+                      and not self._abort and not self._exit:
+                self._notfull.wait()
         if not self._abort and not self._exit:
-            self._queue.append((method, args, kwargs))
+            self._queue.append((time.time(), method, args, kwargs))
+            self._nbqueued += 1
+            self._maxdepth = max(self._maxdepth, len(self._queue))
             self._lock.notify()
             res = True
         debug("about to release lock")
@@ -172,6 +239,9 @@ class ActionQueueThread(threading.Thread):
     def queueFinalAction(self, method, *args, **kwargs):
         """
         Set a last action to be called.
+
+        The final action is called once all pending actions have been
+        processed, outside of any batch.
         """
         res = False
         debug("about to queue %r", method)
@@ -179,15 +249,46 @@ class ActionQueueThread(threading.Thread):
         debug("Got lock to queue, _abort:%r, _exit:%r",
                 self._abort, self._exit)
         if not self._abort and not self._exit:
-            self._queue.append((method, args, kwargs))
+            self._finalaction = (method, args, kwargs)
             res = True
         self._exit = True
         self._lock.notify()
+        self._notfull.notifyAll()
         debug("about to release lock")
         self._lock.release()
         debug("lock released, result:%r", res)
         return res
 
+    def getStatistics(self):
+        """
+        Returns a dictionnary of statistics about the queue:
+        * depth : number of pending actions
+        * max-depth : highest number of pending actions seen
+        * queued : total number of actions queued
+        * processed : total number of actions processed
+        * batches : number of batches processed
+        * blocked : number of times queueAction() had to wait
+        * average-latency : average time (in seconds) between queueing
+          and processing of an action
+        * max-latency : highest time (in seconds) between queueing and
+          processing of an action
+        """
+        self._lock.acquire()
+        try:
+            avg = 0.0
+            if self._nbprocessed:
+                avg = self._totallatency / self._nbprocessed
+            return {"depth" : len(self._queue),
+                    "max-depth" : self._maxdepth,
+                    "queued" : self._nbqueued,
+                    "processed" : self._nbprocessed,
+                    "batches" : self._nbbatches,
+                    "blocked" : self._nbblocked,
+                    "average-latency" : avg,
+                    "max-latency" : self._maxlatency}
+        finally:
+            self._lock.release()
+
 class FileReadingThread(threading.Thread):
     """
     Helper class to implement asynchronous reading of a file
@@ -223,21 +223,45 @@ def map_list(alist, mapdict):
             r.append((mapdict[k], v))
     return r
 
-def compress_file(original, compfile):
+def intern_dict(adict):
+    """
+    Returns a copy of the given dictionnary where all (non-unicode) string
+    keys are interned, so that the same keys of many dictionnaries only
+    take memory once.
+    """
+    if not adict:
+        return {}
+    return dict((isinstance(k, str) and intern(k) or k, v)
+                for k, v in adict.iteritems())
+
+def compress_file(original, compfile, maxsize=None, bufsize=8192):
     """
     Takes the contents of 'original' and compresses it into the new file
     'compfile' using gzip methods.
-    """
-    f = open(original, "r")
-    out = gzip.GzipFile(compfile, "w")
-    # reading 8kbytes at a time, might want to increase it later
-    buf = f.read(8192)
-    while buf:
-        out.write(buf)
-        buf = f.read(8192)
 
-    f.close()
-    out.close()
+    If maxsize is given and the compressed contents would be bigger than
+    maxsize bytes, the compression is aborted, 'compfile' is removed and
+    False is returned. Else True is returned.
+    """
+    f = open(original, "rb")
+    raw = open(compfile, "wb")
+    out = gzip.GzipFile(fileobj=raw, mode="wb")
+    try:
+        # reading bufsize bytes at a time
+        buf = f.read(bufsize)
+        while buf:
+            out.write(buf)
+            if maxsize is not None and raw.tell() > maxsize:
+                break
+            buf = f.read(bufsize)
+        out.close()
+    finally:
+        f.close()
+        raw.close()
+    if maxsize is not None and os.path.getsize(compfile) > maxsize:
+        os.remove(compfile)
+        return False
+    return True
 
 def unicode_dict(adict):
     """
@@ -0,0 +1,163 @@
+# GStreamer QA system
+#
+#       tests/test_dbstorage.py
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+"""
+Testrun summaries maintained by a DBStorage while the tests are stored, and
+the release of the stored iterations of a test
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from insanity.test import Test
+from insanity.testmetadata import TestSchema
+from insanity.storage.sqlite import SQLiteStorage
+
+CHECKLIST = dict(Test.__test_checklist__)
+CHECKLIST["summary-check"] = {"global": False,
+                              "description": "Validated by the test case"}
+
+class SummaryTest(Test):
+    """
+    Test whose checks are validated by the test case
+    """
+
+    __test_name__ = "summary-test"
+    __test_description__ = "Test whose checks are validated by the test case"
+    __test_full_description__ = None
+    __test_schema__ = TestSchema(None, CHECKLIST, None, None)
+
+    def test(self):
+        pass
+
+    def getSchema(self):
+        return self.__test_schema__
+
+    def getFullCheckList(self):
+        return dict(CHECKLIST)
+
+    def getFullArgumentList(self):
+        return {}
+
+    def getFullExtraInfoList(self):
+        return {}
+
+    def getFullOutputFilesList(self):
+        return {}
+
+ITERATIONS_CHECKLIST = dict(CHECKLIST)
+ITERATIONS_CHECKLIST["global-check"] = {"global": True,
+                                        "description": "Carried over iterations"}
+
+class IterationsTest(SummaryTest):
+    """
+    Test with a global check item, carried over to the next iterations
+    """
+
+    __test_name__ = "iterations-test"
+    __test_schema__ = TestSchema(None, ITERATIONS_CHECKLIST, None, None)
+
+    def getFullCheckList(self):
+        return dict(ITERATIONS_CHECKLIST)
+
+class FakeTestRun(object):
+    """
+    What the storage uses of a TestRun
+    """
+
+    _starttime = 1
+    _stoptime = 2
+
+    def getEnvironment(self):
+        return {}
+
+class TestRunSummaryTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._storage = SQLiteStorage(path=os.path.join(self._dir, "test.db"),
+                                      async=False)
+        self._testrun = FakeTestRun()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _storeTest(self, validated, finished=True):
+        test = SummaryTest()
+        self._storage.newTestStarted(self._testrun, test, 1)
+        if not finished:
+            return
+        test.start()
+        if validated:
+            test.validateChecklistItem("summary-check")
+        test.stop()
+        self._storage.newTestStopped(self._testrun, test, 1)
+        self._storage.newTestFinished(self._testrun, test)
+
+    def _getSummaries(self):
+        testrunid = self._storage.listTestRuns()[-1]
+        summary = self._storage.getTestRunSummary(testrunid)
+        return (summary, self._storage._computeTestRunSummary(testrunid),
+                self._storage.getNbTestsForTestrun(testrunid))
+
+    def testIncrementalSummary(self):
+        self._storeTest(True)
+        self._storeTest(False)
+        # still running
+        self._storeTest(False, finished=False)
+        incremental, computed, nbtests = self._getSummaries()
+        self.assertEquals(incremental, computed)
+        self.assertEquals(incremental[:2], (3, 1))
+        self.assertEquals(nbtests, 3)
+        # ending the testrun rebuilds its summary
+        self._storage.endTestRun(self._testrun)
+        self.assertEquals(self._getSummaries()[0], incremental)
+
+class ReleaseIterationTest(unittest.TestCase):
+
+    def _release(self, test, iteration):
+        # the storage releases the iterations from its own thread
+        thread = threading.Thread(target=test.releaseIteration,
+                                  args=(iteration, ))
+        thread.start()
+        thread.join()
+
+    def testRelease(self):
+        test = IterationsTest()
+        test.start()
+        test.validateChecklistItem("global-check")
+        test.stop()
+        self._release(test, 1)
+        # the latest stopped iteration is kept
+        self.assertEquals(test.getIteration(), 1)
+        self.assert_(("global-check", Test.SUCCESS)
+                     in test.getIterationCheckList(1))
+        test.start()
+        # dropped once its global items were carried over
+        self.assertEquals(test.getIterationCheckList(1), [])
+        test.stop()
+        self.assert_(("global-check", Test.SUCCESS)
+                     in test.getIterationCheckList(2))
+        self.assertEquals(test.getCheckListTotals()[0],
+                          2 * len(test.getIterationCheckList(2)))
+
+if __name__ == "__main__":
+    unittest.main()
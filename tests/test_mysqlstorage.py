@@ -0,0 +1,222 @@
+# GStreamer QA system
+#
+#       tests/test_mysqlstorage.py
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+"""
+MySQLStorage against a local MySQL stand-in (sqlite3 behind the MySQLdb
+API), covering the read connections pool, the multi-row inserts and the
+paramstyle conversion
+"""
+
+import os
+import re
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+class MySQLStandIn(object):
+    """
+    The parts of the MySQLdb module used by MySQLStorage, on top of a
+    sqlite3 database file
+    """
+
+    def __init__(self):
+        self.path = None
+        # instructions executed, as given to the cursors
+        self.executed = []
+        # if set, the next connect() raises it
+        self.failure = None
+        # if set, connect() waits for it
+        self.gate = None
+
+    def connect(self, host=None, port=None, user=None, passwd=None, db=None):
+        if self.gate is not None:
+            self.gate.wait()
+        if self.failure is not None:
+            failure, self.failure = self.failure, None
+            raise failure
+        return StandInConnection(self)
+
+class StandInConnection(object):
+
+    def __init__(self, module):
+        self._module = module
+        self._con = sqlite3.connect(module.path, check_same_thread=False)
+
+    def autocommit(self, enabled):
+        self._con.isolation_level = enabled and None or ""
+
+    def cursor(self):
+        return StandInCursor(self._module, self._con.cursor())
+
+    def commit(self):
+        self._con.commit()
+
+    def rollback(self):
+        self._con.rollback()
+
+    def close(self):
+        self._con.close()
+
+class StandInCursor(object):
+
+    _autoincrement = re.compile("integer NOT NULL AUTO_INCREMENT PRIMARY KEY",
+                                re.IGNORECASE)
+
+    def __init__(self, module, cursor):
+        self._module = module
+        self._cursor = cursor
+
+    def _translate(self, instruction):
+        if instruction.strip().rstrip(";") == "SHOW TABLES":
+            return "SELECT name FROM sqlite_master WHERE type='table'"
+        if "?" in instruction:
+            raise ValueError("not using the MySQLdb paramstyle: %s" % instruction)
+        instruction = self._autoincrement.sub(
+            "INTEGER PRIMARY KEY AUTOINCREMENT", instruction)
+        return instruction.replace("%s", "?")
+
+    def execute(self, instruction, args=()):
+        self._module.executed.append(instruction)
+        instruction = self._translate(instruction)
+        if instruction.strip().rstrip(";").count(";"):
+            self._cursor.executescript(instruction)
+        else:
+            self._cursor.execute(instruction, args)
+
+    def executemany(self, instruction, args):
+        self._module.executed.append(instruction)
+        self._cursor.executemany(self._translate(instruction), args)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+standin = MySQLStandIn()
+try:
+    import MySQLdb
+except ImportError:
+    sys.modules["MySQLdb"] = standin
+import insanity.storage.mysql
+from insanity.storage.mysql import MySQLStorage
+
+class MySQLStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        standin.path = os.path.join(self._dir, "insanity.db")
+        standin.executed = []
+        standin.failure = None
+        standin.gate = None
+        self._mysqldb = insanity.storage.mysql.MySQLdb
+        insanity.storage.mysql.MySQLdb = standin
+
+    def tearDown(self):
+        insanity.storage.mysql.MySQLdb = self._mysqldb
+        shutil.rmtree(self._dir)
+
+    def _getStorage(self, **kwargs):
+        return MySQLStorage(async=False, **kwargs)
+
+    def testStatements(self):
+        storage = self._getStorage()
+        clientid = storage.setClientInfo("software", "client", "user")
+        instruction = "SELECT software, name, user FROM client WHERE id=?"
+        self.assertEquals(storage._FetchOne(instruction, (clientid, )),
+                          ("software", "client", "user"))
+        self.assertEquals(standin.executed[-1],
+                          "SELECT software, name, user FROM client WHERE id=%s")
+
+    def testInsertMany(self):
+        storage = self._getStorage(insertrows=2)
+        rows = [(i, "name%d" % i) for i in range(5)]
+        del standin.executed[:]
+        storage._InsertMany("testrun_environment_dict",
+                            ["containerid", "name"], rows)
+        # 3 INSERT statements of 2, 2 and 1 rows
+        self.assertEquals([instruction.count("(%s, %s)")
+                           for instruction in standin.executed], [2, 2, 1])
+        self.assertEquals(storage._FetchAll("""SELECT containerid, name
+        FROM testrun_environment_dict ORDER BY containerid"""), rows)
+        # nothing to insert
+        del standin.executed[:]
+        storage._InsertMany("testrun_environment_dict",
+                            ["containerid", "name"], [])
+        self.assertEquals(standin.executed, [])
+
+    def testReadConnections(self):
+        storage = self._getStorage(readers=1)
+        getcon = storage._DBStorage__getReadConnection
+        putcon = storage._DBStorage__putReadConnection
+        con = getcon()
+        self.assertNotEquals(con, None)
+        # the only read connection is in use, waits for it
+        res = []
+        waiter = threading.Thread(target=lambda: res.append(getcon()))
+        waiter.start()
+        waiter.join(0.2)
+        self.assert_(waiter.isAlive())
+        putcon(con)
+        waiter.join(5)
+        self.failIf(waiter.isAlive())
+        self.assert_(res[0] is con)
+        putcon(con)
+        storage._shutDown()
+
+    def testReadConnectionFailure(self):
+        storage = self._getStorage(readers=1)
+        getcon = storage._DBStorage__getReadConnection
+        standin.failure = Exception("can't connect")
+        standin.gate = threading.Event()
+        res = []
+        opener = threading.Thread(target=lambda: res.append(getcon()))
+        opener.start()
+        waiter = threading.Thread(target=lambda: res.append(getcon()))
+        waiter.start()
+        waiter.join(0.2)
+        standin.gate.set()
+        opener.join(5)
+        waiter.join(5)
+        self.failIf(opener.isAlive() or waiter.isAlive())
+        # the failed opening fell back to the main connection, and freed
+        # its slot for the waiter
+        self.assertEquals(sorted([con == None for con in res]), [False, True])
+        self.assertEquals(storage._DBStorage__nbreaders, 1)
+        self.assertEquals(storage._maxreaders, 1)
+
+    def testReadConnectionUnsupported(self):
+        storage = self._getStorage(readers=2)
+        storage._openReadConnection = lambda: None
+        getcon = storage._DBStorage__getReadConnection
+        self.assertEquals(getcon(), None)
+        # doesn't block nor try again
+        self.assertEquals(getcon(), None)
+        self.assertEquals(storage._maxreaders, 0)
+        self.assertEquals(storage._DBStorage__nbreaders, 0)
+
+if __name__ == "__main__":
+    unittest.main()
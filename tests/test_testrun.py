@@ -0,0 +1,157 @@
+# GStreamer QA system
+#
+#       tests/test_testrun.py
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the
+# Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
+# Boston, MA 02110-1301, USA.
+
+"""
+Scheduling of the test batches of a TestRun
+"""
+
+import shutil
+import tempfile
+import unittest
+import gobject
+import insanity.testrun
+from insanity.testrun import TestRun
+from insanity.scheduler import SlotScheduler
+
+class FakeMetadata(object):
+    """
+    Test metadata of a batch
+    """
+
+    def __init__(self, name):
+        self.__test_name__ = name
+
+    def getCost(self):
+        return 1.0
+
+class FakeTest(object):
+    """
+    Test instance whose end is triggered by the test case
+    """
+
+    started = []
+
+    def __init__(self, testrun=None, metadata=None, **kwargs):
+        self.metadata = metadata
+        self.uuid = metadata.__test_name__
+        self._callbacks = {}
+
+    def connect(self, signal, callback):
+        self._callbacks[signal] = callback
+
+    def addMonitor(self, *args):
+        pass
+
+    def run(self):
+        FakeTest.started.append(self)
+        return True
+
+    def stop(self):
+        pass
+
+    def finish(self):
+        self._callbacks["done"](self)
+
+    def getSuccessPercentage(self):
+        return 100.0
+
+    def getSubprocessUsage(self):
+        return None
+
+class FakeStorage(object):
+
+    def startNewTestRun(self, testrun, clientid):
+        pass
+
+    def newTestFinished(self, testrun, test):
+        pass
+
+    def endTestRun(self, testrun):
+        pass
+
+class LocalTestRun(TestRun):
+    """
+    TestRun without a private bus
+    """
+
+    def _setupPrivateBus(self):
+        pass
+
+gobject.type_register(LocalTestRun)
+
+class TestRunBatchesTest(unittest.TestCase):
+
+    nbbatches = 6
+
+    def setUp(self):
+        self._workingdir = tempfile.mkdtemp()
+        self._testclass = insanity.testrun.PythonDBusTest
+        insanity.testrun.PythonDBusTest = FakeTest
+        FakeTest.started = []
+        self._done = 0
+
+    def tearDown(self):
+        insanity.testrun.PythonDBusTest = self._testclass
+        shutil.rmtree(self._workingdir)
+
+    def _iterate(self):
+        context = gobject.main_context_default()
+        while context.pending():
+            context.iteration(False)
+
+    def _doneCb(self, testrun):
+        self._done += 1
+
+    def _runBatches(self, scheduler=None, maxnbtests=2):
+        testrun = LocalTestRun(maxnbtests=maxnbtests,
+                               workingdir=self._workingdir,
+                               sharedregistry=False)
+        testrun.setStorage(FakeStorage())
+        if scheduler:
+            testrun.setScheduler(scheduler)
+        testrun.connect("done", self._doneCb)
+        for i in range(self.nbbatches):
+            testrun.addTest(FakeMetadata("batch%d" % i), {})
+        testrun._gotEnvironment({})
+        self._iterate()
+        finished = 0
+        while finished < len(FakeTest.started):
+            self.assertEquals(self._done, 0)
+            FakeTest.started[finished].finish()
+            finished += 1
+            self._iterate()
+        self.assertEquals([test.uuid for test in FakeTest.started],
+                          ["batch%d" % i for i in range(self.nbbatches)])
+        self.assertEquals(self._done, 1)
+
+    def testWithoutScheduler(self):
+        self._runBatches()
+
+    def testOneSlot(self):
+        scheduler = SlotScheduler(maxslots=1)
+        self._runBatches(scheduler)
+        self.assertEquals(scheduler.getRunningTests(), 0)
+
+    def testTwoSlots(self):
+        scheduler = SlotScheduler(maxslots=2)
+        self._runBatches(scheduler)
+        self.assertEquals(scheduler.getRunningTests(), 0)
+
+if __name__ == "__main__":
+    unittest.main()
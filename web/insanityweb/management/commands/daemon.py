@@ -3,25 +3,196 @@ from django.core.management.commands.runserver import BaseRunserverCommand
 
 from django.core.handlers.wsgi import WSGIHandler
 from django.core.servers.basehttp import WSGIRequestHandler, WSGIServer, AdminMediaHandler, WSGIServerException
+from django.core.urlresolvers import reverse
+
+from optparse import make_option
 
 import gtk
-import gobject
 
 import sys
 import os
+import socket
+import threading
+import Queue
 
 from insanityweb.runner import get_runner
+from insanity.isolation import IsolationProfile, IOPRIO_CLASSES, parse_cpu_list
 from settings import DATA_PATH
 
+# number of bytes read ahead to find the path of a request
+REQUEST_PEEK_SIZE = 1024
+
+class StreamRequestHandler(WSGIRequestHandler):
+    """
+    Request handler of the streams, telling the views they are served by
+    their own thread (see insanityweb.views.is_stream_request).
+    """
+
+    def get_environ(self):
+        env = WSGIRequestHandler.get_environ(self)
+        env['insanity.stream'] = True
+        return env
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """
+    WSGIServer handling the requests from a fixed pool of threads, so that
+    slow pages don't block other clients (nor the runner main loop).
+
+    The requests for one of the given stream paths stay open for a long
+    time, and are each served by their own thread instead, up to
+    maxstreams at once. The other ones go to the pool, and the views
+    answer them right away.
+    """
+
+    def __init__(self, nbthreads, streampaths, maxstreams, *args, **kwargs):
+        WSGIServer.__init__(self, *args, **kwargs)
+        self._streampaths = streampaths
+        self._maxstreams = maxstreams
+        self._nbstreams = 0
+        self._streamslock = threading.Lock()
+        self._requests = Queue.Queue()
+        for i in range(nbthreads):
+            thread = threading.Thread(target=self._worker,
+                                      name="http-worker-%d" % i)
+            thread.daemon = True
+            thread.start()
+
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+
+    def _worker(self):
+        while True:
+            request, client_address = self._requests.get()
+            if self._isStream(request) and self._startStream():
+                thread = threading.Thread(target=self._streamWorker,
+                                          args=(request, client_address),
+                                          name="http-stream")
+                thread.daemon = True
+                thread.start()
+                continue
+            self._serve(request, client_address, self.RequestHandlerClass)
+
+    def _streamWorker(self, request, client_address):
+        try:
+            self._serve(request, client_address, StreamRequestHandler)
+        finally:
+            self._streamslock.acquire()
+            self._nbstreams -= 1
+            self._streamslock.release()
+
+    def _serve(self, request, client_address, handlerclass):
+        try:
+            handlerclass(request, client_address, self)
+        except:
+            self.handle_error(request, client_address)
+        self.shutdown_request(request)
+
+    def _isStream(self, request):
+        # the request line is left in the socket for the handler
+        try:
+            data = request.recv(REQUEST_PEEK_SIZE, socket.MSG_PEEK)
+        except socket.error:
+            return False
+        fields = data.split(" ", 2)
+        if len(fields) < 3:
+            return False
+        return fields[1].split("?", 1)[0] in self._streampaths
+
+    def _startStream(self):
+        self._streamslock.acquire()
+        try:
+            if self._nbstreams >= self._maxstreams:
+                return False
+            self._nbstreams += 1
+            return True
+        finally:
+            self._streamslock.release()
+
 class Command(BaseRunserverCommand):
+    option_list = BaseRunserverCommand.option_list + (
+        make_option('--threads', action='store', dest='threads', type='int',
+                    default=4,
+                    help='Number of threads serving HTTP requests'),
+        make_option('--streams', action='store', dest='streams', type='int',
+                    default=16,
+                    help='Maximum number of live progress streams served '
+                    'by their own thread'),
+        make_option('--max-tests', action='store', dest='maxtests', type='int',
+                    default=1,
+                    help='Maximum number of tests running at the same time'),
+        make_option('--max-slots', action='store', dest='maxslots',
+                    type='float', default=None,
+                    help='Maximum total cost of the tests running at the '
+                    'same time'),
+        make_option('--max-load', action='store', dest='maxload',
+                    type='float', default=None,
+                    help='Don\'t start tests while the tests use more than '
+                    'that fraction (0.0 to 1.0) of the CPU time'),
+        make_option('--min-memory', action='store', dest='minmemory',
+                    type='int', default=None,
+                    help='Available memory (in kB) needed to start a test of '
+                    'cost 1'),
+        make_option('--cpus-per-test', action='store', dest='cpuspertest',
+                    type='int', default=None,
+                    help='Pin each test process to its own N CPUs'),
+        make_option('--cpus', action='store', dest='cpus', default=None,
+                    help='CPUs the test processes can be pinned to, '
+                    'ex: 0-3,6 (default: all)'),
+        make_option('--nice', action='store', dest='nice', type='int',
+                    default=None,
+                    help='Niceness increment of the test processes'),
+        make_option('--io-class', action='store', dest='ioclass',
+                    type='choice', choices=sorted(IOPRIO_CLASSES.keys()),
+                    default=None,
+                    help='I/O scheduling class of the test processes'),
+        make_option('--io-level', action='store', dest='iolevel', type='int',
+                    default=0,
+                    help='I/O priority level of the test processes within '
+                    'their class, 0 being the highest'),
+    )
     args = ''
     help = 'Start the Insanity integrated web + test runner'
 
+    def _getIsolationProfile(self, options):
+        cpus = options.get('cpus')
+        if cpus:
+            try:
+                cpus = parse_cpu_list(cpus)
+            except ValueError, e:
+                raise CommandError("Invalid --cpus: %s" % e)
+        iolevel = options.get('iolevel', 0)
+        if not 0 <= iolevel <= 7:
+            raise CommandError("--io-level must be between 0 and 7")
+        if not (options.get('cpuspertest') or
+                options.get('nice') is not None or options.get('ioclass')):
+            return None
+        try:
+            return IsolationProfile(cpuspertest=options.get('cpuspertest'),
+                                    cpus=cpus or None,
+                                    nice=options.get('nice'),
+                                    ioclass=options.get('ioclass'),
+                                    iolevel=iolevel)
+        except ValueError, e:
+            raise CommandError("Invalid --cpus: %s" % e)
+
     def run(self, *args, **options):
+        isolation = self._getIsolationProfile(options)
         os.chdir(DATA_PATH)
-        runner = get_runner()
+        # the runner has to be created from the main loop thread
+        runner = get_runner(maxnbtests=options.get('maxtests', 1),
+                            maxslots=options.get('maxslots'),
+                            maxload=options.get('maxload'),
+                            minmemory=options.get('minmemory'),
+                            isolation=isolation)
+        streampaths = [reverse(view) for view in
+                       ('web.insanityweb.views.current_progress_feed',
+                        'web.insanityweb.views.current_progress_events')]
         try:
-            server = WSGIServer((self.addr, int(self.port)), WSGIRequestHandler)
+            server = ThreadPoolWSGIServer(options.get('threads', 4),
+                                          streampaths,
+                                          options.get('streams', 16),
+                                          (self.addr, int(self.port)),
+                                          WSGIRequestHandler)
         except WSGIServerException, e:
             sys.stderr.write("ERROR: " + str(e) + "\n")
             runner.quit()
@@ -33,33 +204,18 @@ class Command(BaseRunserverCommand):
 
         handler = AdminMediaHandler(WSGIHandler())
         server.set_app(handler)
-        server.timeout = 0.1
-
-        orig_handle_timeout = server.handle_timeout
-        timeout_happened = [False]
-
-        def handle_timeout(*args, **kwargs):
-            orig_handle_timeout(*args, **kwargs)
-            timeout_happened[0] = True
-
-        server.handle_timeout = handle_timeout
-
-        def django_driver():
-            timeout_happened[0] = False
-            while not timeout_happened[0]:
-                try:
-                    server.handle_request()
-                except KeyboardInterrupt:
-                    sys.stdout.write("Stopping the server...\n")
-                    runner.quit()
-                    gtk.main_quit()
-                    return False
-                except Exception, e:
-                    sys.stderr.write("ERROR: " + str(e) + "\n")
-                    return True
-            return True
 
-        gobject.idle_add(django_driver)
+        # HTTP requests are accepted in a separate thread, the main thread
+        # only runs the GLib main loop used by the runner
+        thread = threading.Thread(target=server.serve_forever,
+                                  name="http-server")
+        thread.daemon = True
+        thread.start()
 
         sys.stdout.write("Running the server...\n")
-        gtk.main()
+        try:
+            gtk.main()
+        except KeyboardInterrupt:
+            sys.stdout.write("Stopping the server...\n")
+            server.shutdown()
+            runner.quit()
@@ -6,6 +6,8 @@ from cPickle import dumps, loads
 from django.db import models
 from django.db.models import permalink
 from django.db import connection
+from django.core.exceptions import ImproperlyConfigured
+from insanity.storage.outputstore import is_digest
 
 class DateTimeIntegerField(models.IntegerField):
 
@@ -77,6 +79,37 @@ class TestClassInfoManager(models.Manager):
 
         return filter_subclass(sct, v)
 
+    def full_dicts(self, classinfos):
+        """
+        Returns the full checklist and full arguments (see
+        TestClassInfo.fullchecklist and TestClassInfo.fullarguments) of
+        all the given TestClassInfo, as two dictionnaries:
+        * key : type of the TestClassInfo
+        * value : list of TestClassInfoCheckListDict/TestClassInfoArgumentsDict
+
+        Only three queries are done whatever the number of classes.
+        """
+        parents = dict(self.values_list("type", "parent"))
+        parentage = {}
+        for ci in classinfos:
+            res = []
+            t = ci.type
+            while t:
+                res.append(t)
+                t = parents.get(t)
+            parentage[ci.type] = res
+        allclasses = set()
+        for res in parentage.itervalues():
+            allclasses.update(res)
+        checks = list(TestClassInfoCheckListDict.objects.filter(containerid__in=allclasses).order_by("id"))
+        args = list(TestClassInfoArgumentsDict.objects.filter(containerid__in=allclasses).order_by("id"))
+        fullchecks = {}
+        fullargs = {}
+        for t, classes in parentage.iteritems():
+            fullchecks[t] = [x for x in checks if x.containerid_id in classes]
+            fullargs[t] = [x for x in args if x.containerid_id in classes]
+        return fullchecks, fullargs
+
 class TestClassInfo(models.Model):
     objects = TestClassInfoManager()
     id = models.IntegerField(null=False, primary_key=True, blank=True)
@@ -196,7 +229,9 @@ class TestClassInfoOutputFilesDict(models.Model):
 
 class TestRunManager(models.Manager):
     def withcounts(self):
-        return self.all().extra(select={'nbtests':"SELECT COUNT(*) FROM test WHERE test.testrunid = testrun.id and test.ismonitor=0"})
+        # use the testrun_summary maintained by the storage, and only
+        # count the tests for testruns which don't have one yet
+        return self.all().extra(select={'nbtests':"SELECT COALESCE((SELECT nbtests FROM testrun_summary WHERE testrun_summary.testrunid = testrun.id), (SELECT COUNT(*) FROM test WHERE test.testrunid = testrun.id and test.ismonitor=0))"})
 
 class TestRun(models.Model, CustomSQLInterface):
     objects = TestRunManager()
@@ -215,6 +250,14 @@ class TestRun(models.Model, CustomSQLInterface):
         return ('web.insanityweb.views.matrix_view', [self.id])
     get_matrix_view_url = permalink(get_matrix_view_url)
 
+    def _get_output_root(self):
+        # the output files of sharded testruns are stored relative to it
+        if not hasattr(self, "_output_root"):
+            env = self.environment.filter(name="output-files-root")
+            self._output_root = env and env[0].value or None
+        return self._output_root
+    output_root = property(_get_output_root)
+
     def find_test_similar_args(self, atest):
         """Returns tests which have the similar arguments as atest"""
         # this query is too complex to do with DJango code
@@ -285,6 +328,18 @@ class TestRun(models.Model, CustomSQLInterface):
     def __str__(self):
         return "Testrun #%d [%s]" % (self.id, self.starttime)
 
+class TestRunSummary(models.Model):
+    """Summary of a testrun, maintained by the DBStorage"""
+    testrun = models.OneToOneField(TestRun, primary_key=True,
+                                   db_column="testrunid",
+                                   related_name="summary")
+    nbtests = models.IntegerField()
+    nbfailed = models.IntegerField()
+    nbtimedout = models.IntegerField()
+    nbcrashed = models.IntegerField()
+    class Meta:
+        db_table = 'testrun_summary'
+
 class TestManager(models.Manager):
     def failed(self):
         """Only returns the tests that succeeded"""
@@ -415,7 +470,7 @@ class Test(models.Model):
             d['type'] = argtype
             val = None
             for av in v:
-                if argtype == av.name:
+                if argtype.id == av.name_id:
                     d['skipped'] = False
                     val = av.value
                     break
@@ -509,7 +564,25 @@ class TestArgumentsDict(models.Model):
         return "%s:%s" % (self.name.name, self.value)
 
 
+class TestCheckListManager(models.Manager, CustomSQLInterface):
+
+    def check_supported(self):
+        """
+        Raises ImproperlyConfigured if the latest tests only have their
+        checklist stored as a bitmap (DBStorage with
+        compactchecklist=True), which the web interface doesn't support.
+        """
+        res = self._fetchOne("SELECT MAX(containerid) FROM test_checklist_bitmap")
+        if res == None or res[0] == None:
+            return
+        if self._fetchOne("""SELECT containerid FROM test_checklist_list
+        WHERE containerid=%s LIMIT 1""", [res[0]]) == None:
+            raise ImproperlyConfigured("The checklists are only stored as "
+                                       "bitmaps (compactchecklist), which the "
+                                       "web interface doesn't support")
+
 class TestCheckListList(models.Model):
+    objects = TestCheckListManager()
     SKIPPED = None
     FAILURE = 0
     SUCCESS = 1
@@ -562,6 +635,13 @@ class TestOutputFilesDict(models.Model):
         return os.path.basename(self.value)
     basename = property(_get_basename)
 
+    def _get_digest(self):
+        # the file was moved to an OutputStore
+        if is_digest(self.value):
+            return self.value
+        return None
+    digest = property(_get_digest)
+
     class Meta:
         db_table = 'test_outputfiles_dict'
 
@@ -603,6 +683,29 @@ class TestErrorExplanationDict(models.Model):
     class Meta:
         db_table = 'test_error_explanation_dict'
 
+class FailureSignature(models.Model):
+    """Signature shared by similar test failures, maintained by the DBStorage"""
+    id = models.IntegerField(null=False, primary_key=True, blank=True)
+    signature = models.CharField(max_length=40)
+    testtype = models.TextField(blank=True)
+    description = models.TextField(blank=True)
+    class Meta:
+        db_table = 'failure_signature'
+
+    def get_absolute_url(self):
+        return ('web.insanityweb.views.failure_signature', [str(self.id)])
+    get_absolute_url = permalink(get_absolute_url)
+
+class TestFailureSignature(models.Model):
+    test = models.OneToOneField(Test, primary_key=True, db_column="testid",
+                                related_name="failure_signature")
+    testrun = models.ForeignKey(TestRun, db_column="testrunid",
+                                related_name="failure_signatures")
+    signature = models.ForeignKey(FailureSignature, db_column="signatureid",
+                                  related_name="tests")
+    class Meta:
+        db_table = 'test_failure_signature'
+
 class TestRunEnvironmentDict(models.Model):
     id = models.IntegerField(null=False, primary_key=True, blank=True)
     containerid = models.ForeignKey(TestRun, db_column="containerid",
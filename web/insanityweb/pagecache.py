@@ -0,0 +1,89 @@
+"""
+Cache of the rendered pages of finished testruns.
+
+The data of a testrun never changes once it has a stoptime, so the pages
+showing it are cached in memory and, if INSANITY_PAGE_CACHE_DIR is set, in
+files. Cache keys contain the modification time of the database, which
+is updated when testruns are merged into it.
+"""
+
+import hashlib
+from functools import wraps
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection
+from django.http import HttpResponse
+
+_memory_cache = get_cache('django.core.cache.backends.locmem.LocMemCache',
+                          LOCATION='insanity-pages')
+_file_cache = None
+if getattr(settings, "INSANITY_PAGE_CACHE_DIR", None):
+    _file_cache = get_cache('django.core.cache.backends.filebased.FileBasedCache',
+                            LOCATION=settings.INSANITY_PAGE_CACHE_DIR)
+
+def _get_timeout():
+    return getattr(settings, "INSANITY_PAGE_CACHE_TIMEOUT", 24 * 3600)
+
+def _get_database_generation():
+    """Returns the modification time of the database"""
+    cur = connection.cursor()
+    cur.execute("SELECT MAX(modificationtime) FROM version")
+    res = cur.fetchone()
+    if not res:
+        return 0
+    return res[0] or 0
+
+def _get_key(testrunid, request):
+    path = hashlib.md5(request.get_full_path()).hexdigest()
+    return "insanity-page-%d-%s-%s" % (testrunid, _get_database_generation(),
+                                       path)
+
+def _get(key):
+    res = _memory_cache.get(key)
+    if res == None and _file_cache != None:
+        res = _file_cache.get(key)
+        if res != None:
+            _memory_cache.set(key, res, _get_timeout())
+    return res
+
+def _set(key, value):
+    _memory_cache.set(key, value, _get_timeout())
+    if _file_cache != None:
+        _file_cache.set(key, value, _get_timeout())
+
+def cache_finished_testrun(get_testrun):
+    """
+    Caches the responses of the decorated view if they are about a
+    finished testrun.
+
+    get_testrun will be called with the arguments of the view (minus the
+    request) and should return the TestRun the page is about, or None.
+
+    @cache_finished_testrun(lambda testrun_id: TestRun.objects.get(pk=testrun_id))
+    def a_view(request, testrun_id):
+        ...
+    """
+    def outer(f):
+        @wraps(f)
+        def inner_cache(request, *args, **kwargs):
+            if request.method != "GET":
+                return f(request, *args, **kwargs)
+            try:
+                testrun = get_testrun(*args, **kwargs)
+            except ObjectDoesNotExist:
+                testrun = None
+            if testrun == None or testrun.stoptime == None:
+                # still running (or doesn't exist), don't cache
+                return f(request, *args, **kwargs)
+            key = _get_key(testrun.id, request)
+            cached = _get(key)
+            if cached != None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+            r = f(request, *args, **kwargs)
+            if r.status_code == 200:
+                _set(key, (r.content, r['Content-Type']))
+            return r
+        return inner_cache
+    return outer
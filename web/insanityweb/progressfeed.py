@@ -0,0 +1,162 @@
+"""
+Live progress feed of the runner's current test run.
+
+The feed is updated from the GLib main loop by the TestRun/Test signals
+and read from the HTTP threads. Updates are coalesced: the signal
+handlers only mark the feed as dirty, and a snapshot is published at
+most every PROGRESS_FEED_INTERVAL milliseconds, so bursts of check
+events don't wake up the clients for each of them.
+"""
+
+from collections import deque
+import threading
+import time
+
+import gobject
+
+PROGRESS_FEED_INTERVAL = 250
+PROGRESS_FEED_FAILURES = 10
+
+class ProgressFeed(object):
+    """
+    Versioned snapshots of the progress of the current test run.
+
+    Clients call wait() with the last version they have seen and get the
+    next snapshot as soon as it is published.
+    """
+
+    def __init__(self, interval=PROGRESS_FEED_INTERVAL,
+                 nbfailures=PROGRESS_FEED_FAILURES):
+        self._interval = interval
+        self._cond = threading.Condition()
+        self._version = 0
+        self._snapshot = {"running": False}
+        self._dirty = False
+        self._timer = None
+        self._reset()
+        self._failures = deque(maxlen=nbfailures)
+
+    def _reset(self):
+        self._run = None
+        self._name = None
+        self._slots = {}
+        self._starttime = None
+        self._nbdone = 0
+        self._nbfailed = 0
+        self._progress = 0
+
+    # called from the main loop
+
+    def run_started(self, run, name):
+        self._reset()
+        self._run = run
+        self._name = name
+        self._starttime = time.time()
+        self._failures.clear()
+        self._dirty = True
+        if self._timer is None:
+            self._timer = gobject.timeout_add(self._interval, self._flush)
+        self._flush()
+
+    def test_started(self, test, iteration):
+        slot = self._slots.get(test)
+        if slot is None:
+            slot = self._slots[test] = {
+                "test": test.getTestName(),
+                "uri": test.arguments.get("uri"),
+                "started": time.time(),
+                "checks": 0,
+                }
+        slot["iteration"] = iteration
+        self._dirty = True
+
+    def test_checked(self, test, progress):
+        slot = self._slots.get(test)
+        if slot is not None:
+            slot["checks"] += 1
+        self._progress = progress
+        self._dirty = True
+
+    def test_done(self, test):
+        self._slots.pop(test, None)
+        self._nbdone += 1
+        pct = test.getSuccessPercentage()
+        if pct < 100.0:
+            self._nbfailed += 1
+            self._failures.appendleft({
+                "test": test.getTestName(),
+                "uri": test.arguments.get("uri"),
+                "success": pct,
+                "time": int(time.time()),
+                })
+        self._dirty = True
+
+    def run_done(self):
+        if self._timer is not None:
+            gobject.source_remove(self._timer)
+            self._timer = None
+        self._reset()
+        self._dirty = True
+        self._flush()
+
+    def _flush(self):
+        if self._dirty:
+            self._dirty = False
+            self._publish(self._build())
+        return self._timer is not None
+
+    def _build(self):
+        if self._run is None:
+            return {"running": False,
+                    "failures": list(self._failures)}
+        now = time.time()
+        total = self._run.getCurrentBatchLength()
+        elapsed = now - self._starttime
+        throughput = None
+        eta = None
+        if self._nbdone and elapsed > 0:
+            throughput = self._nbdone * 60.0 / elapsed
+            if total:
+                eta = int(max(total - self._nbdone, 0) * elapsed / self._nbdone)
+        slots = []
+        for slot in self._slots.itervalues():
+            slot = dict(slot)
+            slot["elapsed"] = int(now - slot.pop("started"))
+            slots.append(slot)
+        return {
+            "running": True,
+            "test": self._name,
+            "progress": self._progress,
+            "elapsed": int(elapsed),
+            "tests-done": self._nbdone,
+            "tests-failed": self._nbfailed,
+            "tests-total": total,
+            "throughput": throughput,
+            "eta": eta,
+            "slots": slots,
+            "failures": list(self._failures),
+            }
+
+    def _publish(self, snapshot):
+        self._cond.acquire()
+        try:
+            self._version += 1
+            self._snapshot = snapshot
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    # called from any thread
+
+    def wait(self, since=0, timeout=None):
+        """
+        Returns (version, snapshot) once a snapshot newer than <since> is
+        available, or the current one after <timeout> seconds.
+        """
+        self._cond.acquire()
+        try:
+            if self._version <= since:
+                self._cond.wait(timeout)
+            return self._version, self._snapshot
+        finally:
+            self._cond.release()
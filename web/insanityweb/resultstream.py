@@ -0,0 +1,142 @@
+"""
+Streaming of the results of a testrun.
+
+The tests are read in batches (using the test id as key) and the related
+dictionnaries are fetched for a whole batch at once, so that the memory
+used doesn't depend on the size of the testrun.
+"""
+
+from django.db import connection
+from insanity.storage.outputstore import resolve_output_file
+
+# number of tests read at once
+BATCH_SIZE = 200
+
+_DICT_QUERIES = {
+    "arguments" : """SELECT v.containerid, d.name, v.intvalue, v.txtvalue
+    FROM test_arguments_dict v, testclassinfo_arguments_dict d
+    WHERE v.name=d.id AND v.containerid IN (%s)""",
+    "checklist" : """SELECT v.containerid, d.name, v.intvalue, NULL
+    FROM test_checklist_list v, testclassinfo_checklist_dict d
+    WHERE v.name=d.id AND v.containerid IN (%s)""",
+    "extrainfo" : """SELECT v.containerid, d.name, v.intvalue, v.txtvalue
+    FROM test_extrainfo_dict v, testclassinfo_extrainfo_dict d
+    WHERE v.name=d.id AND v.containerid IN (%s)""",
+    "outputfiles" : """SELECT v.containerid, d.name, NULL, v.txtvalue
+    FROM test_outputfiles_dict v, testclassinfo_outputfiles_dict d
+    WHERE v.name=d.id AND v.containerid IN (%s)""",
+    }
+
+def _fetch_all(instruction, args):
+    cur = connection.cursor()
+    cur.execute(instruction, args)
+    return cur.fetchall()
+
+def _fill_dicts(entries, outputroot=None):
+    """
+    Fills the arguments/checklist/extrainfo/outputfiles dictionnaries of
+    the given entries (dictionnary of test id to test dictionnary).
+
+    outputroot : the directory the output files are relative to, if any
+    """
+    ids = entries.keys()
+    if not ids:
+        return
+    placeholders = ", ".join(["%s"] * len(ids))
+    for dictname, query in _DICT_QUERIES.iteritems():
+        for containerid, name, intvalue, txtvalue in _fetch_all(query % placeholders, ids):
+            if intvalue != None:
+                value = intvalue
+            else:
+                value = txtvalue
+            if dictname == "outputfiles":
+                value = resolve_output_file(value, outputroot=outputroot)
+            entries[containerid][dictname][name] = value
+
+def _new_entry(testid, testtype, resultpercentage):
+    return {"id" : testid,
+            "type" : testtype,
+            "resultpercentage" : resultpercentage,
+            "arguments" : {},
+            "checklist" : {},
+            "extrainfo" : {},
+            "outputfiles" : {}}
+
+def iter_testrun_tests(testrunid, failedonly=False, testtype=None,
+                       checkitem=None, checkvalue=0, batchsize=BATCH_SIZE):
+    """
+    Yields a dictionnary for each (non-monitor) test of the given testrun,
+    ordered by test id, containing:
+    * id, type, resultpercentage, parentid, isscenario
+    * arguments, checklist, extrainfo, outputfiles : dictionnaries
+    * monitors : list of dictionnaries with the same information for each
+    monitor of the test
+
+    failedonly : only return tests which didn't fully succeed
+    testtype : only return tests of that type
+    checkitem : only return tests where the given check item has the
+    value checkvalue (None for skipped items)
+    """
+    searchstr = """SELECT test.id, testclassinfo.type, test.resultpercentage,
+    test.parentid, test.isscenario
+    FROM test, testclassinfo
+    WHERE test.type=testclassinfo.id AND test.testrunid=%s
+    AND test.ismonitor=0 AND test.id>%s """
+    searchargs = []
+    if failedonly:
+        searchstr += "AND test.resultpercentage<>100.0 "
+    if testtype != None:
+        searchstr += "AND testclassinfo.type=%s "
+        searchargs.append(testtype)
+    if checkitem != None:
+        searchstr += """AND EXISTS (SELECT 1
+        FROM test_checklist_list, testclassinfo_checklist_dict
+        WHERE test_checklist_list.containerid=test.id
+        AND test_checklist_list.name=testclassinfo_checklist_dict.id
+        AND testclassinfo_checklist_dict.name=%s """
+        searchargs.append(checkitem)
+        if checkvalue == None:
+            searchstr += "AND test_checklist_list.intvalue IS NULL) "
+        else:
+            searchstr += "AND test_checklist_list.intvalue=%s) "
+            searchargs.append(checkvalue)
+    searchstr += "ORDER BY test.id LIMIT %d" % batchsize
+
+    monitorstr = """SELECT test.id, testclassinfo.type, test.resultpercentage,
+    test.parentid
+    FROM test, testclassinfo
+    WHERE test.type=testclassinfo.id AND test.ismonitor=1
+    AND test.parentid IN (%s)
+    ORDER BY test.id"""
+
+    # the output files of sharded testruns are stored relative to it
+    res = _fetch_all("""SELECT txtvalue FROM testrun_environment_dict
+    WHERE containerid=%s AND name=%s""", [testrunid, "output-files-root"])
+    outputroot = res and res[0][0] or None
+
+    lastid = -1
+    while True:
+        rows = _fetch_all(searchstr, [testrunid, lastid] + searchargs)
+        if not rows:
+            break
+        lastid = rows[-1][0]
+        tests = []
+        entries = {}
+        for testid, ttype, resperc, parentid, isscenario in rows:
+            entry = _new_entry(testid, ttype, resperc)
+            entry["parentid"] = parentid
+            entry["isscenario"] = bool(isscenario)
+            entry["monitors"] = []
+            entries[testid] = entry
+            tests.append(entry)
+        placeholders = ", ".join(["%s"] * len(tests))
+        for mid, mtype, resperc, parentid in _fetch_all(monitorstr % placeholders,
+                                                         [x["id"] for x in tests]):
+            entry = _new_entry(mid, mtype, resperc)
+            entries[parentid]["monitors"].append(entry)
+            entries[mid] = entry
+        _fill_dicts(entries, outputroot)
+        for entry in tests:
+            yield entry
+        if len(rows) < batchsize:
+            break
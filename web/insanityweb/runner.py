@@ -9,7 +9,72 @@ from insanity.generators.filesystem import URIFileSystemGenerator
 from insanity.storage.sqlite import SQLiteStorage
 from insanity.log import debug
 
+from insanityweb.progressfeed import ProgressFeed
+
 import gobject
+import threading
+from functools import wraps
+
+# how long (in seconds) a call from another thread waits for the main loop
+MAIN_LOOP_CALL_TIMEOUT = 10
+
+class MainLoopUnavailable(Exception):
+    """
+    Raised when a call couldn't be done from the main loop, because it
+    is busy or not running anymore.
+    """
+    pass
+
+def in_main_loop(f):
+    """
+    Decorator for Runner methods which need to be called from the main
+    loop thread (the one which created the Runner).
+
+    When called from another thread (i.e. the HTTP server threads), the
+    call is done from the main loop and the result waited for. If the
+    main loop doesn't get to it within MAIN_LOOP_CALL_TIMEOUT seconds,
+    or is quitting, the call is cancelled and MainLoopUnavailable is
+    raised.
+    """
+    @wraps(f)
+    def wrapper(self, *args, **kwargs):
+        if threading.currentThread() is self._main_thread:
+            return f(self, *args, **kwargs)
+        if self._quitting:
+            raise MainLoopUnavailable("The runner is quitting")
+        done = threading.Event()
+        lock = threading.Lock()
+        result = {}
+        def idle_call():
+            lock.acquire()
+            try:
+                if result.get("cancelled"):
+                    return False
+                result["started"] = True
+            finally:
+                lock.release()
+            try:
+                result["value"] = f(self, *args, **kwargs)
+            except Exception, e:
+                result["error"] = e
+            done.set()
+            return False
+        gobject.idle_add(idle_call)
+        done.wait(MAIN_LOOP_CALL_TIMEOUT)
+        if not done.isSet():
+            lock.acquire()
+            try:
+                if not result.get("started"):
+                    result["cancelled"] = True
+                    raise MainLoopUnavailable("The runner main loop is busy")
+            finally:
+                lock.release()
+            # it's running now, it won't be long
+            done.wait()
+        if "error" in result:
+            raise result["error"]
+        return result.get("value")
+    return wrapper
 
 # Custom insanity test client. Extends the
 # insanity TesterClient to split the "stop test" and "quit
@@ -23,10 +88,10 @@ class Client(TesterClient):
 
     __software_name__ = 'Insanity web service'
 
-    def __init__(self, runner):
+    def __init__(self, runner, **kwargs):
         self.runner = runner
         self.current_run = None
-        super(Client, self).__init__(singlerun=True)
+        super(Client, self).__init__(singlerun=True, **kwargs)
 
     def stop(self):
         debug("Stopping...")
@@ -35,8 +100,7 @@ class Client(TesterClient):
             return
         self._running = False
         try:
-            if self._current:
-                self._current.abort()
+            self._abortCurrents()
         except Exception, e:
             debug("Exception while aborting the current test: " + str(e))
 
@@ -72,9 +136,11 @@ class Client(TesterClient):
         if iteration == 1:
             debug("Test started: " + repr(test))
             test.connect('check', self.test_check_cb)
+        self.runner.feed.test_started(test, iteration)
 
     def single_test_done_cb(self, run, test):
         debug("Test done: " + repr(test))
+        self.runner.feed.test_done(test)
 
     def test_check_cb(self, test, item, validated):
         run = self.current_run
@@ -84,16 +150,28 @@ class Client(TesterClient):
 
         pct = int((100.0 * run_index + test_pct) / run_length)
         self.runner.test_progress_cb(run, test, pct, test_pct)
+        self.runner.feed.test_checked(test, pct)
 
 class Runner(object):
 
     _singleton = None
 
-    def __init__(self):
+    def __init__(self, maxnbtests=1, **kwargs):
+        """
+        maxnbtests : maximum number of tests of a run running at the same
+        time.
+        The other keyword arguments are given to the TesterClient (maxslots,
+        maxload, minmemory, isolation).
+        """
         assert Runner._singleton is None, "Please use get_runner()."
         Runner._singleton = self
 
-        self.client = Client(self)
+        self._main_thread = threading.currentThread()
+        # set once quit() was called, the main loop stops
+        self._quitting = False
+        self._maxnbtests = maxnbtests
+        self.feed = ProgressFeed()
+        self.client = Client(self, **kwargs)
         self._clear_info()
 
         storage = SQLiteStorage(path=settings.DATABASES['default']['NAME'])
@@ -113,8 +191,9 @@ class Runner(object):
         tests.extend(t.__test_name__ for t in insanity.utils.list_available_scenarios())
         return tests
 
+    @in_main_loop
     def start_test(self, test, folder, extra_arguments):
-        self.run = TestRun(maxnbtests=1)
+        self.run = TestRun(maxnbtests=self._maxnbtests)
         self.test_metadata = insanity.utils.get_test_metadata(test)
         args = {
             'uri': URIFileSystemGenerator(paths=[folder], recursive=True)
@@ -128,9 +207,11 @@ class Runner(object):
         self.current_run_progress = 0
         self.test_name = test
         self.test_folder = folder
+        self.feed.run_started(self.run, test)
         debug("Running test: " + test)
         self.client.run()
 
+    @in_main_loop
     def stop_test(self):
         debug("Stopping test")
         self.client.stop()
@@ -143,6 +224,7 @@ class Runner(object):
 
     def test_run_done(self):
         debug("Test run done")
+        self.feed.run_done()
         self._clear_info()
         self.client.clearTestRuns()
 
@@ -155,11 +237,17 @@ class Runner(object):
     def get_test_folder(self):
         return self.test_folder
 
+    @in_main_loop
     def quit(self):
+        self._quitting = True
         self.client.quit()
 
-def get_runner():
-    """Get (or create) the Runner singleton."""
+def get_runner(**kwargs):
+    """
+    Get (or create) the Runner singleton.
+
+    The keyword arguments are only used to create it (see Runner).
+    """
     if Runner._singleton is None:
-        Runner()
+        Runner(**kwargs)
     return Runner._singleton
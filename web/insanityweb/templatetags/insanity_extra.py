@@ -1,7 +1,7 @@
 import os.path
-import math
 from django import template
 from django.utils.html import escape
+from insanity.storage.outputstore import resolve_output_file
 
 register = template.Library()
 
@@ -15,6 +15,24 @@ def test_arg_value(parser, token):
 
     return TestArgValueNode(arg_name)
 
+@register.filter
+def output_file_path(value, outputroot=None):
+    """
+    Full path of an output file stored relative to the output root of its
+    testrun
+    """
+    return resolve_output_file(value, outputroot=outputroot)
+
+@register.filter
+def output_file_url_path(value, outputroot=None):
+    """
+    Path of an output file relative to the outputfiles directory served
+    at ONLINE_OUTPUTFILES_URL
+    """
+    if outputroot and not os.path.isabs(value):
+        return os.path.join(os.path.basename(outputroot), value)
+    return os.path.basename(value)
+
 @register.simple_tag
 def verticalize(toparse):
     return "<br>".join([a[0].capitalize() for a in toparse.split('-')])
@@ -167,50 +185,26 @@ def test_extrainfo_dict(test):
 @register.inclusion_tag('insanityweb/matrix_checklist_row.html')
 def matrix_checklist_row(test, fullchecklist, fullarguments,
                          allchecks, allargs, allextrainfo):
-    args = test._get_full_arguments(fullarguments, allargs.get(test, []))
-    checks = allchecks.get(test, [])
-    test_error = test._test_error(allextras=allextrainfo.get(test, []))
+    args = test._get_full_arguments(fullarguments, allargs.get(test.id, []))
+    checks = allchecks.get(test.id, [])
+    test_error = test._test_error(allextras=allextrainfo.get(test.id, []))
     return {'test':test,
             'arguments':args,
             'results':checks,
             'test_error':test_error}
 
 @register.inclusion_tag('insanityweb/matrix_navigation.html', takes_context=True)
-def matrix_navigation(context, adjacent_pages=2):
-    testrun = context['testrun']
-    currentoffset = context.get('offset', 0)
-    limit = context.get('limit', 100)
-    onlyfailed = context.get('onlyfailed', 0)
-    showscenario = context.get('showscenario', 1)
-    crashonly = context.get('crashonly', 0)
-    timedoutonly = context.get('timedoutonly', 0)
-    totalnb = context["totalnb"]
-
-    # This creates a navigation <div> for the given page
-    # for the time being we just calculate the offset for the
-    # previous and next series
-    totalpages = int(math.ceil(float(totalnb) / limit))
-    pages = []
-    for i in range(totalpages):
-        d = {}
-        d["index"] = i
-        d["iscurrent"] = (currentoffset == limit * i)
-        d["offset"] = limit * i
-        pages.append(d)
-    if len(pages) == 1:
-        # Everything fits on one page, no pagination needed:
-        pages = []
-
-    poff = currentoffset - limit
-    noff = currentoffset + limit
-    return {'testrun':testrun,
-            'prevoffset':poff,
-            'limit':limit,
-            'currentoffset':currentoffset,
-            'nextoffset':noff,
-            'onlyfailed':onlyfailed,
-            'showscenario':showscenario,
-            'crashonly':crashonly,
-            'timedoutonly':timedoutonly,
-            'pages':pages
+def matrix_navigation(context):
+    # This creates a navigation <div> for the given page, using the
+    # first/last test ids of the current page for the previous/next pages
+    return {'testrun':context['testrun'],
+            'limit':context.get('limit', 100),
+            'onlyfailed':context.get('onlyfailed', 0),
+            'showscenario':context.get('showscenario', 1),
+            'crashonly':context.get('crashonly', 0),
+            'timedoutonly':context.get('timedoutonly', 0),
+            'firstid':context.get('firstid'),
+            'lastid':context.get('lastid'),
+            'hasprev':context.get('hasprev', False),
+            'hasnext':context.get('hasnext', False)
             }
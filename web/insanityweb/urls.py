@@ -3,10 +3,18 @@ from django.conf.urls.defaults import *
 urlpatterns = patterns('web.insanityweb.views',
                        (r'^$', 'index'),
                        (r'^current/progress.json$', 'current_progress'),
+                       (r'^current/progress/feed.json$', 'current_progress_feed'),
+                       (r'^current/progress/events$', 'current_progress_events'),
                        (r'^current/stop/$', 'stop_current'),
                        (r'^current/$', 'current'),
                        (r'^testrun/(?P<testrun_id>\d+)/$', 'testrun_summary'),
+                       (r'^testrun/(?P<testrun_id>\d+)/tests.json$', 'testrun_tests'),
+                       (r'^testrun/(?P<testrun_id>\d+)/tests.ndjson$', 'testrun_tests',
+                        {'fmt': 'ndjson'}),
+                       (r'^testrun/(?P<testrun_id>\d+)/failures/$', 'testrun_failures'),
                        (r'^test/(?P<test_id>\d+)/$', 'test_summary'),
+                       (r'^outputfile/(?P<digest>[0-9a-f]{40})/$', 'output_file'),
+                       (r'^failure/(?P<signature_id>\d+)/$', 'failure_signature'),
                        (r'^matrix/(?P<testrun_id>\d+)/$', 'matrix_view'),
                        (r'^available_tests/$', 'available_tests')
 #     (r'^(?P<poll_id>\d+)/$', 'detail'),
@@ -1,14 +1,54 @@
-from web.insanityweb.models import TestRun, Test, TestClassInfo, TestCheckListList, TestArgumentsDict, TestExtraInfoDict
+from web.insanityweb.models import TestRun, TestRunSummary, Test, TestClassInfo, TestCheckListList, TestArgumentsDict, TestExtraInfoDict, FailureSignature, TestFailureSignature
 from django.shortcuts import render_to_response, get_object_or_404, redirect
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
 
-from insanityweb.runner import get_runner
+from insanityweb.runner import get_runner, MainLoopUnavailable
+from insanityweb.pagecache import cache_finished_testrun
+from insanityweb.resultstream import iter_testrun_tests
 from django.utils.encoding import smart_str
 
 from functools import wraps
 from django.utils import simplejson as json
-from settings import ONLINE_OUTPUTFILES_URL
+from settings import ONLINE_OUTPUTFILES_URL, INSANITY_OUTPUT_STORE
+from insanity.storage.outputstore import OutputStore
+
+import os
+import time
+
+# how long (in seconds) the number of tests matching the matrix filters
+# is cached for finished testruns without summary
+MATRIX_TOTAL_CACHE_TIMEOUT = 3600
+
+# how long (in seconds) a progress feed request waits for an update, and
+# how long an event stream stays open
+PROGRESS_POLL_TIMEOUT = 20
+PROGRESS_EVENTS_DURATION = 300
+
+# size of the chunks the output files are sent in
+OUTPUT_FILE_CHUNK_SIZE = 65536
+
+def is_stream_request(request):
+    """
+    Returns True if the request is served by its own thread (see the
+    daemon command), and can be kept open without holding a thread of
+    the pool. The other requests for the progress feed are answered
+    right away, and the clients poll again.
+    """
+    return request.META.get('insanity.stream', False)
+
+def checklist_list_required(f):
+    """
+    Decorates the views reading the checklists, which aren't available
+    if the storing DBStorage only keeps them as bitmaps.
+    """
+    @wraps(f)
+    def inner_checklist(request, *args, **kwargs):
+        TestCheckListList.objects.check_supported()
+        return f(request, *args, **kwargs)
+    return inner_checklist
 
 def index(request):
     nbruns = request.GET.get("nbruns", 20)
@@ -16,6 +56,7 @@ def index(request):
     return render_to_response("insanityweb/index.html", {"latest_runs":latest_runs,
                                                       "nbruns":nbruns})
 
+@cache_finished_testrun(lambda testrun_id: TestRun.objects.get(pk=testrun_id))
 def testrun_summary(request, testrun_id):
     toplevel_only = bool(int(request.GET.get("toplevel",True)))
     tr = get_object_or_404(TestRun, pk=testrun_id)
@@ -23,6 +64,8 @@ def testrun_summary(request, testrun_id):
                               {'testrun': tr,
                                'toplevel_only': toplevel_only})
 
+@cache_finished_testrun(lambda test_id: Test.objects.select_related("testrunid").get(pk=test_id).testrunid)
+@checklist_list_required
 def test_summary(request, test_id):
     tr = get_object_or_404(Test, pk=test_id)
     if ONLINE_OUTPUTFILES_URL:
@@ -31,7 +74,86 @@ def test_summary(request, test_id):
         log_base = None
 
     return render_to_response('insanityweb/test_summary.html', {'test': tr,
-            'logs_base':log_base})
+            'logs_base':log_base,
+            'output_root':tr.testrunid.output_root})
+
+def _iter_file(f, head=""):
+    # head : the data already read from f
+    try:
+        if head:
+            yield head
+        while True:
+            chunk = f.read(OUTPUT_FILE_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+def output_file(request, digest):
+    """
+    Contents of an output file moved to the OutputStore
+
+    The file is streamed, and compressed files are sent as they are
+    stored to the clients accepting gzip.
+    """
+    if not INSANITY_OUTPUT_STORE:
+        raise Http404
+    store = OutputStore(INSANITY_OUTPUT_STORE)
+    path = store.lookup(digest)
+    f = store.open(digest)
+    if f is None:
+        raise Http404
+    try:
+        head = f.read(OUTPUT_FILE_CHUNK_SIZE)
+    except IOError:
+        f.close()
+        raise Http404
+    if "\0" in head:
+        content_type = "application/octet-stream"
+    else:
+        content_type = "text/plain"
+    gzipped = path.endswith(".gz") and \
+              "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+    if gzipped:
+        f.close()
+        f = open(path, "rb")
+        head = ""
+    r = HttpResponse(_iter_file(f, head), content_type=content_type)
+    if gzipped:
+        r["Content-Encoding"] = "gzip"
+        r["Content-Length"] = str(os.path.getsize(path))
+    return r
+
+@cache_finished_testrun(lambda testrun_id: TestRun.objects.get(pk=testrun_id))
+def testrun_failures(request, testrun_id):
+    """ Failures of a testrun grouped by signature """
+    tr = get_object_or_404(TestRun, pk=testrun_id)
+    counts = TestFailureSignature.objects.filter(testrun=tr).values("signature").annotate(nbtests=Count("test")).order_by("-nbtests", "signature")
+    sids = [c["signature"] for c in counts]
+    signatures = FailureSignature.objects.in_bulk(sids)
+    nbruns = dict([(c["signature"], c["nbruns"]) for c in
+                   TestFailureSignature.objects.filter(signature__in=sids).values("signature").annotate(nbruns=Count("testrun", distinct=True))])
+    groups = [(signatures[c["signature"]], c["nbtests"], nbruns[c["signature"]])
+              for c in counts]
+    return render_to_response('insanityweb/testrun_failures.html',
+                              {'testrun': tr,
+                               'groups': groups})
+
+def failure_signature(request, signature_id):
+    """ Testruns and tests sharing a failure signature """
+    signature = get_object_or_404(FailureSignature, pk=signature_id)
+    testruns = signature.tests.values("testrun").annotate(nbtests=Count("test")).order_by("-testrun")
+    testrun_id = request.GET.get("testrun", None)
+    tests = None
+    if testrun_id and testrun_id.isdigit():
+        tests = Test.objects.filter(failure_signature__signature=signature,
+                                    testrunid=int(testrun_id)).select_related("type")
+    return render_to_response('insanityweb/failure_signature.html',
+                              {'signature': signature,
+                               'testruns': testruns,
+                               'testrun_id': testrun_id,
+                               'tests': tests})
 
 def available_tests(request):
     """ Returns a tree of all available tests """
@@ -39,6 +161,39 @@ def available_tests(request):
     return render_to_response('insanityweb/available_tests.html',
                               {"classinfos": classinfos})
 
+def _matrix_total(tr, testsinst, onlyfailed, showscenario, crashonly,
+                  timedoutonly):
+    """
+    Returns the total number of tests matching the matrix filters.
+
+    Uses the testrun summary if available, else the count is cached
+    for finished testruns.
+    """
+    if showscenario:
+        try:
+            summary = tr.summary
+        except TestRunSummary.DoesNotExist:
+            summary = None
+        if summary:
+            # crashed and timed out tests are always failed tests
+            if crashonly:
+                return summary.nbcrashed
+            if timedoutonly:
+                return summary.nbtimedout
+            if onlyfailed:
+                return summary.nbfailed
+            return summary.nbtests
+    key = "insanity-matrix-total-%d-%d%d%d%d" % (tr.id, onlyfailed, showscenario,
+                                                 crashonly, timedoutonly)
+    totalnb = cache.get(key)
+    if totalnb == None:
+        totalnb = testsinst.count()
+        if tr.stoptime:
+            cache.set(key, totalnb, MATRIX_TOTAL_CACHE_TIMEOUT)
+    return totalnb
+
+@cache_finished_testrun(lambda testrun_id: TestRun.objects.get(pk=testrun_id))
+@checklist_list_required
 def matrix_view(request, testrun_id):
     tr = get_object_or_404(TestRun, pk=testrun_id)
 
@@ -47,10 +202,12 @@ def matrix_view(request, testrun_id):
     crashonly = bool(int(request.GET.get("crashonly", False)))
     timedoutonly = bool(int(request.GET.get("timedoutonly", False)))
     limit = int(request.GET.get("limit", 100))
-    offset = int(request.GET.get("offset", 0))
+    # keyset pagination, 'after' and 'before' are test ids
+    after = request.GET.get("after")
+    before = request.GET.get("before")
 
     # let's get the test instances ...
-    testsinst = Test.objects.nomonitors().select_related("type", "parentid", "checklist").filter(testrunid=tr)
+    testsinst = Test.objects.nomonitors().filter(testrunid=tr)
 
     # and filter them according to the given parameters
     if onlyfailed:
@@ -68,73 +225,76 @@ def matrix_view(request, testrun_id):
         sctypes = TestClassInfo.objects.scenarios()
         testsinst = testsinst.exclude(type__in=sctypes)
 
-    tests = []
     # total number of potential results for this query
-    # FIXME : This should be cached
-    totalnb = testsinst.count()
-    res = list(testsinst[offset:offset+limit])
+    totalnb = _matrix_total(tr, testsinst, onlyfailed, showscenario,
+                            crashonly, timedoutonly)
+
+    # fetch one more test than needed to know if there's another page
+    page = testsinst.select_related("type")
+    if before:
+        res = list(page.filter(id__lt=int(before)).order_by("-id")[:limit + 1])
+        hasprev = len(res) > limit
+        res = res[:limit]
+        res.reverse()
+        hasnext = True
+    else:
+        if after:
+            page = page.filter(id__gt=int(after))
+        res = list(page.order_by("id")[:limit + 1])
+        hasnext = len(res) > limit
+        res = res[:limit]
+        hasprev = bool(after)
 
+    tests = []
     error_summary = {}
-    for t in res:
-        for r in t.checklist.all().select_related(depth=1):
-            if r.failure:
-                if r.name.id not in error_summary:
-                    error_summary[r.name.id] = {
-                        'name': r.name.name,
-                        'description': r.name.description,
+    if res != []:
+        ids = [x.id for x in res]
+
+        # return dictionnaries of:
+        # key : test id
+        # value : list of args/checks/extrainfos
+        checks = {}
+        for x in TestCheckListList.objects.select_related("name").filter(containerid__in=ids).order_by("name"):
+            checks.setdefault(x.containerid_id, []).append(x)
+            if x.failure:
+                if x.name_id not in error_summary:
+                    error_summary[x.name_id] = {
+                        'name': x.name.name,
+                        'description': x.name.description,
                         'count': 0
                     }
-                error_summary[r.name.id]['count'] += 1
+                error_summary[x.name_id]['count'] += 1
 
-    error_summary = error_summary.values()
-    error_summary.sort(key=lambda x: x['count'], reverse=True)
+        args = {}
+        for x in TestArgumentsDict.objects.filter(containerid__in=ids).order_by("name"):
+            args.setdefault(x.containerid_id, []).append(x)
 
-    if totalnb != 0 and res != []:
-        v = Test.objects.values_list("type",flat=True).filter(id__in=(x.id for x in res)).distinct()
+        extras = {}
+        for x in TestExtraInfoDict.objects.select_related("name").filter(containerid__in=ids,
+                                                                         name__name__in=["subprocess-return-code","errors"]):
+            extras.setdefault(x.containerid_id, []).append(x)
 
-        # get the TestClassInfo for the available tests
-        testtypes = set([x.type for x in res])
+        # get the TestClassInfo for the available tests, with the
+        # checklist and arguments of their whole parentage
+        testtypes = []
+        for x in res:
+            if not x.type in testtypes:
+                testtypes.append(x.type)
+        fullchecklists, fullarguments = TestClassInfo.objects.full_dicts(testtypes)
 
         for t in testtypes:
-            query = [x for x in res if x.type == t]
-
-            # skip empty sets early
-            if len(query) == 0:
-                continue
-
-            # return dictionnaries of:
-            # key : test
-            # value : list of args/checks/extrainfos
-            checks = {}
-            for x in TestCheckListList.objects.select_related("containerid__type","name","value").filter(containerid__in=query).order_by("name"):
-                if not x.containerid in checks.keys():
-                    checks[x.containerid] = [x]
-                else:
-                    checks[x.containerid].append(x)
-
-            args = {}
-            for x in TestArgumentsDict.objects.select_related("containerid__type", "name","intvalue","txtvalue","blobvalue").filter(containerid__in=query).order_by("name"):
-                if not x.containerid in args.keys():
-                    args[x.containerid] = [x]
-                else:
-                    args[x.containerid].append(x)
-
-            extras = {}
-            for x in TestExtraInfoDict.objects.select_related("containerid__type", "name__name", "intvalue", "txtvalue", "blobvalue").filter(containerid__in=query,
-                                                                                                                                       name__name__in=["subprocess-return-code","errors"]):
-                if not x.containerid in extras.keys():
-                    extras[x.containerid] = [x]
-                else:
-                    extras[x.containerid].append(x)
-
+            query = [x for x in res if x.type_id == t.id]
             tests.append({"type":t,
                           "tests":query,
-                          "fullchecklist":t.fullchecklist,
-                          "fullarguments":t.fullarguments,
+                          "fullchecklist":fullchecklists[t.type],
+                          "fullarguments":fullarguments[t.type],
                           "allchecks":checks,
                           "allargs":args,
                           "allextras":extras})
 
+    error_summary = error_summary.values()
+    error_summary.sort(key=lambda x: x['count'], reverse=True)
+
     return render_to_response('insanityweb/matrix_view.html',
                               {
         'testrun':tr,
@@ -144,7 +304,10 @@ def matrix_view(request, testrun_id):
         'showscenario':int(showscenario),
         'crashonly':int(crashonly),
         'timedoutonly':int(timedoutonly),
-        "offset":offset,
+        "firstid":res and res[0].id,
+        "lastid":res and res[-1].id,
+        "hasprev":hasprev,
+        "hasnext":hasnext,
         "limit":limit,
         'errorsummary': error_summary
         })
@@ -182,12 +345,117 @@ def render_to_json(**jsonargs):
         return inner_json
     return outer
 
+@checklist_list_required
+def testrun_tests(request, testrun_id, fmt="json"):
+    """
+    Streams all the tests of a testrun as JSON (fmt="json") or as
+    newline-delimited JSON (fmt="ndjson", one test per line).
+
+    Supported parameters:
+    * failedonly : only return failed tests
+    * type : only return tests of that type
+    * checkitem : only return tests where that check item has the value
+    'checkvalue' (default 0, i.e. failed). Use checkvalue=skipped for
+    skipped check items.
+    """
+    tr = get_object_or_404(TestRun, pk=testrun_id)
+    failedonly = bool(int(request.GET.get("failedonly", False)))
+    testtype = request.GET.get("type")
+    checkitem = request.GET.get("checkitem")
+    checkvalue = request.GET.get("checkvalue", "0")
+    if checkvalue == "skipped":
+        checkvalue = None
+    else:
+        checkvalue = int(checkvalue)
+    tests = iter_testrun_tests(tr.id, failedonly=failedonly, testtype=testtype,
+                               checkitem=checkitem, checkvalue=checkvalue)
+
+    def ndjson_chunks():
+        for test in tests:
+            yield json.dumps(test) + "\n"
+
+    def json_chunks():
+        yield '{"testrun": %d, "tests": [' % tr.id
+        sep = "\n"
+        for test in tests:
+            yield sep + json.dumps(test)
+            sep = ",\n"
+        yield "\n]}\n"
+
+    if fmt == "ndjson":
+        return HttpResponse(ndjson_chunks(), mimetype='application/x-ndjson')
+    return HttpResponse(json_chunks(), mimetype='application/json')
+
 @render_to_json()
 def current_progress(request):
     return {
         'progress': get_runner().get_progress()
     }
 
+@render_to_json()
+def current_progress_feed(request):
+    """
+    Long-poll variant of the progress feed: waits for a snapshot newer
+    than the 'since' version.
+    """
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        since = 0
+    timeout = 0
+    if is_stream_request(request):
+        timeout = PROGRESS_POLL_TIMEOUT
+    version, snapshot = get_runner().feed.wait(since, timeout)
+    return {
+        'version': version,
+        'progress': snapshot
+    }
+
+def current_progress_events(request):
+    """
+    Server-sent events variant of the progress feed.
+
+    The stream is closed after PROGRESS_EVENTS_DURATION seconds so that it
+    doesn't hold an HTTP thread forever, browsers reconnect on their own
+    with the Last-Event-ID header. If the request isn't served by its own
+    thread, only the latest update is sent before closing the stream, and
+    the browser polls again after the retry delay.
+    """
+    feed = get_runner().feed
+    try:
+        since = int(request.META.get('HTTP_LAST_EVENT_ID',
+                                     request.GET.get('since', 0)))
+    except ValueError:
+        since = 0
+
+    stream = is_stream_request(request)
+    timeout = 0
+    if stream:
+        timeout = PROGRESS_POLL_TIMEOUT
+
+    def events():
+        version = since
+        end = time.time() + PROGRESS_EVENTS_DURATION
+        yield "retry: 1000\n\n"
+        while time.time() < end:
+            newversion, snapshot = feed.wait(version, timeout)
+            if newversion != version:
+                version = newversion
+                yield "id: %d\ndata: %s\n\n" % (version, json.dumps(snapshot))
+            elif stream:
+                # keep the connection alive through proxies
+                yield ": \n\n"
+            if not stream:
+                return
+
+    r = HttpResponse(events(), mimetype='text/event-stream')
+    r['Cache-Control'] = 'no-cache'
+    return r
+
+def _runner_unavailable(e):
+    return HttpResponse("The test runner isn't available (%s), try again later.\n" % e,
+                        mimetype='text/plain', status=503)
+
 def current(request):
     runner = get_runner()
     test_names = runner.get_test_names()
@@ -197,8 +465,11 @@ def current(request):
         test = request.POST.get('test', '')
         folder = request.POST.get('folder', '')
         if test in test_names and folder in settings.INSANITY_TEST_FOLDERS:
-            runner.start_test(test, folder,
-                settings.INSANITY_TEST_FOLDERS[folder].get('extra-arguments', {}))
+            try:
+                runner.start_test(test, folder,
+                    settings.INSANITY_TEST_FOLDERS[folder].get('extra-arguments', {}))
+            except MainLoopUnavailable, e:
+                return _runner_unavailable(e)
         return redirect('web.insanityweb.views.current')
 
     progress = runner.get_progress()
@@ -209,5 +480,8 @@ def current(request):
 
 def stop_current(request):
     if 'submit' in request.POST:
-        get_runner().stop_test()
+        try:
+            get_runner().stop_test()
+        except MainLoopUnavailable, e:
+            return _runner_unavailable(e)
     return redirect('web.insanityweb.views.current')
@@ -7,9 +7,19 @@ DATA_PATH = os.path.join(PROJECT_PATH, '..')
 # Url of the online folder that containes all log files
 ONLINE_OUTPUTFILES_URL = "http:///there/are/the/outputfiles/"
 
+# Directory of the OutputStore the output files were moved to, if any
+INSANITY_OUTPUT_STORE = None
+
 # Url of the online directory that containes media files
 ONLINE_MEDIAS_URL = "http:///there/are/the/media/files/"
 
+# Directory in which the pages of finished testruns are cached, in addition
+# to the in-memory cache. Set to None to only cache them in memory.
+INSANITY_PAGE_CACHE_DIR = None
+
+# How long (in seconds) the pages of finished testruns are cached
+INSANITY_PAGE_CACHE_TIMEOUT = 24 * 3600
+
 if not os.access(DATA_PATH, os.W_OK):
     sys.stderr.write("%s is not writable. Trying xdg-data-path.\n" %
             DATA_PATH)